@@ -0,0 +1,289 @@
+import os
+from functools import partial
+import numpy as np
+import spek
+
+# ===================================
+# PIPELINE DE ANÁLISE (UMA DECODIFICAÇÃO, VÁRIOS ANALISADORES)
+# ===================================
+# Cada analisador guarda só um estado pequeno e implementa:
+#   consumir(mag)        -> bloco de magnitudes STFT (quadros x bins), opcional
+#   consumir_pcm(bloco)  -> bloco de PCM float32 mono, opcional
+#   resultado()          -> dict serializável em JSON
+ANALISADORES_ATIVOS = [a.strip() for a in os.getenv('VIBE_ANALISADORES', 'analysis,bpm,key,loudness,waveform').split(',') if a.strip()]
+
+BPM_MIN, BPM_MAX = 60, 200
+BPM_CONFIANCA_MIN = 0.05  # abaixo disso não há pulso (ambient, ruído, falas)
+LARGURA_WAVEFORM = 600
+NOTAS = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+# Perfis de Krumhansl-Kessler (maior/menor, a partir da tônica)
+PERFIL_MAIOR = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+PERFIL_MENOR = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+# Roda de Camelot (notação usada em Rekordbox/Serato/Mixed In Key)
+CAMELOT_MAIOR = ['8B', '3B', '10B', '5B', '12B', '7B', '2B', '9B', '4B', '11B', '6B', '1B']
+CAMELOT_MENOR = ['5A', '12A', '7A', '2A', '9A', '4A', '11A', '6A', '1A', '8A', '3A', '10A']
+
+# Filtro K da ITU-R BS.1770 (coeficientes de referência a 48 kHz)
+K_SHELF = ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585])
+K_HPF = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+
+
+class AnalisadorEspectrograma:
+    """Espectrograma PNG (ver spek.Espectrograma)."""
+
+    def __init__(self, sr, titulo, destino, pooling=spek.POOLING):
+        self.sr = sr
+        self.titulo = titulo
+        self.destino = destino
+        self._espectro = spek.Espectrograma(sr, pooling=pooling)
+
+    def consumir(self, mag):
+        self._espectro.consumir(mag)
+
+    def resultado(self):
+        db = self._espectro.matriz_db()
+        if db is None:
+            raise ValueError('Áudio vazio ou ilegível')
+        spek.renderizar_png(db, self.sr, self._espectro.duracao, self.titulo, self.destino)
+        return self.destino
+
+
+class DetectorDeBPM:
+    """Tempo por autocorrelação do fluxo espectral.
+
+    Estado: os últimos `max_lag` valores do envelope de onsets e o vetor de autocorrelação,
+    atualizado bloco a bloco com um único produto matriz-vetor.
+    """
+
+    def __init__(self, sr, hop=spek.HOP, janela_s=4.0):
+        self.fps = sr / hop
+        self.max_lag = int(janela_s * self.fps)
+        self._historico = np.zeros(self.max_lag, dtype=np.float64)
+        self._acf = np.zeros(self.max_lag + 1, dtype=np.float64)
+        self._anterior = None
+        self._quadros = 0
+        # Fluxo só até ~8 kHz (bumbo, caixa e hats; acima é ruído de codec)
+        self._bins = int(8000 / (sr / spek.N_FFT))
+
+    def consumir(self, mag):
+        log = np.log1p(100 * mag[:, :self._bins])
+        anterior = log[:1] if self._anterior is None else self._anterior
+        fluxo = np.maximum(np.diff(np.vstack([anterior, log]), axis=0), 0).sum(axis=1)
+        self._anterior = log[-1:]
+        fluxo -= fluxo.mean()  # remove o nível DC do bloco
+
+        serie = np.concatenate([self._historico, fluxo])
+        janelas = np.lib.stride_tricks.sliding_window_view(serie, self.max_lag + 1)
+        self._acf += janelas[:, -1] @ janelas[:, ::-1]
+        self._historico = serie[-self.max_lag:]
+        self._quadros += len(fluxo)
+
+    def _pico(self, lag):
+        """Refina um pico da autocorrelação por interpolação parabólica."""
+        lag = int(round(lag))
+        if lag <= 0 or lag >= self.max_lag:
+            return float(lag)
+        lag = lag - 1 + int(np.argmax(self._acf[lag - 1:lag + 2]))
+        if 0 < lag < self.max_lag:
+            a, b, c = self._acf[lag - 1:lag + 2]
+            denominador = a - 2 * b + c
+            if denominador:
+                return lag + 0.5 * (a - c) / denominador
+        return float(lag)
+
+    def resultado(self):
+        if self._quadros < self.max_lag or self._acf[0] <= 0:
+            return None
+        lags = np.arange(int(self.fps * 60 / BPM_MAX), int(self.fps * 60 / BPM_MIN) + 1)
+        bpms = 60 * self.fps / lags
+        # Preferência suave por tempos de pista (~120 BPM), como no librosa
+        peso = np.exp(-0.5 * (np.log2(bpms / 120)) ** 2)
+        candidato = lags[int(np.argmax(self._acf[lags] * peso))]
+        # Resolução: refina no pico de 4 batidas (quando cabe na janela)
+        multiplo = 4 if 4 * candidato < self.max_lag else 1
+        confianca = float(self._acf[candidato] / self._acf[0])
+        if confianca < BPM_CONFIANCA_MIN:
+            return None
+        lag = self._pico(candidato * multiplo) / multiplo
+        return {'bpm': round(float(60 * self.fps / lag), 1), 'confianca': round(confianca, 2)}
+
+
+class DetectorDeTom:
+    """Tonalidade por cromagrama acumulado + perfis de Krumhansl-Kessler."""
+
+    def __init__(self, sr, n_fft=spek.N_FFT, fmin=100.0, fmax=5000.0):
+        freqs = np.arange(n_fft // 2 + 1) * sr / n_fft
+        self._sel = np.nonzero((freqs >= fmin) & (freqs <= fmax))[0]
+        classes = np.round(12 * np.log2(freqs[self._sel] / 440.0)).astype(int) % 12
+        classes = (classes + 9) % 12  # A=9 -> C=0
+        self._mapa = np.zeros((len(self._sel), 12), dtype=np.float32)
+        self._mapa[np.arange(len(self._sel)), classes] = 1
+        self._croma = np.zeros(12, dtype=np.float64)
+
+    def consumir(self, mag):
+        self._croma += mag[:, self._sel].sum(axis=0) @ self._mapa
+
+    def resultado(self):
+        if not self._croma.any():
+            return None
+        croma = (self._croma - self._croma.mean()) / (self._croma.std() or 1)
+        melhor = None
+        for tonica in range(12):
+            for modo, perfil in (('major', PERFIL_MAIOR), ('minor', PERFIL_MENOR)):
+                r = float(np.corrcoef(croma, np.roll(perfil, tonica))[0, 1])
+                if melhor is None or r > melhor[0]:
+                    melhor = (r, tonica, modo)
+        r, tonica, modo = melhor
+        return {
+            'key': f"{NOTAS[tonica]} {modo}",
+            'camelot': (CAMELOT_MAIOR if modo == 'major' else CAMELOT_MENOR)[tonica],
+            'confianca': round(r, 2),
+        }
+
+
+def _resposta_biquad(coef, freqs, sr_ref=48000):
+    b, a = coef
+    z = np.exp(-1j * 2 * np.pi * freqs / sr_ref)
+    return np.abs((b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)) ** 2
+
+
+class Loudness:
+    """Loudness integrado (LUFS, BS.1770) e pico de amostra.
+
+    O filtro K é aplicado no domínio da frequência sobre os quadros da STFT (Parseval);
+    os blocos de 400 ms com gating vão para um histograma de 0,01 LU, então a memória
+    não cresce com a duração. Aproximação: o downmix mono do FFmpeg, (L+R)/√2, equivale à
+    soma de canais da norma para estéreo correlacionado (caso típico de pista); com
+    canais descorrelacionados o valor sai até 3 LU abaixo. O pico só desconta o √2
+    quando a origem é estéreo (`canais` == 2): mono não passa pelo downmix.
+    """
+
+    def __init__(self, sr, n_fft=spek.N_FFT, hop=spek.HOP, canais=2):
+        freqs = np.minimum(np.arange(n_fft // 2 + 1) * sr / n_fft, 23999.0)
+        peso = _resposta_biquad(K_SHELF, freqs) * _resposta_biquad(K_HPF, freqs)
+        peso[1:-1] *= 2  # bins espelhados do espectro completo
+        self._peso = (peso / (n_fft * float(np.sum(spek.JANELA ** 2)))).astype(np.float32)
+        self._quadros_bloco = max(int(round(0.4 * sr / hop)), 1)
+        self._passo = max(int(round(0.1 * sr / hop)), 1)
+        self._pendentes = np.zeros(0, dtype=np.float64)
+        self._contagem = np.zeros(7501, dtype=np.int64)  # -70.00 .. +5.00 LUFS
+        self._soma = np.zeros(7501, dtype=np.float64)
+        self._pico = 0.0
+        self._ganho_downmix = np.sqrt(2) if canais == 2 else 1.0
+
+    def consumir_pcm(self, bloco):
+        if len(bloco):
+            # Desfaz o ganho de √2 do downmix estéreo para estimar o pico por canal
+            self._pico = max(self._pico, float(np.abs(bloco).max()) / self._ganho_downmix)
+
+    def consumir(self, mag):
+        potencia = (mag * mag) @ self._peso
+        serie = np.concatenate([self._pendentes, potencia])
+        n = (len(serie) - self._quadros_bloco) // self._passo + 1
+        if n <= 0:
+            self._pendentes = serie
+            return
+        acumulado = np.concatenate([[0.0], np.cumsum(serie)])
+        inicio = np.arange(n) * self._passo
+        blocos = (acumulado[inicio + self._quadros_bloco] - acumulado[inicio]) / self._quadros_bloco
+        self._pendentes = serie[n * self._passo:]
+
+        lufs = -0.691 + 10 * np.log10(blocos + 1e-20)
+        validos = lufs > -70
+        indices = np.clip(np.round((lufs[validos] + 70) * 100).astype(int), 0, len(self._contagem) - 1)
+        np.add.at(self._contagem, indices, 1)
+        np.add.at(self._soma, indices, blocos[validos])
+
+    def resultado(self):
+        total = self._contagem.sum()
+        if not total:
+            return None
+        relativo = -0.691 + 10 * np.log10(self._soma.sum() / total) - 10
+        inicio = int(np.clip(np.ceil((relativo + 70) * 100), 0, len(self._contagem) - 1))
+        contagem = self._contagem[inicio:].sum()
+        integrado = -0.691 + 10 * np.log10(self._soma[inicio:].sum() / contagem) if contagem else None
+        return {
+            'lufs': round(float(integrado), 1) if integrado is not None else None,
+            'pico_dbfs': round(float(20 * np.log10(self._pico)), 1) if self._pico > 0 else None,
+        }
+
+
+class FormaDeOnda:
+    """Visão geral da forma de onda: pares [min, max] normalizados, em largura fixa (ver spek.Decimador)."""
+
+    def __init__(self, sr, largura=LARGURA_WAVEFORM, hop=spek.HOP):
+        self.hop = hop
+        self._resto = np.zeros(0, dtype=np.float32)
+        self._decimador = spek.Decimador(largura, 2, 'minmax')
+
+    def consumir_pcm(self, bloco):
+        amostras = np.concatenate([self._resto, bloco])
+        n = len(amostras) // self.hop
+        self._resto = amostras[n * self.hop:]
+        if n:
+            grupos = amostras[:n * self.hop].reshape(n, self.hop)
+            self._decimador.consumir(np.stack([grupos.min(axis=1), grupos.max(axis=1)], axis=1))
+
+    def resultado(self):
+        colunas = self._decimador.colunas()
+        if not len(colunas):
+            return None
+        largura = self._decimador.largura
+        if len(colunas) > largura:
+            bordas = np.linspace(0, len(colunas), largura + 1).astype(int)[:-1]
+            colunas = np.stack([np.minimum.reduceat(colunas[:, 0], bordas),
+                                np.maximum.reduceat(colunas[:, 1], bordas)], axis=1)
+        pico = float(np.abs(colunas).max()) or 1.0
+        return np.round(colunas.astype(np.float64) / pico, 3).tolist()  # normalizada em [-1, 1]
+
+
+FABRICAS = {
+    'analysis': spek.DetectorDeCorte,
+    'bpm': DetectorDeBPM,
+    'key': DetectorDeTom,
+    'loudness': Loudness,
+    'waveform': FormaDeOnda,
+}
+
+
+def analisar(audio_path, fabricas, ffmpeg='ffmpeg', duracao=spek.DURACAO):
+    """Decodifica `audio_path` uma única vez e alimenta todos os analisadores.
+
+    `fabricas` mapeia nome -> callable(sr). Retorna nome -> resultado (None se falhar).
+    """
+    sr = spek.taxa_amostragem(audio_path)
+    analisadores = {nome: fabrica(sr) for nome, fabrica in fabricas.items()}
+    pcm = [a for a in analisadores.values() if hasattr(a, 'consumir_pcm')]
+    stft = [a for a in analisadores.values() if hasattr(a, 'consumir')]
+
+    def blocos():
+        for bloco in spek.ler_pcm(audio_path, sr, ffmpeg=ffmpeg, duracao=duracao):
+            for analisador in pcm:
+                analisador.consumir_pcm(bloco)
+            yield bloco
+
+    if stft:
+        for mag in spek.magnitudes_stft(blocos()):
+            for analisador in stft:
+                analisador.consumir(mag)
+    else:
+        for _ in blocos():
+            pass
+
+    resultados = {}
+    for nome, analisador in analisadores.items():
+        try:
+            resultados[nome] = analisador.resultado()
+        except Exception as e:
+            print(f"Erro analisador {nome}: {e}")
+            resultados[nome] = None
+    return resultados
+
+
+def analisar_faixa(audio_path, titulo, destino_png, ffmpeg='ffmpeg', ativos=ANALISADORES_ATIVOS):
+    """Espectrograma + analisadores ativos numa única passada."""
+    fabricas = {'spectrogram': partial(AnalisadorEspectrograma, titulo=titulo, destino=destino_png)}
+    fabricas.update({nome: FABRICAS[nome] for nome in ativos if nome in FABRICAS})
+    if 'loudness' in fabricas:
+        fabricas['loudness'] = partial(Loudness, canais=spek.canais(audio_path))
+    return analisar(audio_path, fabricas, ffmpeg=ffmpeg)
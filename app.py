@@ -1,43 +1,57 @@
 import os
-import shutil
-import zipfile
+import hmac
 import time
+import shutil
+import random
+import itertools
+import threading
+import mimetypes
+import unicodedata
+from urllib.parse import quote, urlsplit
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import librosa
-import librosa.display
-import numpy as np
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, send_from_directory, jsonify
-from yt_dlp import YoutubeDL
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB
-from mutagen.mp3 import MP3
-from mutagen.flac import FLAC
-from mutagen.wave import WAVE
-import requests
-from io import BytesIO
-from PIL import Image
-import mercadopago
+from flask import Flask, render_template, request, send_file, flash, redirect, url_for, send_from_directory, jsonify, Response, stream_with_context, g
 from dotenv import load_dotenv
 import uuid
-import sqlite3
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 
 # Carrega variáveis de ambiente
 load_dotenv()
 
 # Importações dos Modelos
-from models import db, User, Payment, Coupon, UsedCoupon
+from models import db, User, Payment, Coupon, UsedCoupon, WebhookEvent
+from jobs import FilaDeJobs, PoolDeFaixas, FilaCheia, JobCancelado
+from cache import CacheDeFaixas
+from workspace import Workspaces
+from eventos import Broker, formatar, SSE_DURACAO, SSE_DURACAO_PAGAMENTO, SSE_RETRY_OCUPADO
+from webhooks import cliente_sdk, ProcessadorDeWebhooks, registrar_evento
+from usuarios import CacheDeUsuarios, VarredorDeAssinaturas, assinatura_vigente
+from metadados import CacheDeCapas, escrever_tags
+from playlists import CacheDePlaylists, PLAYLIST_MAX
+from metricas import Registro, PerfilWSGI, cronometro, TIPO_CONTEUDO, BALDES_BYTES_POR_S
+import zipstream
+import conversao
+import migracoes
+from sqlalchemy import update, insert, or_, func
+from sqlalchemy.exc import IntegrityError
+# yt_dlp, mutagen, PIL, mercadopago e o pipeline NumPy (spek/analise) são importados
+# na primeira vez que são usados: login, landing e boot do worker não pagam por eles
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'vibe_secret_key_pro_dj_2024_ultra_secure')
 
 # Banco de Dados
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'vibe_v2.db') # Garante uso do V2
+DATABASE_PATH = os.getenv('VIBE_DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'vibe_v2.db')) # Garante uso do V2
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATABASE_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Uma conexão por thread do Gunicorn (32) mais as threads de fundo; pragmas em models.configurar_sqlite
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': int(os.getenv('VIBE_DB_POOL', '16')),
+    'max_overflow': int(os.getenv('VIBE_DB_POOL_EXTRA', '32')),
+    'pool_timeout': 10,
+}
 
 db.init_app(app)
 login_manager = LoginManager()
@@ -46,54 +60,42 @@ login_manager.login_view = 'login'
 
 # Mercado Pago SDK
 MP_ACCESS_TOKEN = os.getenv('MERCADOPAGO_ACCESS_TOKEN')
-sdk = mercadopago.SDK(MP_ACCESS_TOKEN) if MP_ACCESS_TOKEN else None
+_sdk = None
+
+def mp_sdk():
+    """SDK do Mercado Pago, criado no primeiro uso (None sem token)."""
+    global _sdk
+    if _sdk is None and MP_ACCESS_TOKEN:
+        import mercadopago
+        # MERCADOPAGO_API_URL troca o endpoint da API (ex.: servidor falso de bench/ para testes de carga)
+        _sdk = mercadopago.SDK(MP_ACCESS_TOKEN, http_client=cliente_sdk(os.getenv('MERCADOPAGO_API_URL')))
+    return _sdk
+
+# Usuário logado vem do cache (sem consulta por requisição); quem altera o User invalida
+cache_usuarios = CacheDeUsuarios()
+varredor_assinaturas = VarredorDeAssinaturas(app, cache_usuarios)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return cache_usuarios.obter(int(user_id))
 
 # ===================================
-# SISTEMA DE MIGRAÇÃO AUTOMÁTICA (CORRIGIDO)
+# MIGRAÇÕES (migracoes.py)
 # ===================================
 def verificar_e_migrar_banco():
-    """Verifica e atualiza tabelas antigas para o novo formato."""
+    """Aplica as migrações pendentes (PRAGMA user_version)."""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # 1. Verifica Tabela COUPON (Adiciona colunas novas se faltarem)
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='coupon'")
-        if cursor.fetchone():
-            cursor.execute("PRAGMA table_info(coupon)")
-            colunas = [col[1] for col in cursor.fetchall()]
-            
-            if 'usage_limit' not in colunas:
-                print("🔧 Migrando Coupon: Adicionando usage_limit...")
-                cursor.execute("ALTER TABLE coupon ADD COLUMN usage_limit INTEGER DEFAULT 0")
-            
-            if 'usage_count' not in colunas:
-                print("🔧 Migrando Coupon: Adicionando usage_count...")
-                cursor.execute("ALTER TABLE coupon ADD COLUMN usage_count INTEGER DEFAULT 0")
-        
-        # 2. Cria tabela UsedCoupon se não existir
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='used_coupon'")
-        if not cursor.fetchone():
-            print("🔧 Criando tabela UsedCoupon...")
-            # Deixa o SQLAlchemy criar depois
-            
-        conn.commit()
-        conn.close()
-        
-        # Garante criação de tabelas novas via SQLAlchemy
         with app.app_context():
-            db.create_all()
-            
+            return migracoes.migrar(db.engine)
     except Exception as e:
         print(f"❌ ERRO MIGRAÇÃO: {e}")
+        return []
 
-# Executa migração ao iniciar
-with app.app_context():
+@app.cli.command('migrar')
+def migrar_comando():
+    """Atualiza o banco. Roda uma vez por deploy (`flask --app app migrar`), não no import."""
     verificar_e_migrar_banco()
+    print(f"✅ Banco na versão {migracoes.VERSAO_ATUAL}.")
 
 DOWNLOAD_FOLDER = 'downloads'
 STATIC_FOLDER = 'static'
@@ -104,56 +106,153 @@ for f in [DOWNLOAD_FOLDER, STATIC_FOLDER]:
 
 FFMPEG_PATH = shutil.which("ffmpeg") or "/usr/bin/ffmpeg"
 
-def limpar_pastas():
-    try:
-        for folder in [DOWNLOAD_FOLDER, STATIC_FOLDER]:
-            for filename in os.listdir(folder):
-                if filename == 'images': continue 
-                file_path = os.path.join(folder, filename)
-                if os.path.isfile(file_path): os.unlink(file_path)
-    except Exception as e:
-        print(f"Erro ao limpar pastas: {e}")
+# Progresso em tempo real: um stream SSE por usuário
+broker = Broker()
+
+def publicar_evento_job(job, tipo, dados):
+    # Eventos 'job' levam só o id: o stream monta o estado atual (com URLs) na hora de enviar
+    broker.publicar(job.user_id, tipo, dados if tipo == 'faixa' else {'id': job.id})
+
+# Fila de downloads em segundo plano (libera o worker web na hora)
+fila = FilaDeJobs(ao_mudar=publicar_evento_job, ao_terminar=lambda job: registrar_job(job))
+# Faixas de todos os jobs dividem o mesmo teto de downloads/FFmpeg simultâneos
+pool_faixas = PoolDeFaixas()
+# Faixas já convertidas (compartilhadas entre usuários)
+cache_faixas = CacheDeFaixas()
+# Capas já convertidas para JPEG (por URL e por conteúdo), baixadas por uma Session só
+capas = CacheDeCapas()
+# Expansões de playlists/canais (extract_flat) e o que cada usuário já sincronizou
+playlists = CacheDePlaylists()
+QUALIDADE = '320'
+
+# ===================================
+# MÉTRICAS (/metrics) E PERFIL SOB DEMANDA
+# ===================================
+metricas = Registro()
+m_etapa = metricas.histograma('vibe_etapa_segundos', 'Duração de cada etapa do pipeline', ('etapa',))
+m_download_bytes = metricas.contador('vibe_download_bytes_total', 'Bytes baixados pelo yt-dlp')
+m_download_velocidade = metricas.histograma('vibe_download_velocidade_bytes_por_segundo',
+                                            'Velocidade média do download de cada faixa', baldes=BALDES_BYTES_POR_S)
+m_faixas = metricas.contador('vibe_faixas_total', 'Faixas por resultado (ok, cache, erro)', ('resultado',))
+m_falhas = metricas.contador('vibe_falhas_total', 'Faixas que falharam, por host da URL e motivo', ('host', 'motivo'))
+m_jobs = metricas.contador('vibe_jobs_total', 'Jobs que rodaram, por status final', ('status',))
+m_zip_bytes = metricas.contador('vibe_zip_bytes_total', 'Bytes enviados em pacotes .zip')
+m_conversoes = metricas.contador('vibe_conversoes_total', 'Faixas convertidas por ação (mantido, copia, sem_perda, transcodificacao)', ('acao',))
+m_ffmpeg_cpu = metricas.contador('vibe_ffmpeg_cpu_segundos_total', 'CPU (usuário + sistema) do FFmpeg na conversão, por ação', ('acao',))
+m_http = metricas.histograma('vibe_http_segundos', 'Tempo até a resposta (sem o corpo em streaming)', ('rota', 'metodo', 'status'))
+metricas.medidor('vibe_fila_jobs', 'Jobs consultáveis por status (a espera por vaga está em vibe_faixas_na_fila)', fila.contagem, ('status',))
+metricas.medidor('vibe_faixas_ativas', 'Faixas sendo processadas agora', lambda: pool_faixas.ativas)
+metricas.medidor('vibe_faixas_na_fila', 'Faixas esperando vaga no pool (todos os usuários)', lambda: pool_faixas.pendentes())
+metricas.medidor('vibe_faixas_capacidade', 'Faixas simultâneas permitidas (VIBE_FAIXAS_SIMULTANEAS)', lambda: pool_faixas.max_global)
+metricas.medidor('vibe_cache_hits_total', 'Acertos de cada cache', lambda: {
+    'faixas': cache_faixas.hits, 'capas': capas.hits, 'usuarios': cache_usuarios.hits,
+    'playlists': playlists.hits}, ('cache',), tipo='counter')
+metricas.medidor('vibe_cache_misses_total', 'Faltas de cada cache', lambda: {
+    'faixas': cache_faixas.misses, 'capas': capas.misses, 'usuarios': cache_usuarios.misses,
+    'playlists': playlists.misses}, ('cache',), tipo='counter')
+metricas.medidor('vibe_cache_faixas_bytes', 'Bytes ocupados pelo cache de faixas', lambda: cache_faixas.stats()['bytes_em_uso'])
+metricas.medidor('vibe_sse_conexoes', 'Streams SSE abertos', lambda: broker.conexoes())
+m_sse_recusados = metricas.contador('vibe_sse_recusados_total', 'Conexões SSE respondidas sem stream (teto global atingido)')
+
+def inbox_webhooks():
+    with app.app_context():
+        linhas = (db.session.query(WebhookEvent.status, func.count())
+                  .filter(WebhookEvent.status.in_(('pending', 'retry', 'processing')))
+                  .group_by(WebhookEvent.status).all())
+    return dict.fromkeys(('pending', 'retry', 'processing'), 0) | dict(linhas)
 
-def gerar_spek(audio_path, title):
+metricas.medidor('vibe_webhooks_inbox', 'Notificações do MP ainda não processadas', inbox_webhooks, ('status',))
+
+def registrar_job(job):
+    m_jobs.inc(status=job.status)
+    m_etapa.observar(job.finalizado_em - job.iniciado_em, etapa='job')
+
+# Hosts vistos em falhas viram rótulo; a partir do limite, caem em 'outros'
+HOSTS_MAX = 50
+_hosts_com_falha = set()
+_hosts_lock = threading.Lock()
+
+def host_da_url(url):
+    host = (urlsplit(url).hostname or 'invalido').lower().removeprefix('www.')
+    # Faixas falham em paralelo: conferir e incluir juntos, senão o teto passa de HOSTS_MAX
+    with _hosts_lock:
+        if host not in _hosts_com_falha and len(_hosts_com_falha) >= HOSTS_MAX:
+            return 'outros'
+        _hosts_com_falha.add(host)
+    return host
+
+MOTIVOS_FALHA = (
+    # (motivo, trechos da mensagem do yt-dlp/FFmpeg em minúsculas)
+    ('url_invalida', ('unsupported url', 'is not a valid url')),
+    ('indisponivel', ('video unavailable', 'private video', 'has been removed', 'not available', 'http error 404', 'http error 410')),
+    ('bloqueado', ('sign in to confirm', 'age-restricted', 'http error 403', 'http error 401', 'geo restrict', 'drm')),
+    ('limite_taxa', ('http error 429', 'too many requests')),
+    ('erro_servidor', ('http error 5',)),
+    ('timeout', ('timed out', 'timeout')),
+    ('rede', ('connection', 'name or service not known', 'temporary failure in name resolution', 'unable to download')),
+    ('conversao', ('ffmpeg', 'ffprobe', 'postprocessing', 'audio conversion')),
+    ('formato', ('requested format is not available', 'no video formats')),
+)
+
+def motivo_falha(e):
+    mensagem = str(e).lower()
+    for motivo, trechos in MOTIVOS_FALHA:
+        if any(t in mensagem for t in trechos):
+            return motivo
+    return 'desconhecido'
+
+# X-Vibe-Perfil: <VIBE_PERFIL_TOKEN> grava um cProfile da requisição em VIBE_PERFIL_DIR
+PERFIL_TOKEN = os.getenv('VIBE_PERFIL_TOKEN')
+if PERFIL_TOKEN:
+    app.wsgi_app = PerfilWSGI(app.wsgi_app, os.getenv('VIBE_PERFIL_DIR', 'perfis'), PERFIL_TOKEN)
+# /metrics fecha por padrão: abre com VIBE_METRICS_TOKEN (Bearer) ou, sem token, com
+# VIBE_METRICS_LOCAL=1 (Prometheus na mesma máquina, app sem proxy na frente)
+METRICAS_TOKEN = os.getenv('VIBE_METRICS_TOKEN')
+METRICAS_LOCAL = os.getenv('VIBE_METRICS_LOCAL') == '1'
+
+# Entrega dos arquivos: 'direto' (o app envia), 'x-accel' (nginx) ou 'x-sendfile' (Apache/lighttpd).
+# Nos modos de proxy o app só autentica; o servidor web envia os bytes (com Range/ETag).
+ENTREGA = os.getenv('VIBE_ENTREGA', 'direto')
+ACCEL_PREFIXO = os.getenv('VIBE_ACCEL_PREFIXO', '/_downloads/')
+app.config['USE_X_SENDFILE'] = ENTREGA == 'x-sendfile'
+
+def job_ativo(job_id):
+    job = fila.obter(job_id)
+    return job is not None and not job.finalizado
+
+# downloads/<user>/<job>/ e static/spek/<user>/<job>/, limpos por um varredor (TTL + cota)
+workspaces = Workspaces(DOWNLOAD_FOLDER, os.path.join(STATIC_FOLDER, 'spek'), ativo=job_ativo)
+
+
+def gerar_spek(audio_path, title, job, kbps_origem=None):
+    """Decodifica a faixa uma vez: espectrograma + análises (corte, BPM, tom, loudness, waveform).
+
+    Retorna (img_name, analises), onde img_name é relativo a static/ e analises vai
+    direto para o files_info. `kbps_origem`: taxa do MP3 entregue sem reencode, para o
+    veredito julgar pela taxa real e não pelos 320 pedidos.
+    """
+    import spek, analise
     try:
-        y, sr = librosa.load(audio_path, duration=60)
-        plt.style.use('dark_background')
-        plt.figure(figsize=(8, 3))
-        D = librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
-        librosa.display.specshow(D, sr=sr, x_axis='time', y_axis='hz', cmap='inferno')
-        plt.colorbar(format='%+2.0f dB')
-        plt.title(f'{title[:40]}...', fontsize=10, color='white')
-        plt.tight_layout()
-        img_name = f"spec_{int(time.time())}_{np.random.randint(100)}.png"
-        img_path = os.path.join(STATIC_FOLDER, img_name)
-        plt.savefig(img_path, facecolor='#1e1e1e', edgecolor='none')
-        plt.close()
-        return img_name
+        img_name, img_path = novo_spek(job)
+        with cronometro(m_etapa, etapa='espectrograma'):
+            analises = analise.analisar_faixa(audio_path, title, img_path, ffmpeg=FFMPEG_PATH)
+        if not analises.pop('spectrogram', None):
+            return None, {}
+        if analises.get('analysis'):
+            analises['analysis']['veredito'] = spek.veredito(analises['analysis'], os.path.splitext(audio_path)[1].lower().lstrip('.'), kbps_origem)
+        return img_name, analises
     except Exception as e:
         print(f"Erro spek: {e}")
-        return None
+        return None, {}
 
-def editar_metadados(file_path, artist=None, title=None, album=None, cover_url=None):
+def editar_metadados(file_path, artist=None, title=None, album=None, cover_url=None, capa=None):
+    """Grava as tags (mp3, flac, wav, aiff). `capa` (JPEG pronto) dispensa buscar `cover_url`."""
     try:
-        ext = os.path.splitext(file_path)[1].lower()
-        if ext == '.mp3':
-            audio = MP3(file_path, ID3=ID3)
-            try: audio.delete()
-            except: pass
-            audio.add_tags()
-            if title: audio.tags.add(TIT2(encoding=3, text=title))
-            if artist: audio.tags.add(TPE1(encoding=3, text=artist))
-            if album: audio.tags.add(TALB(encoding=3, text=album))
-            if cover_url:
-                try:
-                    resp = requests.get(cover_url, timeout=10)
-                    if resp.status_code == 200:
-                        img = Image.open(BytesIO(resp.content)).resize((500, 500))
-                        img_bytes = BytesIO()
-                        img.save(img_bytes, format='JPEG')
-                        audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=img_bytes.getvalue()))
-                except: pass
-            audio.save()
+        if capa is None and cover_url:
+            with cronometro(m_etapa, etapa='capa'):
+                capa = capas.obter(cover_url)
+        with cronometro(m_etapa, etapa='metadados'):
+            escrever_tags(file_path, artist, title, album, capa)
         return True
     except Exception as e:
         print(f"Erro metadados: {e}")
@@ -181,6 +280,7 @@ def login():
             return render_template('login.html')
         
         login_user(user)
+        cache_usuarios.invalidar(user.id)  # próxima página já parte do estado atual do banco
         
         # Verifica assinatura
         if user.is_subscriber and user.subscription_expires:
@@ -265,13 +365,14 @@ def setup_coupons():
 @app.route('/payment')
 @login_required
 def payment():
-    if current_user.is_subscriber: return redirect(url_for('index'))
+    if assinatura_ativa(): return redirect(url_for('index'))
     pending_payment = Payment.query.filter_by(user_id=current_user.id, status='pending').first()
     return render_template('payment.html', user=current_user, pending_payment=pending_payment)
 
 @app.route('/create_pix_payment', methods=['POST'])
 @login_required
 def create_pix_payment():
+    sdk = mp_sdk()
     if not sdk: return jsonify({'error': 'Configuração de pagamento ausente'}), 500
     
     try:
@@ -319,6 +420,8 @@ def create_pix_payment():
         print(f"Erro Python PIX: {e}")
         return jsonify({'error': str(e)}), 500
 
+lock_resgate = threading.Lock()
+
 @app.route('/redeem_coupon', methods=['POST'])
 @login_required
 def redeem_coupon():
@@ -329,146 +432,677 @@ def redeem_coupon():
         return redirect(url_for('payment'))
         
     try:
-        coupon = Coupon.query.filter_by(code=code, active=True).first()
-        
-        # 1. Verifica se cupom existe e limites globais
-        if not coupon:
-            flash('Código inválido ou expirado.', 'error')
-            return redirect(url_for('payment'))
-            
-        if coupon.usage_limit > 0 and coupon.usage_count >= coupon.usage_limit:
-            flash('Este cupom atingiu o limite máximo de usos.', 'error')
-            return redirect(url_for('payment'))
+        # Um resgate por vez no processo: a espera é no lock (acorda na hora) e não no
+        # busy_timeout do SQLite, que sonda o arquivo com intervalos crescentes
+        with lock_resgate:
+            # 1. Reserva um uso com UPDATE condicional: o limite é conferido pelo próprio
+            # banco e a transação passa a segurar o lock de escrita (nada de ler-e-somar)
+            dias = db.session.execute(
+                update(Coupon)
+                .where(Coupon.code == code, Coupon.active == True,
+                       or_(func.coalesce(Coupon.usage_limit, 0) == 0,
+                           func.coalesce(Coupon.usage_count, 0) < Coupon.usage_limit))
+                .values(usage_count=func.coalesce(Coupon.usage_count, 0) + 1)
+                .returning(Coupon.days)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            if dias is None:
+                db.session.rollback()
+                if Coupon.query.filter_by(code=code, active=True).first():
+                    flash('Este cupom atingiu o limite máximo de usos.', 'error')
+                else:
+                    flash('Código inválido ou expirado.', 'error')
+                return redirect(url_for('payment'))
 
-        # 2. Verifica se ESSE usuário já usou ESSE cupom
-        ja_usou = UsedCoupon.query.filter_by(user_id=current_user.id, coupon_code=code).first()
-        if ja_usou:
-            flash('Você já resgatou este cupom anteriormente.', 'error')
-            return redirect(url_for('payment'))
+            # 2. Registra o uso; o índice único (user_id, coupon_code) barra o segundo resgate
+            # e o rollback devolve o uso reservado acima
+            try:
+                db.session.execute(insert(UsedCoupon).values(
+                    user_id=current_user.id, coupon_code=code, used_at=datetime.utcnow()))
+            except IntegrityError:
+                db.session.rollback()
+                flash('Você já resgatou este cupom anteriormente.', 'error')
+                return redirect(url_for('payment'))
+
+            # 3. Aplica o cupom sobre o estado atual do usuário (lido já dentro da transação)
+            usuario = db.session.get(User, current_user.id, populate_existing=True)
+            usuario.is_subscriber = True
+            now = datetime.utcnow()
+            if usuario.subscription_expires and usuario.subscription_expires > now:
+                usuario.subscription_expires += timedelta(days=dias)
+            else:
+                usuario.subscription_expires = now + timedelta(days=dias)
+            db.session.commit()
+            cache_usuarios.invalidar(usuario.id)
+
+            flash(f'💎 Sucesso! {dias} dias adicionados à sua conta.', 'success')
+            return redirect(url_for('index'))
 
-        # 3. Aplica o cupom
-        current_user.is_subscriber = True
-        
-        now = datetime.utcnow()
-        if current_user.subscription_expires and current_user.subscription_expires > now:
-            current_user.subscription_expires += timedelta(days=coupon.days)
-        else:
-            current_user.subscription_expires = now + timedelta(days=coupon.days)
-            
-        # 4. Registra o uso
-        coupon.usage_count += 1
-        uso = UsedCoupon(user_id=current_user.id, coupon_code=code)
-        db.session.add(uso)
-        db.session.commit()
-        
-        flash(f'💎 Sucesso! {coupon.days} dias adicionados à sua conta.', 'success')
-        return redirect(url_for('index'))
-            
     except Exception as e:
+        db.session.rollback()
         print(f"Erro ao resgatar: {e}")
-        # Tenta consertar o banco se falhar
-        verificar_e_migrar_banco()
         flash('Erro no sistema. Tente novamente agora.', 'error')
         return redirect(url_for('payment'))
 
 @app.route('/webhook/mercadopago', methods=['POST'])
 def webhook():
-    try:
-        data = request.json
-        if data.get('action') == 'payment.created' or data.get('type') == 'payment':
-            pid = data['data']['id']
-            pay_info = sdk.payment().get(pid)['response']
-            ext_ref = pay_info['external_reference']
-            status = pay_info['status']
-            
-            p = Payment.query.filter_by(external_reference=ext_ref).first()
-            if p:
-                p.status = status
-                if status == 'approved':
-                    p.approved_at = datetime.utcnow()
-                    u = User.query.get(p.user_id)
-                    u.is_subscriber = True
-                    u.subscription_expires = datetime.utcnow() + timedelta(days=30)
-                db.session.commit()
-        return jsonify({'success': True})
-    except: return jsonify({'error': 'fail'}), 500
+    """Só grava a notificação na inbox e responde; o ProcessadorDeWebhooks consulta o MP depois."""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action') or ''
+    pid = (data.get('data') or {}).get('id')
+    if pid and (data.get('type') == 'payment' or action.startswith('payment.')):
+        try:
+            if registrar_evento(pid, action or 'payment'):
+                processador_webhooks.avisar()
+        except Exception as e:
+            print(f"Erro webhook: {e}")
+            return jsonify({'error': 'fail'}), 500  # MP reenvia
+    return jsonify({'success': True})
+
+def buscar_pagamento_mp(payment_id):
+    resposta = mp_sdk().payment().get(payment_id)
+    if resposta['status'] != 200 or not resposta['response']:
+        raise Exception(f"MP respondeu {resposta['status']} para o pagamento {payment_id}")
+    return resposta['response']
+
+def aplicar_pagamento(pay_info):
+    """Aplica o status do MP ao Payment local. Idempotente: notificações repetidas não mudam nada
+    e a assinatura só é estendida na primeira aprovação (approved_at ainda vazio)."""
+    p = Payment.query.filter_by(external_reference=pay_info.get('external_reference')).first()
+    if not p or p.status == pay_info.get('status'):
+        return None
+    p.status = pay_info['status']
+    if p.status == 'approved' and not p.approved_at:
+        p.approved_at = datetime.utcnow()
+        u = User.query.get(p.user_id)
+        u.is_subscriber = True
+        u.subscription_expires = datetime.utcnow() + timedelta(days=30)
+    return p
+
+def avisar_pagamentos(pagamentos):
+    # Avisa na hora a tela do QR Code (stream SSE do usuário); o cache sai antes do aviso,
+    # senão o redirecionamento da página ainda veria o usuário sem assinatura
+    cache_usuarios.invalidar(*{p.user_id for p in pagamentos})
+    for p in pagamentos:
+        broker.publicar(p.user_id, 'pagamento', dados_pagamento(p))
+
+processador_webhooks = ProcessadorDeWebhooks(app, buscar_pagamento_mp, aplicar_pagamento, avisar_pagamentos)
+
+# ===================================
+# SERVIÇOS EM SEGUNDO PLANO
+# ===================================
+_servicos_iniciados = False
+_servicos_lock = threading.Lock()
+
+def iniciar_servicos():
+    """Sobe as threads de fundo (varredores de workspaces e de assinaturas, worker de webhooks).
+
+    Não roda no import: com preload_app o Gunicorn importa o app no master, e threads
+    não sobrevivem ao fork. O gunicorn.conf.py chama isto no post_fork; a primeira
+    requisição cobre os demais modos (python app.py, flask run).
+    """
+    global _servicos_iniciados
+    with _servicos_lock:
+        if _servicos_iniciados: return
+        _servicos_iniciados = True
+    workspaces.iniciar()
+    varredor_assinaturas.iniciar()
+    if MP_ACCESS_TOKEN:
+        try:
+            processador_webhooks.iniciar()
+        except Exception as e:
+            print(f"Erro ao iniciar worker de webhooks (rodou `flask --app app migrar`?): {e}")
+
+@app.before_request
+def garantir_servicos():
+    if not _servicos_iniciados: iniciar_servicos()
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def medir_requisicao(resposta):
+    # Rótulo pela regra da rota (/jobs/<job_id>), nunca pelo caminho: cardinalidade limitada
+    if 'inicio_requisicao' in g and request.endpoint != 'metrics':
+        rota = request.url_rule.rule if request.url_rule else 'sem_rota'
+        m_http.observar(time.perf_counter() - g.inicio_requisicao,
+                        rota=rota, metodo=request.method, status=f'{resposta.status_code // 100}xx')
+    return resposta
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato texto do Prometheus (hosts com falha, estado da fila...).
+
+    Com VIBE_METRICS_TOKEN, exige `Authorization: Bearer <token>`. Sem token, responde
+    403, a não ser com VIBE_METRICS_LOCAL=1, que libera loopback sem X-Forwarded-For.
+    Só serve sem proxy na frente: um nginx que não repassa o cabeçalho faz todo pedido
+    de fora chegar como 127.0.0.1.
+    """
+    if METRICAS_TOKEN:
+        autorizacao = request.headers.get('Authorization', '').encode()
+        if not hmac.compare_digest(autorizacao, f'Bearer {METRICAS_TOKEN}'.encode()):
+            return Response('Não autorizado\n', status=401, mimetype='text/plain')
+    elif not (METRICAS_LOCAL and request.remote_addr in ('127.0.0.1', '::1')
+              and 'X-Forwarded-For' not in request.headers):
+        return Response('Proibido (defina VIBE_METRICS_TOKEN)\n', status=403, mimetype='text/plain')
+    return Response(metricas.expor(), content_type=TIPO_CONTEUDO)
+
+# Status do Mercado Pago que não mudam mais: a tela do QR Code para de escutar
+PAGAMENTO_FINAL = ('approved', 'rejected', 'cancelled', 'refunded', 'charged_back')
+
+def dados_pagamento(p):
+    return {'external_reference': p.external_reference, 'status': p.status, 'approved': p.status == 'approved',
+            'final': p.status in PAGAMENTO_FINAL}
 
 @app.route('/payment/check/<external_reference>')
 @login_required
 def check_status(external_reference):
     p = Payment.query.filter_by(external_reference=external_reference, user_id=current_user.id).first()
     if p and p.status == 'approved':
-        current_user.is_subscriber = True
+        cache_usuarios.invalidar(current_user.id)
         return jsonify({'approved': True})
     return jsonify({'approved': False})
 
 # ===================================
 # CORE DOWNLOADER
 # ===================================
+def assinatura_ativa():
+    """Confere a assinatura do usuário logado. Só lê: o flag no banco é baixado pelo VarredorDeAssinaturas."""
+    return assinatura_vigente(current_user)
+
+def assinante_requerido(f):
+    @wraps(f)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not assinatura_ativa():
+            return jsonify({'error': 'Assinatura inativa'}), 403
+        return f(*args, **kwargs)
+    return wrapper
+
+def novo_spek(job):
+    """Nome (relativo a static/) e caminho de um PNG novo no workspace do job."""
+    nome, caminho = workspaces.novo_spek(job.user_id, job.id)
+    return f'spek/{nome}', caminho
+
+def faixa_do_cache(job, pasta, entrada):
+    """Materializa uma entrada do cache no workspace do job (sem yt-dlp nem FFmpeg)."""
+    inicio = time.perf_counter()
+    info = entrada['info']
+    fname = os.path.join(pasta, entrada['audio'])
+    # Cópia (e não hardlink): editar_metadados altera o arquivo do usuário in-place
+    shutil.copyfile(entrada['audio_path'], fname)
+    spec = None
+    if entrada['spek_path']:
+        spec, spec_path = novo_spek(job)
+        shutil.copyfile(entrada['spek_path'], spec_path)
+    file_info = dict(info, spectrogram=spec, filename=os.path.relpath(fname, DOWNLOAD_FOLDER), cached=True)
+    m_etapa.observar(time.perf_counter() - inicio, etapa='cache')
+    return file_info, fname
+
+def processar_faixa(job, indice, url, entrada_playlist=None):
+    """Extrai, baixa, converte e analisa uma única URL (cada faixa tem seu próprio YoutubeDL).
+
+    `entrada_playlist` (da expansão plana) já traz extrator e id: se a faixa está no
+    cache, nem o yt-dlp é aberto.
+    """
+    from yt_dlp import YoutubeDL
+    format_type = job.format_type
+    # Subpasta por faixa: downloads paralelos nunca disputam o mesmo arquivo
+    pasta = os.path.join(workspaces.pasta(job.user_id, job.id), f'{indice:02d}')
+    os.makedirs(pasta, exist_ok=True)
+
+    marcas = {}  # início do download e da conversão (perf_counter)
+
+    def ao_progresso(d):
+        # Também permite abortar no meio do download quando o usuário cancela
+        job.verificar_cancelamento()
+        if d['status'] == 'downloading':
+            marcas.setdefault('download', time.perf_counter())
+            job.atualizar_faixa(indice, etapa='baixando', baixados=d.get('downloaded_bytes'),
+                                total=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                                velocidade=d.get('speed'), eta=d.get('eta'))
+        elif d['status'] == 'finished':
+            baixados = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            duracao = time.perf_counter() - marcas.pop('download', time.perf_counter())
+            m_etapa.observar(duracao, etapa='download')
+            m_download_bytes.inc(baixados)
+            if duracao > 0 and baixados: m_download_velocidade.observar(baixados / duracao)
+            job.atualizar_faixa(indice, etapa='baixado', baixados=baixados, eta=0)
+
+    # Sem FFmpegExtractAudio: o yt-dlp só baixa, preferindo uma fonte já no codec de saída,
+    # e conversao.converter decide entre manter, copiar o stream ou transcodificar
+    ydl_opts = {
+        'format': conversao.seletor_de_formato(format_type),
+        'outtmpl': f'{pasta}/%(title)s.%(ext)s',
+        'noplaylist': True, 'quiet': True, 'ffmpeg_location': FFMPEG_PATH,
+        'progress_hooks': [ao_progresso],
+    }
+
+    chave_previa = None
+    if entrada_playlist:
+        chave_previa = cache_faixas.chave(entrada_playlist['ie_key'], entrada_playlist['id'], format_type, QUALIDADE)
+        entrada = cache_faixas.obter(chave_previa)
+        if entrada:
+            job.atualizar_faixa(indice, etapa='cache', titulo=entrada['info'].get('title'))
+            return faixa_do_cache(job, pasta, entrada)
+
+    job.atualizar_faixa(indice, etapa='extraindo', titulo=(entrada_playlist or {}).get('titulo'))
+    try:
+        with YoutubeDL(ydl_opts) as ydl:
+            # Só metadados primeiro: se a faixa já está no cache, nada é baixado
+            with cronometro(m_etapa, etapa='extracao'):
+                info = ydl.extract_info(url, download=False)
+            chave = cache_faixas.chave(info.get('extractor_key') or info.get('extractor'), info.get('id'), format_type, QUALIDADE)
+            entrada = cache_faixas.obter(chave) if chave != chave_previa else None
+            if entrada:
+                job.atualizar_faixa(indice, etapa='cache', titulo=info.get('title'))
+                return faixa_do_cache(job, pasta, entrada)
+            info = ydl.process_ie_result(info, download=True)
+            baixado = (info.get('requested_downloads') or [{}])[0].get('filepath') or ydl.prepare_filename(info)
+    except Exception:
+        if job.cancelado: raise JobCancelado()
+        raise
+    if not os.path.exists(baixado): return None
+
+    job.verificar_cancelamento()
+    job.atualizar_faixa(indice, etapa='convertendo')
+    with cronometro(m_etapa, etapa='conversao'):
+        fname, relatorio = conversao.converter(baixado, format_type, QUALIDADE, ffmpeg=FFMPEG_PATH)
+    m_conversoes.inc(acao=relatorio['acao'])
+    m_ffmpeg_cpu.inc(relatorio['ffmpeg_cpu_s'], acao=relatorio['acao'])
+
+    job.verificar_cancelamento()
+    job.atualizar_faixa(indice, etapa='analisando', titulo=info.get('title'))
+    # MP3 mantido/copiado abaixo de 320 não foi "inflado" por nós: o veredito usa a taxa real
+    kbps_origem = relatorio['origem']['kbps'] if relatorio['acao'] in ('mantido', 'copia') else None
+    spec, analises = gerar_spek(fname, info.get('title', 'Audio'), job, kbps_origem)
+    meta = dict({'title': info.get('title'), 'artist': info.get('artist'), 'thumbnail': info.get('thumbnail'),
+                 'conversao': relatorio}, **analises)
+    cache_faixas.guardar(chave, fname, os.path.join(STATIC_FOLDER, spec) if spec else None, meta)
+    file_info = dict(meta, spectrogram=spec, filename=os.path.relpath(fname, DOWNLOAD_FOLDER))
+    return file_info, fname
+
+def faixas_do_job(job):
+    """Gera (indice, url, entrada da playlist ou None) para cada faixa do job.
+
+    Em modo playlist, cada link é expandido sob demanda: as primeiras faixas já entram
+    no pool enquanto o resto da lista ainda está sendo lido. Link que falha na expansão
+    vira uma faixa com erro, sem derrubar as outras.
+    """
+    if not job.playlist:
+        for indice, url in enumerate(job.urls, 1):
+            yield indice, url, None
+        return
+    opcoes = {'ffmpeg_location': FFMPEG_PATH}
+    for origem in job.origens:
+        try:
+            for entrada in playlists.expandir(origem, job.user_id, job.somente_novas, opcoes):
+                if len(job.urls) >= PLAYLIST_MAX:
+                    print(f"Job {job.id}: limite de {PLAYLIST_MAX} faixas atingido")
+                    return
+                job.verificar_cancelamento()
+                yield job.adicionar_url(entrada['link']), entrada['url'], dict(entrada, origem=origem)
+        except JobCancelado:
+            raise
+        except Exception as e:
+            print(f"Erro playlist {origem}: {e}")
+            m_falhas.inc(host=host_da_url(origem), motivo=motivo_falha(e))
+            job.atualizar_faixa(job.adicionar_url(origem), etapa='erro', erro=str(e))
+
+def processar_pacote(job):
+    """Baixa, converte, gera espectrogramas e compacta as URLs de um job (roda na fila)."""
+    workspaces.pasta(job.user_id, job.id)
+    format_type = job.format_type
+    m_etapa.observar(job.iniciado_em - job.criado_em, etapa='fila')
+
+    concluidas = itertools.count(1)
+    sincronizadas = {}  # origem -> ids de playlist entregues (para o somente_novas)
+
+    def tarefa(item):
+        indice, url, entrada = item
+        inicio = time.perf_counter()
+        try:
+            resultado = processar_faixa(job, indice, url, entrada)
+            if not resultado: raise Exception('Arquivo convertido não encontrado')
+            m_etapa.observar(time.perf_counter() - inicio, etapa='faixa')
+            m_faixas.inc(resultado='cache' if resultado[0].get('cached') else 'ok')
+            # Entrega incremental: o evento da faixa já leva o arquivo para download
+            job.atualizar_faixa(indice, etapa='pronto', titulo=resultado[0].get('title'), arquivo=resultado[0]['filename'])
+            if entrada:
+                sincronizadas.setdefault(entrada['origem'], []).append(entrada['id'])
+            return resultado
+        except JobCancelado:
+            raise
+        except Exception as e:
+            motivo = 'arquivo_ausente' if str(e) == 'Arquivo convertido não encontrado' else motivo_falha(e)
+            m_faixas.inc(resultado='erro')
+            m_falhas.inc(host=host_da_url(url), motivo=motivo)
+            print(f"Erro faixa {url} ({motivo}): {e}")
+            job.atualizar_faixa(indice, etapa='erro', erro=str(e))
+            raise
+        finally:
+            job.etapa = f'Processando faixas ({next(concluidas)}/{len(job.urls)})...'
+
+    job.etapa = 'Lendo playlists...' if job.playlist else f'Processando faixas (0/{len(job.urls)})...'
+    try:
+        # Resultados voltam na mesma ordem de urls[]
+        resultados = [r for r in pool_faixas.mapear(job, tarefa, faixas_do_job(job)) if r]
+    finally:
+        for origem, ids in sincronizadas.items():
+            playlists.marcar_vistos(origem, job.user_id, ids)
+    files_info = [info for info, _ in resultados]
+
+    if not files_info:
+        if job.somente_novas and not job.urls:
+            raise Exception('Nenhuma faixa nova nas playlists desde a última sincronização.')
+        raise Exception('Nenhum link pôde ser processado.')
+
+    # Pacotes não são mais compactados aqui: o .zip é gerado em streaming no download
+    return {'files_info': files_info, 'format_type': format_type}
+
+def enfileirar_download():
+    """Lê o formulário de download e submete o job. Retorna None se não houver URLs."""
+    urls = [u.strip() for u in request.form.getlist('urls[]') if u.strip()]
+    format_type = request.form.get('format', 'mp3')
+    if not urls: return None
+    # playlist=1: cada link pode ser playlist/canal; somente_novas=1: só o que entrou desde a última sincronização
+    playlist = request.form.get('playlist') in ('1', 'on', 'true')
+    somente_novas = playlist and request.form.get('somente_novas') in ('1', 'on', 'true')
+    return fila.submeter(current_user.id, urls, format_type, processar_pacote,
+                         playlist=playlist, somente_novas=somente_novas)
+
+def job_json(job):
+    data = job.to_dict()
+    data['status_url'] = url_for('job_status', job_id=job.id)
+    data['cancel_url'] = url_for('job_cancel', job_id=job.id)
+    # Faixas prontas já podem ser baixadas com o job ainda rodando
+    data['faixas'] = [dict(f, download_url=url_for('download_file', filename=f['arquivo'])) if f.get('arquivo') else f
+                      for f in data['faixas']]
+    if job.status == 'done':
+        data['result_url'] = url_for('job_resultado', job_id=job.id)
+        data['files_info'] = job.resultado['files_info']
+    return data
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if not current_user.is_authenticated: return render_template('landing.html')
     
-    # Verifica expiração
-    if current_user.subscription_expires and current_user.subscription_expires < datetime.utcnow():
-        current_user.is_subscriber = False
-        db.session.commit()
-        return redirect(url_for('payment'))
-        
-    if not current_user.is_subscriber: return redirect(url_for('payment'))
+    if not assinatura_ativa(): return redirect(url_for('payment'))
 
     if request.method == 'POST':
-        limpar_pastas()
-        urls = [u.strip() for u in request.form.getlist('urls[]') if u.strip()]
-        format_type = request.form.get('format', 'mp3')
-        if not urls: return redirect(url_for('index'))
-
-        files_info, downloaded = [], []
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{DOWNLOAD_FOLDER}/%(title)s.%(ext)s',
-            'noplaylist': True, 'quiet': True, 'ffmpeg_location': FFMPEG_PATH,
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': format_type, 'preferredquality': '320'}],
-        }
-
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                for url in urls:
-                    try:
-                        info = ydl.extract_info(url, download=True)
-                        fname = ydl.prepare_filename(info).rsplit('.', 1)[0] + f'.{format_type}'
-                        if os.path.exists(fname):
-                            spec = gerar_spek(fname, info.get('title', 'Audio'))
-                            files_info.append({'title': info.get('title'), 'artist': info.get('artist'), 'thumbnail': info.get('thumbnail'), 'spectrogram': spec, 'filename': os.path.basename(fname)})
-                            downloaded.append(fname)
-                    except: continue
-            
-            if len(downloaded) == 1:
-                return render_template('index.html', show_metadata_editor=True, file_info=files_info[0], format_type=format_type)
-            elif len(downloaded) > 1:
-                zip_name = f"Vibe_Pack_{int(time.time())}.zip"
-                with zipfile.ZipFile(f"{DOWNLOAD_FOLDER}/{zip_name}", 'w') as zf:
-                    for f in downloaded: zf.write(f, os.path.basename(f))
-                return render_template('index.html', download_ready=True, results=files_info, final_filename=zip_name, is_zip=True)
-        except Exception as e:
-            flash(f'Erro: {e}', 'error')
+            job = enfileirar_download()
+        except FilaCheia as e:
+            flash(str(e), 'error')
+            return redirect(url_for('index'))
+        if not job: return redirect(url_for('index'))
+        return render_template('index.html', download_ready=False, job_id=job.id, playlist_max=PLAYLIST_MAX)
+
+    return render_template('index.html', download_ready=False, playlist_max=PLAYLIST_MAX)
 
-    return render_template('index.html', download_ready=False)
+@app.route('/eventos')
+@login_required
+def eventos():
+    """Stream SSE do usuário: jobs, progresso de cada faixa e confirmação de pagamentos PIX.
+
+    `?pagamento=<external_reference>` é a tela do QR Code: só recebe eventos desse
+    pagamento, dura SSE_DURACAO_PAGAMENTO e fecha assim que ele chega a um status final
+    (o estado atual vai ao conectar, cobrindo o webhook que chegou antes). Com o teto
+    global de streams atingido, responde na hora com a foto atual (ou o replay) e um
+    `retry:` maior, sem ocupar uma thread esperando eventos.
+    """
+    user_id = current_user.id
+    ultimo_id = request.headers.get('Last-Event-ID', type=int)
+    referencia = request.args.get('pagamento')
+    pagamento = None
+    if referencia:
+        p = Payment.query.filter_by(external_reference=referencia, user_id=user_id).first()
+        if p: pagamento = dados_pagamento(p)
+    assinatura = None
+    if not (pagamento and pagamento['final']):
+        assinatura = broker.assinar(user_id, ultimo_id)
+        if assinatura is None: m_sse_recusados.inc()
+
+    def formatar_evento(evento_id, tipo, dados):
+        # None: evento que não interessa a esta conexão
+        if referencia:
+            if tipo != 'pagamento' or dados.get('external_reference') != referencia: return None
+        elif tipo == 'job':
+            job = fila.obter(dados['id'], user_id)
+            if not job: return None
+            dados = job_json(job)
+        return formatar(evento_id, tipo, dados)
+
+    def foto_atual():
+        # Conexão nova: estado atual (o resto chega como eventos); reconexão: o que se perdeu
+        if ultimo_id is not None and not referencia:
+            for evento in broker.perdidos(user_id, ultimo_id):
+                texto = formatar_evento(*evento)
+                if texto: yield texto
+        elif referencia:
+            if pagamento: yield formatar(None, 'pagamento', pagamento)
+        else:
+            for job in fila.listar(user_id):
+                yield formatar(None, 'job', job_json(job))
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        if ultimo_id is None or referencia:
+            yield from foto_atual()
+        if pagamento and pagamento['final']: return
+        duracao = SSE_DURACAO_PAGAMENTO if referencia else SSE_DURACAO
+        for evento in broker.escutar(assinatura, duracao=duracao):
+            if evento is None:
+                yield ': ping\n\n'
+                continue
+            texto = formatar_evento(*evento)
+            if texto: yield texto
+            if referencia and texto and evento[2].get('final'): return
+
+    def resposta_curta():
+        # Espalha as novas tentativas para não voltarem todas juntas
+        yield f'retry: {SSE_RETRY_OCUPADO * 1000 + random.randint(0, 5000)}\n\n'
+        yield from foto_atual()
+
+    cabecalhos = {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # nginx não pode segurar os eventos no buffer
+    }
+    if assinatura is None:
+        # Pagamento já decidido (manda o status e fecha) ou teto global atingido
+        corpo = stream() if pagamento and pagamento['final'] else resposta_curta()
+        return Response(stream_with_context(corpo), mimetype='text/event-stream', headers=cabecalhos)
+    resposta = Response(stream_with_context(stream()), mimetype='text/event-stream', headers=cabecalhos)
+    resposta.call_on_close(lambda: broker.cancelar(assinatura))
+    return resposta
+
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    return jsonify(cache_faixas.stats())
+
+# ===================================
+# API DE JOBS
+# ===================================
+@app.route('/jobs', methods=['POST'])
+@assinante_requerido
+def job_submit():
+    try:
+        job = enfileirar_download()
+    except FilaCheia as e:
+        return jsonify({'error': str(e)}), 429
+    if not job: return jsonify({'error': 'Nenhum link informado'}), 400
+    return jsonify(job_json(job)), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = fila.obter(job_id, current_user.id)
+    if not job: return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job_json(job))
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def job_cancel(job_id):
+    job = fila.cancelar(job_id, current_user.id)
+    if not job: return jsonify({'error': 'Job não encontrado'}), 404
+    return jsonify(job_json(job))
+
+@app.route('/jobs/<job_id>/resultado')
+@login_required
+def job_resultado(job_id):
+    job = fila.obter(job_id, current_user.id)
+    if not job or job.status != 'done':
+        if job and job.erro: flash(f'Erro: {job.erro}', 'error')
+        return redirect(url_for('index'))
+
+    resultado = job.resultado
+    files_info = resultado['files_info']
+    if len(files_info) == 1:
+        return render_template('index.html', show_metadata_editor=True, file_info=files_info[0], format_type=resultado['format_type'])
+    return render_template('index.html', download_ready=True, results=files_info, download_url=url_for('download_pack', job_id=job.id), is_zip=True,
+                           metadados_url=url_for('job_metadados', job_id=job.id),
+                           capa_padrao=next((f['thumbnail'] for f in files_info if f.get('thumbnail')), ''))
+
+def arquivo_do_usuario(filename):
+    """Resolve `<user_id>/<job_id>/...` dentro de downloads/ só para o dono. Retorna (caminho, job_id)."""
+    partes = (filename or '').split('/')
+    if len(partes) < 3 or partes[0] != str(current_user.id) or '..' in partes:
+        return None, None
+    caminho = safe_join(DOWNLOAD_FOLDER, filename)
+    return (caminho, partes[1]) if caminho else (None, None)
 
 @app.route('/apply_metadata', methods=['POST'])
 @login_required
 def apply_metadata():
     fname = request.form.get('filename')
-    path = os.path.join(DOWNLOAD_FOLDER, fname)
-    if os.path.exists(path):
-        editar_metadados(path, request.form.get('artist'), request.form.get('title'), request.form.get('album'), request.form.get('cover_url'))
-        return jsonify({'success': True, 'download_url': url_for('download_file', filename=fname)})
+    path, job_id = arquivo_do_usuario(fname)
+    if path:
+        # O arrendamento impede o varredor de apagar o arquivo durante a edição
+        with workspaces.arrendar(current_user.id, job_id):
+            if os.path.exists(path):
+                editar_metadados(path, request.form.get('artist'), request.form.get('title'), request.form.get('album'), request.form.get('cover_url'))
+                return jsonify({'success': True, 'download_url': url_for('download_file', filename=fname)})
     return jsonify({'error': 'Arquivo sumiu'}), 404
 
+@app.route('/jobs/<job_id>/metadados', methods=['POST'])
+@login_required
+def job_metadados(job_id):
+    """Tags no pacote inteiro numa chamada (formulário ou JSON).
+
+    `artist`, `album` e `cover_url` valem para todas as faixas; `faixas` (só JSON),
+    uma lista de {filename, title, artist}, sobrescreve faixa a faixa. Sem `cover_url`,
+    cada faixa leva a própria thumbnail; o título padrão é o do download.
+    """
+    job = fila.obter(job_id, current_user.id)
+    if not job or job.status != 'done': return jsonify({'error': 'Job não encontrado'}), 404
+    dados = request.get_json(silent=True) or request.form
+    artist = (dados.get('artist') or '').strip() or None
+    album = (dados.get('album') or '').strip() or None
+    cover_url = (dados.get('cover_url') or '').strip() or None
+    ajustes = {f.get('filename'): f for f in (dados.get('faixas') or []) if isinstance(f, dict)} if request.is_json else {}
+    faixas = job.resultado['files_info']
+
+    # Cada capa é buscada uma vez (e em paralelo quando são várias) antes de gravar
+    urls = {cover_url} if cover_url else {f.get('thumbnail') for f in faixas if f.get('thumbnail')}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        capas_por_url = dict(zip(urls, executor.map(capas.obter, urls)))
+
+    aplicados, falhas = 0, []
+    with workspaces.arrendar(current_user.id, job.id):
+        for info in faixas:
+            ajuste = ajustes.get(info['filename'], {})
+            path, _ = arquivo_do_usuario(info['filename'])
+            capa = capas_por_url.get(cover_url or info.get('thumbnail'))
+            if path and os.path.isfile(path) and editar_metadados(
+                    path, ajuste.get('artist') or artist or info.get('artist'),
+                    ajuste.get('title') or info.get('title'), album, capa=capa):
+                aplicados += 1
+            else:
+                falhas.append(info['filename'])
+    if not aplicados: return jsonify({'error': 'Nenhuma faixa pôde ser editada', 'falhas': falhas}), 410
+    return jsonify({'success': True, 'aplicados': aplicados, 'falhas': falhas,
+                    'download_url': url_for('download_pack', job_id=job.id)})
+
+def disposicao(resposta, nome):
+    """Content-Disposition de anexo, com filename* (RFC 5987) para nomes fora do ASCII."""
+    try:
+        nome.encode('ascii')
+        resposta.headers.set('Content-Disposition', 'attachment', filename=nome)
+    except UnicodeEncodeError:
+        simples = unicodedata.normalize('NFKD', nome).encode('ascii', 'ignore').decode('ascii')
+        resposta.headers.set('Content-Disposition', 'attachment', filename=simples,
+                             **{'filename*': f"UTF-8''{quote(nome, safe='!#$&+^`|~')}"})
+
+def resposta_x_accel(filename, path):
+    """Resposta vazia: o nginx serve `ACCEL_PREFIXO + filename` de uma location internal."""
+    nome = os.path.basename(path)
+    resposta = Response(mimetype=mimetypes.guess_type(nome)[0] or 'application/octet-stream')
+    resposta.headers['X-Accel-Redirect'] = ACCEL_PREFIXO + quote(filename)
+    disposicao(resposta, nome)
+    return resposta
+
 @app.route('/download/<path:filename>')
 @login_required
 def download_file(filename):
-    return send_file(os.path.join(DOWNLOAD_FOLDER, filename), as_attachment=True)
+    path, job_id = arquivo_do_usuario(filename)
+    if not path: return jsonify({'error': 'Arquivo não encontrado'}), 404
+    # send_file abre o arquivo aqui; depois de aberto, a remoção pelo varredor não corta o envio
+    with workspaces.arrendar(current_user.id, job_id):
+        if not os.path.isfile(path):
+            return jsonify({'error': 'Arquivo expirou'}), 410
+        if ENTREGA == 'x-accel':
+            return resposta_x_accel(filename, path)
+        # conditional: Range (206), If-None-Match/If-Modified-Since (304) e If-Range
+        return send_file(path, as_attachment=True, conditional=True, etag=True)
+
+@app.route('/download/pack/<job_id>')
+@login_required
+def download_pack(job_id):
+    """Envia as faixas do job num .zip "stored" montado em streaming (sem arquivo temporário)."""
+    job = fila.obter(job_id, current_user.id)
+    if not job or job.status != 'done':
+        return jsonify({'error': 'Pacote não encontrado'}), 404
+    caminhos = [os.path.join(DOWNLOAD_FOLDER, info['filename']) for info in job.resultado['files_info']]
+    arrendamento = workspaces.arrendar(current_user.id, job.id)
+    try:
+        # As faixas são abertas uma a uma durante o envio: o arrendamento vale até o fim do stream
+        inicio = time.perf_counter()
+        def ao_fechar():
+            arrendamento.liberar()
+            m_zip_bytes.inc(pacote.enviados)
+            m_etapa.observar(time.perf_counter() - inicio, etapa='zip')
+        pacote = zipstream.ZipEmStreaming(caminhos, ao_fechar=ao_fechar)
+    except OSError:
+        arrendamento.liberar()
+        return jsonify({'error': 'Arquivos do pacote expiraram'}), 410
+    resposta = Response(mimetype='application/zip', direct_passthrough=True)
+    disposicao(resposta, f"Vibe_Pack_{int(job.finalizado_em)}.zip")
+    resposta.accept_ranges = 'bytes'
+    resposta.cache_control.no_cache = True
+    resposta.set_etag(pacote.etag)
+
+    if request.if_none_match.contains(pacote.etag):
+        arrendamento.liberar()
+        resposta.status_code = 304
+        return resposta
+
+    # If-Range com ETag diferente (pacote mudou) ou com data: ignora o Range e manda tudo
+    intervalo = request.range
+    if intervalo and (request.if_range.date or request.if_range.etag not in (None, pacote.etag)):
+        intervalo = None
+    if intervalo:
+        trecho = intervalo.range_for_length(pacote.tamanho)
+        if trecho is None:
+            arrendamento.liberar()
+            resposta.status_code = 416
+            resposta.headers['Content-Range'] = f'bytes */{pacote.tamanho}'
+            return resposta
+        pacote.selecionar_intervalo(*trecho)
+        resposta.status_code = 206
+        resposta.headers['Content-Range'] = f'bytes {trecho[0]}-{trecho[1] - 1}/{pacote.tamanho}'
+
+    resposta.response = pacote
+    resposta.headers['Content-Length'] = str(pacote.fim - pacote.inicio)
+    return resposta
 
 if __name__ == '__main__':
     # Garante migração ao rodar local
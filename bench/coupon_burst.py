@@ -0,0 +1,121 @@
+"""Rajada de resgates de cupom contra o app, tudo local.
+
+Sobe o app com banco SQLite temporário, cria --usuarios contas logadas e um cupom com
+--limite usos, e dispara /redeem_coupon em paralelo, cada usuário tentando
+--tentativas vezes. Confere no banco que o limite e a regra "um resgate por usuário"
+valeram: usage_count == linhas em used_coupon <= limite e ninguém resgatou duas vezes.
+
+Uso:
+    python bench/coupon_burst.py --usuarios 400 --limite 150 --tentativas 2 --clientes 32
+Saída: uma linha JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--usuarios', type=int, default=400)
+    parser.add_argument('--limite', type=int, default=150, help='usage_limit do cupom (0 = ilimitado)')
+    parser.add_argument('--tentativas', type=int, default=2, help='resgates disparados por usuário')
+    parser.add_argument('--clientes', type=int, default=32, help='conexões simultâneas')
+    parser.add_argument('--porta-app', type=int, default=8902)
+    args = parser.parse_args()
+
+    trabalho = tempfile.mkdtemp(prefix='vibe-bench-')
+    os.environ['VIBE_DATABASE_PATH'] = os.path.join(trabalho, 'bench.db')
+    os.chdir(trabalho)
+    import app as vibe
+    from models import db, User, Coupon, UsedCoupon
+    from sqlalchemy import func
+    from werkzeug.serving import make_server
+
+    vibe.verificar_e_migrar_banco()
+    with vibe.app.app_context():
+        modelo = User(email='modelo@vibe', dj_name='Modelo')
+        modelo.set_password('bench')  # um hash só: o scrypt não entra na medição
+        for i in range(args.usuarios):
+            u = User(email=f'cupom{i}@vibe', dj_name=f'Cupom {i}', password_hash=modelo.password_hash)
+            u.generate_referral()
+            db.session.add(u)
+        db.session.add(Coupon(code='PROMO', days=30, active=True, usage_limit=args.limite, usage_count=0))
+        db.session.commit()
+
+    servidor = make_server('127.0.0.1', args.porta_app, vibe.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{args.porta_app}'
+
+    def logar(i):
+        s = requests.Session()
+        s.post(base + '/login', data={'email': f'cupom{i}@vibe', 'password': 'bench'})
+        return s
+
+    with ThreadPoolExecutor(args.clientes) as pool:
+        sessoes = list(pool.map(logar, range(args.usuarios)))
+
+    def resgatar(i):
+        t0 = time.perf_counter()
+        r = sessoes[i % len(sessoes)].post(base + '/redeem_coupon', data={'code': 'promo'}, allow_redirects=False)
+        destino = r.headers.get('Location', '')
+        return time.perf_counter() - t0, r.status_code, destino.rstrip('/').endswith('/payment')
+
+    disparos = [i for i in range(args.usuarios) for _ in range(args.tentativas)]
+    latencias, aceitos, recusados, falhas = [], 0, 0, 0
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.clientes) as pool:
+        for duracao, status, recusado in pool.map(resgatar, disparos):
+            latencias.append(duracao)
+            if status != 302:
+                falhas += 1
+            elif recusado:
+                recusados += 1
+            else:
+                aceitos += 1
+    duracao_total = time.perf_counter() - inicio
+
+    with vibe.app.app_context():
+        usos = db.session.get(Coupon, 1).usage_count
+        linhas = UsedCoupon.query.count()
+        repetidos = (db.session.query(UsedCoupon.user_id).group_by(UsedCoupon.user_id, UsedCoupon.coupon_code)
+                     .having(func.count() > 1).count())
+        assinantes = User.query.filter_by(is_subscriber=True).count()
+
+    esperado = min(args.usuarios, args.limite) if args.limite else args.usuarios
+    print(json.dumps({
+        'resgates_disparados': len(disparos),
+        'aceitos': aceitos,
+        'recusados': recusados,
+        'falhas_http': falhas,
+        'resgates_por_s': round(len(disparos) / duracao_total, 1),
+        'p50_ms': round(statistics.median(latencias) * 1000, 2),
+        'p99_ms': round(percentil(latencias, 99) * 1000, 2),
+        'limite': args.limite,
+        'usage_count': usos,
+        'linhas_used_coupon': linhas,
+        'usuarios_com_resgate_repetido': repetidos,
+        'assinantes': assinantes,
+        'excedente': max(0, linhas - esperado, usos - esperado),
+        'consistente': usos == linhas == aceitos == assinantes == esperado and not repetidos,
+    }))
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Servidor falso da API do Mercado Pago, para testes de carga offline.
+
+Implementa só o que o app usa do SDK:
+    POST /v1/payments            cria um pagamento PIX (status 'pending')
+    GET  /v1/payments/<id>       consulta um pagamento
+e rotas de controle:
+    POST /_fake/payments/<id>/approve   aprova e, com --webhook, notifica o app como o MP faria
+    GET  /_fake/stats                   contadores de chamadas
+
+Uso:
+    python bench/fake_mercadopago.py --porta 8900 --latencia 0.05 --webhook http://127.0.0.1:5002/webhook/mercadopago
+    MERCADOPAGO_ACCESS_TOKEN=TEST MERCADOPAGO_API_URL=http://127.0.0.1:8900 python app.py
+"""
+import argparse
+import base64
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# PNG 1x1 transparente (o app só repassa o base64 para a página)
+QR_PNG = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')).decode()
+
+
+class MercadoPagoFalso:
+    def __init__(self, latencia=0.0, webhook=None):
+        self.latencia = latencia
+        self.webhook = webhook
+        self.pagamentos = {}
+        self.chamadas = {'create': 0, 'get': 0, 'webhooks_enviados': 0}
+        self._ids = itertools.count(10_000_000)
+        self._lock = threading.Lock()
+
+    def criar(self, dados):
+        with self._lock:
+            self.chamadas['create'] += 1
+            pid = next(self._ids)
+            pagamento = {
+                'id': pid, 'status': 'pending',
+                'external_reference': dados.get('external_reference'),
+                'transaction_amount': dados.get('transaction_amount'),
+                'payment_method_id': dados.get('payment_method_id', 'pix'),
+                'point_of_interaction': {'transaction_data': {
+                    'qr_code': f'00020126-FAKE-PIX-{pid}', 'qr_code_base64': QR_PNG}},
+            }
+            self.pagamentos[pid] = pagamento
+            return pagamento
+
+    def obter(self, pid):
+        with self._lock:
+            self.chamadas['get'] += 1
+            return self.pagamentos.get(pid)
+
+    def aprovar(self, pid, notificacoes=1):
+        with self._lock:
+            pagamento = self.pagamentos.get(pid)
+            if not pagamento: return None
+            pagamento['status'] = 'approved'
+        if self.webhook:
+            corpo = {'action': 'payment.updated', 'type': 'payment', 'data': {'id': str(pid)}}
+            for _ in range(notificacoes):
+                requests.post(self.webhook, json=corpo, timeout=10)
+                with self._lock: self.chamadas['webhooks_enviados'] += 1
+        return pagamento
+
+    def servidor(self, host='127.0.0.1', porta=8900):
+        mp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _responder(self, status, corpo):
+                dados = json.dumps(corpo).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def _corpo(self):
+                tamanho = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(tamanho) or b'{}')
+
+            def do_POST(self):
+                if self.path == '/v1/payments':
+                    time.sleep(mp.latencia)
+                    return self._responder(201, mp.criar(self._corpo()))
+                m = re.fullmatch(r'/_fake/payments/(\d+)/approve(?:\?n=(\d+))?', self.path)
+                if m:
+                    self._corpo()
+                    pagamento = mp.aprovar(int(m.group(1)), int(m.group(2) or 1))
+                    return self._responder(200 if pagamento else 404, pagamento or {'message': 'not found'})
+                self._responder(404, {'message': 'not found'})
+
+            def do_GET(self):
+                m = re.fullmatch(r'/v1/payments/(\d+)', self.path)
+                if m:
+                    time.sleep(mp.latencia)
+                    pagamento = mp.obter(int(m.group(1)))
+                    return self._responder(200 if pagamento else 404, pagamento or {'message': 'Payment not found', 'status': 404})
+                if self.path == '/_fake/stats':
+                    return self._responder(200, dict(mp.chamadas, pagamentos=len(mp.pagamentos)))
+                self._responder(404, {'message': 'not found'})
+
+        return ThreadingHTTPServer((host, porta), Handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API falsa do Mercado Pago')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8900)
+    parser.add_argument('--latencia', type=float, default=0.05, help='segundos por chamada à API')
+    parser.add_argument('--webhook', help='URL do webhook do app, chamada ao aprovar')
+    args = parser.parse_args()
+    servidor = MercadoPagoFalso(args.latencia, args.webhook).servidor(args.host, args.porta)
+    print(f'Mercado Pago falso em http://{args.host}:{args.porta}')
+    servidor.serve_forever()
@@ -0,0 +1,73 @@
+"""Justiça entre usuários: um job pequeno não espera playlists longas de outros terminarem.
+
+Usa a FilaDeJobs e o PoolDeFaixas do app com os limites padrão. Cada faixa é simulada
+(dorme --faixa-s segundos, como um download + FFmpeg), e cada job faz o mesmo que o
+processar_pacote: entrega um gerador de faixas ao pool_faixas.mapear e espera.
+Os usuários A e B submetem --grandes faixas cada; um instante depois, C submete
+--pequenas. Confere que a primeira faixa de C começa antes de A e B terminarem e que o
+job de C acaba antes dos dois.
+
+Uso:
+    python bench/justica.py --grandes 20 --pequenas 2 --faixa-s 0.2
+Saída: uma linha JSON; código de saída 1 se C ficou esperando.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from jobs import FilaDeJobs, PoolDeFaixas  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--grandes', type=int, default=20, help='faixas de A e de B')
+    parser.add_argument('--pequenas', type=int, default=2, help='faixas de C')
+    parser.add_argument('--faixa-s', type=float, default=0.2, help='duração simulada de cada faixa')
+    args = parser.parse_args()
+
+    pool = PoolDeFaixas()
+    terminou = {}
+    fila = FilaDeJobs(ao_terminar=lambda job: terminou.setdefault(job.user_id, time.perf_counter()))
+    inicios = {}  # user_id -> início de cada faixa
+    lock = threading.Lock()
+
+    def tarefa(item):
+        user_id, _ = item
+        with lock:
+            inicios.setdefault(user_id, []).append(time.perf_counter())
+        time.sleep(args.faixa_s)
+        return item
+
+    def pacote(job):
+        # Como o processar_pacote: gerador lento de faixas entregue ao pool
+        return pool.mapear(job, tarefa, ((job.user_id, i) for i in range(len(job.urls))))
+
+    t0 = time.perf_counter()
+    jobs = [fila.submeter(u, [f'http://x/{u}/{i}' for i in range(args.grandes)], 'mp3', pacote) for u in 'AB']
+    time.sleep(args.faixa_s / 2)
+    submetido_c = time.perf_counter()
+    jobs.append(fila.submeter('C', [f'http://x/C/{i}' for i in range(args.pequenas)], 'mp3', pacote))
+    while not all(j.finalizado for j in jobs):
+        time.sleep(0.01)
+
+    espera_c = inicios['C'][0] - submetido_c
+    justo = inicios['C'][0] < min(terminou['A'], terminou['B']) and terminou['C'] < min(terminou['A'], terminou['B'])
+    print(json.dumps({
+        'faixas_simultaneas': pool.max_global,
+        'faixas_por_usuario': pool.max_por_usuario,
+        'status': {j.user_id: j.status for j in jobs},
+        'espera_primeira_faixa_c_s': round(espera_c, 3),
+        'fim_s': {u: round(t - t0, 3) for u, t in sorted(terminou.items())},
+        'justo': justo,
+    }))
+    sys.exit(0 if justo else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,430 @@
+"""Bench offline do pipeline baixar → converter → analisar → empacotar, com fixtures sintéticas.
+
+Gera com o FFmpeg faixas de teste (ruído rosa + tom) em cada combinação de
+--duracoes x --fixtures (codec:corte em Hz, 0 = sem corte) e serve tudo num
+servidor HTTP local: o yt-dlp usa o extrator genérico, nada sai da máquina. Em codecs
+com perda o corte é o lowpass do próprio encoder; em flac/wav/aiff simula um "lossless"
+que já foi MP3. A fase espectrograma confere o corte detectado contra o esperado.
+
+Cada fase roda num processo Python novo, para o pico de RSS ser só dela:
+    espectrograma  gerar_spek direto em cada fixture (decodifica o codec original)
+    metadados      editar_metadados (tags + capa) em cópias das fixtures
+    zip            ZipEmStreaming de todas as fixtures, lido até o fim
+    faixas         processar_faixa em sequência: extração, download, conversão e análise
+    http           servidor de verdade + --clientes simultâneos: POST /jobs, polling, .zip
+
+Por etapa: n, p50/p99/média/máximo em ms, vazão e, quando há áudio, quantas vezes o
+tempo real. Por fase: duração, pico de RSS do Python e do maior filho (FFmpeg).
+As etapas de `faixas` e `http` vêm do próprio histograma vibe_etapa_segundos do app.
+
+Uso:
+    python bench/pipeline.py --duracoes 30,180 --clientes 4
+    python bench/pipeline.py --fases espectrograma,zip --comparar bench/resultados/anterior.json
+Saída: o JSON completo em --saida (padrão bench/resultados/pipeline-<data>.json) e uma linha
+JSON com o resumo por etapa.
+"""
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+FASES = ('espectrograma', 'metadados', 'zip', 'faixas', 'http')
+CODECS = {
+    # codec: (extensão, argumentos do FFmpeg)
+    'mp3': ('mp3', ['-c:a', 'libmp3lame', '-b:a', '320k']),
+    'm4a': ('m4a', ['-c:a', 'aac', '-b:a', '256k']),
+    'flac': ('flac', ['-c:a', 'flac']),
+    'wav': ('wav', ['-c:a', 'pcm_s16le']),
+    'aiff': ('aiff', ['-c:a', 'pcm_s16be']),
+}
+CODECS_SEM_PERDA = ('flac', 'wav', 'aiff')
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def resumo(amostras, segundos_audio=None, nbytes=None):
+    """amostras em segundos -> estatísticas em ms; vazão de uma via só (n / soma)."""
+    soma = sum(amostras)
+    dados = {
+        'n': len(amostras),
+        'p50_ms': round(statistics.median(amostras) * 1000, 2),
+        'p99_ms': round(percentil(amostras, 99) * 1000, 2),
+        'media_ms': round(soma / len(amostras) * 1000, 2),
+        'max_ms': round(max(amostras) * 1000, 2),
+        'por_s': round(len(amostras) / soma, 2) if soma else None,
+    }
+    if segundos_audio and soma:
+        dados['x_tempo_real'] = round(segundos_audio / soma, 1)
+    if nbytes and soma:
+        dados['mb_por_s'] = round(nbytes / soma / 1e6, 1)
+    return dados
+
+
+def rss_pico():
+    # ru_maxrss em KB no Linux; RUSAGE_CHILDREN é o maior filho já encerrado (FFmpeg)
+    return {
+        'rss_pico_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rss_pico_filhos_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+# ===================================
+# FIXTURES E SERVIDOR LOCAL
+# ===================================
+def gerar_fixtures(pasta, duracoes, especificacoes, ffmpeg):
+    """Gera (ou reaproveita) as fixtures. Retorna [{'nome', 'codec', 'corte', 'duracao', 'bytes'}]."""
+    os.makedirs(pasta, exist_ok=True)
+    fixtures = []
+    for duracao in duracoes:
+        for especificacao in especificacoes:
+            codec, _, corte = especificacao.partition(':')
+            corte = int(corte or 0)
+            ext, argumentos = CODECS[codec]
+            nome = f"{codec}_{f'{corte // 1000}k' if corte else 'cheio'}_{duracao}s.{ext}"
+            caminho = os.path.join(pasta, nome)
+            if not os.path.exists(caminho):
+                filtros = '[0][1]amix=inputs=2:normalize=0,aformat=sample_rates=44100:channel_layouts=stereo'
+                if corte and codec in CODECS_SEM_PERDA:
+                    # "Lossless" que já foi MP3: parede em `corte` Hz, como o lowpass de um encoder
+                    filtros += f',firequalizer=gain=if(lt(f\\,{corte})\\,0\\,-120):delay=0.05'
+                elif corte:
+                    argumentos = argumentos + ['-cutoff', str(corte)]
+                subprocess.run([
+                    ffmpeg, '-v', 'error', '-y',
+                    '-f', 'lavfi', '-i', f'anoisesrc=color=pink:sample_rate=44100:amplitude=0.25:duration={duracao}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=220:sample_rate=44100:duration={duracao}',
+                    '-filter_complex', filtros, *argumentos, caminho], check=True)
+            fixtures.append({'nome': nome, 'codec': codec, 'corte': corte, 'duracao': duracao,
+                             'bytes': os.path.getsize(caminho)})
+    return fixtures
+
+
+class ServidorDeFixtures(SimpleHTTPRequestHandler):
+    """`/<prefixo>--<nome>` serve a fixture <nome>: cada prefixo vira outro id no extrator
+    genérico do yt-dlp, então o cache de faixas não devolve um resultado anterior."""
+
+    def translate_path(self, path):
+        return super().translate_path('/' + path.lstrip('/').split('--')[-1])
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(pasta):
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(ServidorDeFixtures, directory=pasta))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_address[1]}'
+
+
+def coletar_etapas(vibe):
+    """Guarda cada observação do histograma de etapas do app (além de registrá-la nele)."""
+    amostras = {}
+    original = vibe.m_etapa.observar
+
+    def observar(valor, **rotulos):
+        amostras.setdefault(rotulos['etapa'], []).append(valor)
+        original(valor, **rotulos)
+
+    vibe.m_etapa.observar = observar
+    return amostras
+
+
+def criar_usuarios(vibe, quantidade):
+    from datetime import datetime, timedelta
+    from models import db, User
+    with vibe.app.app_context():
+        modelo = User(email='modelo@vibe', dj_name='Modelo')
+        modelo.set_password('bench')  # um hash só: o scrypt não entra na medição
+        for i in range(quantidade):
+            u = User(email=f'pipeline{i}@vibe', dj_name=f'Pipeline {i}', password_hash=modelo.password_hash,
+                     is_subscriber=True, subscription_expires=datetime.utcnow() + timedelta(days=1))
+            u.generate_referral()
+            db.session.add(u)
+        db.session.commit()
+
+
+# ===================================
+# FASES (cada uma num processo novo)
+# ===================================
+def fase_espectrograma(vibe, args, fixtures):
+    from jobs import Job
+    job = Job(1, [], 'mp3')
+    amostras, por_codec, cortes = [], {}, {}
+    for _ in range(args.repeticoes):
+        for f in fixtures:
+            t0 = time.perf_counter()
+            _, analises = vibe.gerar_spek(os.path.join(args.pasta_fixtures, f['nome']), f['nome'], job)
+            duracao = time.perf_counter() - t0
+            amostras.append(duracao)
+            por_codec.setdefault(f['codec'], []).append(duracao)
+            cortes[f['nome']] = {'esperado_hz': f['corte'] or None,
+                                 'detectado_hz': (analises.get('analysis') or {}).get('cutoff_hz')}
+    audio = sum(f['duracao'] for f in fixtures) * args.repeticoes
+    return {
+        'etapas': {'espectrograma': resumo(amostras, audio)},
+        'por_codec': {c: resumo(a, sum(f['duracao'] for f in fixtures if f['codec'] == c) * args.repeticoes)
+                      for c, a in por_codec.items()},
+        'cortes': cortes,
+    }
+
+
+def fase_metadados(vibe, args, fixtures):
+    from metadados import CacheDeCapas
+    from PIL import Image
+    from io import BytesIO
+    bruto = BytesIO()
+    Image.new('RGB', (1200, 1200), (40, 90, 160)).save(bruto, format='PNG')
+    t0 = time.perf_counter()
+    capa = CacheDeCapas.converter(bruto.getvalue())
+    conversao_capa = time.perf_counter() - t0
+
+    pasta = tempfile.mkdtemp(prefix='tags-', dir='.')
+    suportadas = [f for f in fixtures if f['codec'] in ('mp3', 'flac', 'wav', 'aiff')]
+    amostras, falhas = [], 0
+    for rodada in range(args.repeticoes):
+        for f in suportadas:
+            destino = os.path.join(pasta, f"{rodada}-{f['nome']}")
+            shutil.copyfile(os.path.join(args.pasta_fixtures, f['nome']), destino)
+            t0 = time.perf_counter()
+            ok = vibe.editar_metadados(destino, 'Bench', f['nome'], 'Vibe Bench', capa=capa)
+            amostras.append(time.perf_counter() - t0)
+            falhas += not ok
+    return {
+        'etapas': {'metadados': resumo(amostras), 'capa': resumo([conversao_capa])},
+        'falhas': falhas,
+        'sem_suporte': sorted({f['codec'] for f in fixtures} - {f['codec'] for f in suportadas}),
+    }
+
+
+def fase_zip(vibe, args, fixtures):
+    import zipstream
+    caminhos = [os.path.join(args.pasta_fixtures, f['nome']) for f in fixtures]
+    amostras, enviados = [], 0
+    for _ in range(max(args.repeticoes, 3)):
+        t0 = time.perf_counter()
+        pacote = zipstream.ZipEmStreaming(caminhos)
+        for parte in pacote:
+            pass
+        amostras.append(time.perf_counter() - t0)
+        enviados += pacote.enviados
+    return {'etapas': {'zip': resumo(amostras, nbytes=enviados)}, 'tamanho_zip': pacote.tamanho}
+
+
+def fase_faixas(vibe, args, fixtures):
+    from jobs import Job
+    servidor, base = servir(args.pasta_fixtures)
+    etapas = coletar_etapas(vibe)
+    falhas = 0
+    for rodada in range(args.repeticoes):
+        urls = [f"{base}/faixas{rodada}--{f['nome']}" for f in fixtures]
+        job = Job(1, urls, args.formato)
+        job.iniciado_em = time.time()
+        for indice, url in enumerate(urls, 1):
+            t0 = time.perf_counter()
+            try:
+                if not vibe.processar_faixa(job, indice, url): falhas += 1
+            except Exception as e:
+                print(f"Erro faixa {url}: {e}", file=sys.stderr)
+                falhas += 1
+            vibe.m_etapa.observar(time.perf_counter() - t0, etapa='faixa')
+    servidor.shutdown()
+    audio = sum(f['duracao'] for f in fixtures) * args.repeticoes
+    return {
+        'etapas': {etapa: resumo(a, audio if etapa in ('faixa', 'conversao', 'espectrograma') else None,
+                                 sum(f['bytes'] for f in fixtures) * args.repeticoes if etapa == 'download' else None)
+                   for etapa, a in sorted(etapas.items())},
+        'falhas': falhas,
+    }
+
+
+def fase_http(vibe, args, fixtures):
+    import requests
+    from werkzeug.serving import make_server
+    servidor_fixtures, base_fixtures = servir(args.pasta_fixtures)
+    criar_usuarios(vibe, args.clientes)
+    etapas = coletar_etapas(vibe)
+    servidor = make_server('127.0.0.1', 0, vibe.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{servidor.server_port}'
+    rotas, rotas_lock = {}, threading.Lock()
+
+    def medir(rota, sessao, metodo, url, **kwargs):
+        t0 = time.perf_counter()
+        r = sessao.request(metodo, url, **kwargs)
+        if kwargs.get('stream'):
+            r.nbytes = sum(len(b) for b in r.iter_content(256 * 1024))
+        with rotas_lock:
+            rotas.setdefault(rota, []).append(time.perf_counter() - t0)
+        return r
+
+    def cliente(i):
+        s = requests.Session()
+        medir('POST /login', s, 'POST', base + '/login', data={'email': f'pipeline{i}@vibe', 'password': 'bench'})
+        jobs, baixados = [], 0
+        for n in range(args.jobs_por_cliente):
+            escolhidas = [fixtures[(i + n + k) % len(fixtures)] for k in range(args.faixas_por_job)]
+            urls = [f"{base_fixtures}/c{i}j{n}f{k}--{f['nome']}" for k, f in enumerate(escolhidas)]
+            t0 = time.perf_counter()
+            job = medir('POST /jobs', s, 'POST', base + '/jobs', data={'urls[]': urls, 'format': args.formato}).json()
+            while job.get('status') not in ('done', 'error', 'cancelled'):
+                time.sleep(0.2)
+                job = medir('GET /jobs/<job_id>', s, 'GET', f"{base}/jobs/{job['id']}").json()
+            if job['status'] == 'done':
+                baixados += medir('GET /download/pack/<job_id>', s, 'GET',
+                                  f"{base}/download/pack/{job['id']}", stream=True).nbytes
+            jobs.append((time.perf_counter() - t0, job['status']))
+        return jobs, baixados
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.clientes) as pool:
+        resultados = list(pool.map(cliente, range(args.clientes)))
+    duracao = time.perf_counter() - inicio
+    servidor.shutdown()
+    servidor_fixtures.shutdown()
+
+    jobs = [j for r, _ in resultados for j in r]
+    concluidos = [d for d, status in jobs if status == 'done']
+    faixas = len(concluidos) * args.faixas_por_job
+    return {
+        'etapas': {etapa: resumo(a) for etapa, a in sorted(etapas.items())},
+        'rotas': {rota: resumo(a) for rota, a in sorted(rotas.items())},
+        'jobs': dict(resumo(concluidos) if concluidos else {}, total=len(jobs), concluidos=len(concluidos)),
+        'clientes': args.clientes,
+        'faixas_por_s': round(faixas / duracao, 2),
+        'requisicoes_por_s': round(sum(len(a) for a in rotas.values()) / duracao, 1),
+        'zip_mb_por_s': round(sum(b for _, b in resultados) / duracao / 1e6, 1),
+    }
+
+
+def rodar_fase(args):
+    """Processo filho: importa o app do zero, roda uma fase e imprime o JSON dela."""
+    with open(os.path.join(args.pasta_fixtures, 'fixtures.json')) as f:
+        fixtures = json.load(f)
+    os.chdir(tempfile.mkdtemp(prefix=f'{args.fase}-', dir=args.trabalho))
+    os.environ['VIBE_DATABASE_PATH'] = os.path.abspath('bench.db')
+    import app as vibe
+    vibe.verificar_e_migrar_banco()
+    inicio = time.perf_counter()
+    resultado = globals()[f'fase_{args.fase}'](vibe, args, fixtures)
+    resultado['duracao_s'] = round(time.perf_counter() - inicio, 2)
+    resultado.update(rss_pico())
+    print(json.dumps(resultado))
+
+
+# ===================================
+# ORQUESTRAÇÃO E COMPARAÇÃO
+# ===================================
+def versao_git():
+    try:
+        return subprocess.run(['git', '-C', RAIZ, 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(atual, anterior):
+    """Variação % do p50 e do p99 de cada etapa presente nas duas rodadas (negativo = melhorou)."""
+    diferencas = {}
+    for fase, dados in atual['fases'].items():
+        antes = anterior.get('fases', {}).get(fase, {}).get('etapas', {})
+        for etapa, agora in dados.get('etapas', {}).items():
+            if etapa in antes:
+                diferencas[f'{fase}.{etapa}'] = {
+                    f'{chave}_%': round((agora[chave] / antes[etapa][chave] - 1) * 100, 1)
+                    for chave in ('p50_ms', 'p99_ms') if antes[etapa].get(chave)}
+    return diferencas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duracoes', default='30,180', help='segundos de cada fixture, separados por vírgula')
+    parser.add_argument('--fixtures', default='mp3:16000,mp3:20000,m4a:19000,flac:0,wav:0',
+                        help='codec:corte_hz (codecs: %s)' % ', '.join(CODECS))
+    parser.add_argument('--fases', default=','.join(FASES))
+    parser.add_argument('--formato', default='mp3', help='formato de saída dos jobs')
+    parser.add_argument('--repeticoes', type=int, default=1)
+    parser.add_argument('--clientes', type=int, default=4, help='clientes simultâneos na fase http')
+    parser.add_argument('--jobs-por-cliente', type=int, default=2)
+    parser.add_argument('--faixas-por-job', type=int, default=3)
+    parser.add_argument('--pasta-fixtures', help='reaproveita fixtures entre rodadas (padrão: pasta temporária)')
+    parser.add_argument('--saida', help='arquivo JSON com o resultado completo')
+    parser.add_argument('--comparar', help='JSON de uma rodada anterior')
+    parser.add_argument('--fase', choices=FASES, help=argparse.SUPPRESS)
+    parser.add_argument('--trabalho', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.fase:
+        return rodar_fase(args)
+
+    ffmpeg = shutil.which('ffmpeg') or '/usr/bin/ffmpeg'
+    trabalho = tempfile.mkdtemp(prefix='vibe-pipeline-')
+    args.pasta_fixtures = os.path.abspath(args.pasta_fixtures or os.path.join(trabalho, 'fixtures'))
+    t0 = time.perf_counter()
+    fixtures = gerar_fixtures(args.pasta_fixtures, [int(d) for d in args.duracoes.split(',')],
+                              args.fixtures.split(','), ffmpeg)
+    with open(os.path.join(args.pasta_fixtures, 'fixtures.json'), 'w') as f:
+        json.dump(fixtures, f)
+    geracao = time.perf_counter() - t0
+
+    repassados = ['--formato', args.formato, '--repeticoes', str(args.repeticoes), '--clientes', str(args.clientes),
+                  '--jobs-por-cliente', str(args.jobs_por_cliente), '--faixas-por-job', str(args.faixas_por_job),
+                  '--pasta-fixtures', args.pasta_fixtures, '--trabalho', trabalho]
+    fases = {}
+    for fase in args.fases.split(','):
+        processo = subprocess.run([sys.executable, os.path.abspath(__file__), '--fase', fase, *repassados],
+                                  capture_output=True, text=True)
+        if processo.returncode:
+            fases[fase] = {'erro': processo.stderr.strip().splitlines()[-1:]}
+            continue
+        fases[fase] = json.loads(processo.stdout.strip().splitlines()[-1])
+
+    versao_ffmpeg = subprocess.run([ffmpeg, '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    resultado = {
+        'data': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': versao_git(),
+        'ambiente': {'python': platform.python_version(), 'cpus': os.cpu_count(), 'ffmpeg': versao_ffmpeg},
+        'parametros': {chave: valor for chave, valor in vars(args).items() if chave not in ('fase', 'trabalho', 'saida', 'comparar')},
+        'fixtures': fixtures,
+        'geracao_fixtures_s': round(geracao, 2),
+        'fases': fases,
+    }
+    if args.comparar:
+        with open(args.comparar) as f:
+            resultado['comparacao'] = comparar(resultado, json.load(f))
+
+    saida = args.saida or os.path.join(RAIZ, 'bench', 'resultados', f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    shutil.rmtree(trabalho, ignore_errors=True)
+
+    linha = {'saida': saida, 'fases_com_erro': [f for f, d in fases.items() if 'erro' in d]}
+    for fase, dados in fases.items():
+        for etapa, numeros in dados.get('etapas', {}).items():
+            linha[f'{fase}.{etapa}'] = {'p50_ms': numeros['p50_ms'], 'p99_ms': numeros['p99_ms']}
+        if 'rss_pico_mb' in dados:
+            linha[f'{fase}.rss_pico_mb'] = dados['rss_pico_mb']
+    if 'comparacao' in resultado:
+        linha['comparacao'] = resultado['comparacao']
+    print(json.dumps(linha, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Mede o boot de um worker: tempo de `import app`, primeira resposta e RSS.
+
+Cada medição roda num processo Python novo (como um worker recém-criado do Gunicorn),
+com banco SQLite temporário já migrado. Reporta a mediana de --repeticoes rodadas.
+
+Uso:
+    python bench/startup.py --repeticoes 5
+Saída: uma linha JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SONDA = r'''
+import sys, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, RAIZ)
+import app as vibe
+t_import = time.perf_counter() - t0
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for linha in f:
+            if linha.startswith('VmRSS:'):
+                return int(linha.split()[1]) / 1024
+
+rss_import = rss_mb()
+cliente = vibe.app.test_client()
+t1 = time.perf_counter()
+status = cliente.get('/login').status_code
+t_login = time.perf_counter() - t1
+t2 = time.perf_counter()
+cliente.get('/')
+t_landing = time.perf_counter() - t2
+pesados = [m for m in ('yt_dlp', 'numpy', 'PIL.Image', 'mercadopago', 'mutagen', 'spek', 'analise', 'librosa', 'matplotlib') if m in sys.modules]
+print(json.dumps({'import_s': t_import, 'primeiro_login_s': t_login, 'landing_s': t_landing,
+                  'rss_mb': rss_import, 'rss_apos_requisicoes_mb': rss_mb(), 'status_login': status,
+                  'modulos_pesados_carregados': pesados}))
+'''
+
+
+def rodar(trabalho, ambiente):
+    codigo = 'RAIZ = %r\n' % RAIZ + SONDA
+    saida = subprocess.run([sys.executable, '-c', codigo], cwd=trabalho, env=ambiente,
+                           capture_output=True, text=True, check=True).stdout
+    return json.loads(saida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    args = parser.parse_args()
+
+    trabalho = tempfile.mkdtemp(prefix='vibe-boot-')
+    ambiente = dict(os.environ, VIBE_DATABASE_PATH=os.path.join(trabalho, 'boot.db'))
+    # Migra uma vez fora da medição (em produção isso é um passo do deploy)
+    subprocess.run([sys.executable, '-m', 'flask', '--app', os.path.join(RAIZ, 'app'), 'migrar'],
+                   cwd=trabalho, env=ambiente, capture_output=True)
+
+    rodadas = [rodar(trabalho, ambiente) for _ in range(args.repeticoes)]
+    resultado = {chave: round(statistics.median(r[chave] for r in rodadas), 4)
+                 for chave in ('import_s', 'primeiro_login_s', 'landing_s', 'rss_mb', 'rss_apos_requisicoes_mb')}
+    resultado['modulos_pesados_carregados'] = rodadas[-1]['modulos_pesados_carregados']
+    resultado['repeticoes'] = args.repeticoes
+    print(json.dumps(resultado))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Rajada de webhooks do Mercado Pago contra o app, tudo local (sem a API real).
+
+Sobe o MP falso e o app (banco SQLite temporário), cria pagamentos PIX pelo fluxo
+normal (/create_pix_payment), aprova todos no MP falso e dispara as notificações,
+com duplicatas, em paralelo. Mede a latência do ACK do webhook e o tempo até a inbox
+esvaziar, e confere que cada pagamento foi aplicado uma única vez.
+
+Uso:
+    python bench/webhook_burst.py --pagamentos 200 --duplicatas 5 --clientes 32 --latencia 0.05
+Saída: uma linha JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_mercadopago import MercadoPagoFalso  # noqa: E402
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pagamentos', type=int, default=200)
+    parser.add_argument('--duplicatas', type=int, default=5, help='notificações por pagamento')
+    parser.add_argument('--usuarios', type=int, default=10)
+    parser.add_argument('--clientes', type=int, default=32, help='conexões simultâneas disparando webhooks')
+    parser.add_argument('--latencia', type=float, default=0.05, help='latência simulada da API do MP (s)')
+    parser.add_argument('--porta-mp', type=int, default=8900)
+    parser.add_argument('--porta-app', type=int, default=8901)
+    args = parser.parse_args()
+
+    trabalho = tempfile.mkdtemp(prefix='vibe-bench-')
+    mp = MercadoPagoFalso(latencia=args.latencia)
+    servidor_mp = mp.servidor(porta=args.porta_mp)
+    threading.Thread(target=servidor_mp.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        'VIBE_DATABASE_PATH': os.path.join(trabalho, 'bench.db'),
+        'MERCADOPAGO_ACCESS_TOKEN': 'TEST-bench',
+        'MERCADOPAGO_API_URL': f'http://127.0.0.1:{args.porta_mp}',
+    })
+    os.chdir(trabalho)  # downloads/, static/ e cache/ do app ficam no diretório temporário
+    import app as vibe
+    from models import db, User, Payment, WebhookEvent
+    from werkzeug.serving import make_server
+
+    servidor_app = make_server('127.0.0.1', args.porta_app, vibe.app, threaded=True)
+    threading.Thread(target=servidor_app.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{args.porta_app}'
+
+    vibe.verificar_e_migrar_banco()  # em produção é o passo `flask migrar` do deploy
+    with vibe.app.app_context():
+        for i in range(args.usuarios):
+            u = User(email=f'bench{i}@vibe', dj_name=f'Bench {i}')
+            u.set_password('bench')
+            u.generate_referral()
+            db.session.add(u)
+        db.session.commit()
+
+    sessoes = []
+    for i in range(args.usuarios):
+        s = requests.Session()
+        s.post(base + '/login', data={'email': f'bench{i}@vibe', 'password': 'bench'})
+        sessoes.append(s)
+
+    def criar(i):
+        r = sessoes[i % len(sessoes)].post(base + '/create_pix_payment', json={'amount': 25})
+        return r.json()['success']
+
+    with ThreadPoolExecutor(args.clientes) as pool:
+        criados = sum(pool.map(criar, range(args.pagamentos)))
+    ids = list(mp.pagamentos)
+    for pid in ids:
+        mp.pagamentos[pid]['status'] = 'approved'
+    gets_antes = mp.chamadas['get']
+
+    notificacoes = [pid for pid in ids for _ in range(args.duplicatas)]
+    latencias = []
+    falhas = 0
+    cliente = requests.Session()
+    cliente.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.clientes))
+
+    def notificar(pid):
+        t0 = time.perf_counter()
+        r = cliente.post(base + '/webhook/mercadopago',
+                         json={'action': 'payment.updated', 'type': 'payment', 'data': {'id': str(pid)}})
+        return time.perf_counter() - t0, r.status_code
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.clientes) as pool:
+        for duracao, status in pool.map(notificar, notificacoes):
+            latencias.append(duracao)
+            falhas += status != 200
+    fim_rajada = time.perf_counter()
+
+    with vibe.app.app_context():
+        while True:
+            aprovados = Payment.query.filter_by(status='approved').count()
+            restantes = WebhookEvent.query.filter(WebhookEvent.status.in_(('pending', 'processing', 'retry'))).count()
+            if (aprovados >= criados and not restantes) or time.perf_counter() - inicio > 300:
+                break
+            db.session.remove()
+            time.sleep(0.05)
+        fim = time.perf_counter()
+        eventos = WebhookEvent.query.count()
+        erros = WebhookEvent.query.filter_by(status='error').count()
+        aplicacoes = Payment.query.filter(Payment.approved_at.isnot(None)).count()
+
+    print(json.dumps({
+        'pagamentos': criados,
+        'notificacoes': len(notificacoes),
+        'ack_falhas': falhas,
+        'ack_p50_ms': round(statistics.median(latencias) * 1000, 2),
+        'ack_p99_ms': round(percentil(latencias, 99) * 1000, 2),
+        'ack_por_s': round(len(notificacoes) / (fim_rajada - inicio), 1),
+        'ate_aplicar_tudo_s': round(fim - inicio, 3),
+        'eventos_na_inbox': eventos,
+        'eventos_com_erro': erros,
+        'gets_no_mp': mp.chamadas['get'] - gets_antes,
+        'aprovados': aprovados,
+        'aprovacoes_aplicadas': aplicacoes,
+        'latencia_mp_s': args.latencia,
+    }))
+    servidor_app.shutdown()
+    servidor_mp.shutdown()
+
+
+if __name__ == '__main__':
+    main()
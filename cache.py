@@ -0,0 +1,181 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+
+# ===================================
+# CACHE DE FAIXAS CONVERTIDAS (ENDEREÇADO POR CONTEÚDO)
+# ===================================
+CACHE_DIR = os.getenv('VIBE_CACHE_DIR', os.path.join('cache', 'faixas'))
+CACHE_MAX_MB = int(os.getenv('VIBE_CACHE_MAX_MB', '5120'))
+CACHE_MAX_DIAS = int(os.getenv('VIBE_CACHE_MAX_DIAS', '30'))
+
+META_FILE = 'meta.json'
+
+
+class CacheDeFaixas:
+    """Guarda áudio convertido + espectrograma + análise por (extrator, id, formato, qualidade).
+
+    Cada entrada é uma pasta `<raiz>/<ab>/<chave>/` com o áudio, o PNG e um meta.json.
+    O mtime do meta.json marca o último acesso e é a base da remoção LRU; a idade
+    (`max_idade`) conta sempre de `criado_em`, na leitura e na remoção: uma faixa muito
+    acessada vence do mesmo jeito que uma esquecida.
+    """
+
+    def __init__(self, raiz=CACHE_DIR, max_bytes=CACHE_MAX_MB * 1024 * 1024, max_idade=CACHE_MAX_DIAS * 86400):
+        self.raiz = raiz
+        self.max_bytes = max_bytes
+        self.max_idade = max_idade
+        self.hits = 0
+        self.misses = 0
+        self.bytes_economizados = 0
+        self._tamanho = None  # calculado sob demanda na primeira escrita
+        self._lock = threading.Lock()
+        os.makedirs(self.raiz, exist_ok=True)
+
+    @staticmethod
+    def chave(extractor, video_id, format_type, quality):
+        if not extractor or not video_id:
+            return None
+        bruto = f'{extractor.lower()}:{video_id}:{format_type}:{quality}'
+        return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+    def _pasta(self, chave):
+        return os.path.join(self.raiz, chave[:2], chave)
+
+    def obter(self, chave):
+        """Retorna o meta da entrada (com caminhos absolutos) ou None."""
+        if not chave:
+            return None
+        pasta = self._pasta(chave)
+        meta_path = os.path.join(pasta, META_FILE)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+            if time.time() - meta['criado_em'] > self.max_idade:
+                tamanho = self._tamanho_pasta(pasta)
+                self._remover(pasta)
+                with self._lock:
+                    if self._tamanho is not None:
+                        self._tamanho = max(0, self._tamanho - tamanho)
+                raise FileNotFoundError(meta_path)
+            meta['audio_path'] = os.path.join(pasta, meta['audio'])
+            meta['spek_path'] = os.path.join(pasta, meta['spek']) if meta.get('spek') else None
+            if not os.path.exists(meta['audio_path']):
+                raise FileNotFoundError(meta['audio_path'])
+            os.utime(meta_path)  # marca o acesso (LRU)
+        except (OSError, ValueError, KeyError):
+            with self._lock: self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_economizados += meta.get('tamanho', 0)
+        return meta
+
+    def guardar(self, chave, audio_path, spek_path=None, info=None):
+        """Copia os artefatos de uma faixa recém-processada para o cache."""
+        if not chave:
+            return
+        destino = self._pasta(chave)
+        if os.path.exists(destino):
+            return
+        temp = os.path.join(self.raiz, f'.tmp-{uuid.uuid4().hex}')
+        try:
+            os.makedirs(temp)
+            audio_nome = os.path.basename(audio_path)
+            shutil.copyfile(audio_path, os.path.join(temp, audio_nome))
+            spek_nome = None
+            if spek_path and os.path.exists(spek_path):
+                spek_nome = 'spek.png'
+                shutil.copyfile(spek_path, os.path.join(temp, spek_nome))
+            tamanho = os.path.getsize(audio_path)
+            meta = {
+                'audio': audio_nome, 'spek': spek_nome, 'info': info or {},
+                'tamanho': tamanho, 'criado_em': time.time(),
+            }
+            with open(os.path.join(temp, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.rename(temp, destino)
+        except OSError as e:
+            # Outra thread pode ter gravado a mesma faixa primeiro
+            shutil.rmtree(temp, ignore_errors=True)
+            if not os.path.exists(destino):
+                print(f"Erro cache: {e}")
+            return
+
+        with self._lock:
+            if self._tamanho is None:
+                self._tamanho = self._calcular_tamanho()
+            else:
+                self._tamanho += self._tamanho_pasta(destino)
+            if self._tamanho > self.max_bytes:
+                self._evictar()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            if self._tamanho is None:
+                self._tamanho = self._calcular_tamanho()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'bytes_economizados': self.bytes_economizados,
+                'bytes_em_uso': self._tamanho,
+                'bytes_maximo': self.max_bytes,
+            }
+
+    def _entradas(self):
+        for prefixo in os.listdir(self.raiz):
+            base = os.path.join(self.raiz, prefixo)
+            if prefixo.startswith('.') or not os.path.isdir(base):
+                continue
+            for chave in os.listdir(base):
+                yield os.path.join(base, chave)
+
+    @staticmethod
+    def _tamanho_pasta(pasta):
+        total = 0
+        for nome in os.listdir(pasta):
+            try: total += os.path.getsize(os.path.join(pasta, nome))
+            except OSError: pass
+        return total
+
+    def _calcular_tamanho(self):
+        return sum(self._tamanho_pasta(p) for p in self._entradas())
+
+    def _evictar(self):
+        """Remove entradas vencidas e, depois, as menos usadas até caber no limite."""
+        agora = time.time()
+        entradas = []
+        for pasta in self._entradas():
+            try:
+                acesso = os.path.getmtime(os.path.join(pasta, META_FILE))
+            except OSError:
+                acesso = 0
+            entradas.append((acesso, pasta, self._tamanho_pasta(pasta)))
+        entradas.sort()
+        total = sum(t for _, _, t in entradas)
+        for _, pasta, tamanho in entradas:
+            if total <= self.max_bytes and agora - self._criado_em(pasta) <= self.max_idade:
+                continue
+            self._remover(pasta)
+            total -= tamanho
+        self._tamanho = total
+
+    @staticmethod
+    def _criado_em(pasta):
+        # Mesma regra de obter(): meta ilegível conta como vencido
+        try:
+            with open(os.path.join(pasta, META_FILE), encoding='utf-8') as f:
+                return json.load(f)['criado_em']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    @staticmethod
+    def _remover(pasta):
+        shutil.rmtree(pasta, ignore_errors=True)
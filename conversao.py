@@ -0,0 +1,139 @@
+import os
+import re
+import subprocess
+import time
+import uuid
+
+# ===================================
+# CONVERSÃO SEM REENCODE DESNECESSÁRIO
+# ===================================
+# O yt-dlp só baixa (com format_selector preferindo o codec de saída); a decisão do
+# que fazer com o arquivo é daqui: manter, copiar o stream para outro contêiner,
+# converter sem perda (FLAC <-> PCM) ou, só quando não há jeito, transcodificar.
+CODECS_SEM_PERDA = ('flac', 'alac', 'wavpack', 'ape', 'tta', 'truehd', 'mlp')
+
+# Ordem de preferência do yt-dlp por formato de saída; `abr>=?` aceita abr desconhecido
+SELETORES = {
+    'mp3': 'bestaudio[acodec=mp3][abr>=?192]/bestaudio[ext=mp3][abr>=?192]/bestaudio/best',
+    'flac': 'bestaudio[acodec=flac]/bestaudio[acodec=alac]/bestaudio[acodec^=pcm]/bestaudio/best',
+    'wav': 'bestaudio[acodec^=pcm]/bestaudio[acodec=flac]/bestaudio[acodec=alac]/bestaudio/best',
+    'aiff': 'bestaudio[acodec^=pcm]/bestaudio[acodec=flac]/bestaudio[acodec=alac]/bestaudio/best',
+}
+
+_RE_CONTEINER = re.compile(r"^Input #0, (.+?), from '", re.M)
+_RE_AUDIO = re.compile(r'Stream #0:\d+\S*: Audio: (\w+)[^,\n]*, (\d+) Hz, [^,\n]+, (\w+)( \(\d+ bit\))?(?:, (\d+) kb/s)?')
+_RE_BITS = re.compile(r'(\d+) bit')
+
+
+def seletor_de_formato(format_type):
+    return SELETORES.get(format_type, 'bestaudio/best')
+
+
+def sem_perda(codec):
+    return bool(codec) and (codec in CODECS_SEM_PERDA or codec.startswith('pcm_'))
+
+
+def sondar(caminho, ffmpeg='ffmpeg'):
+    """Codec, contêiner, taxa, bits e kb/s do primeiro stream de áudio (via `ffmpeg -i`; sem ffprobe).
+
+    Retorna None se o FFmpeg não reconhecer áudio no arquivo.
+    """
+    proc = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-i', caminho],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+    audio = _RE_AUDIO.search(proc.stderr)
+    if not audio:
+        return None
+    codec, hz, formato, bits, kbps = audio.groups()
+    conteiner = _RE_CONTEINER.search(proc.stderr)
+    if bits:
+        bits = int(_RE_BITS.search(bits).group(1))
+    else:
+        bits = {'s16': 16, 's16p': 16, 'u8': 8, 's32': 32, 's32p': 32}.get(formato)
+    return {
+        'codec': codec,
+        'conteiner': conteiner.group(1) if conteiner else None,
+        'hz': int(hz),
+        'bits': bits,
+        'kbps': int(kbps) if kbps else None,
+    }
+
+
+def _pcm(origem, ordem):
+    # 24 bits do FLAC/ALAC/PCM continuam 24; o resto (inclusive float de codecs com perda) vira 16
+    bits = 24 if sem_perda(origem['codec']) and (origem['bits'] or 16) > 16 else 16
+    return f'pcm_s{bits}{ordem}'
+
+
+def planejar(origem, ext_origem, format_type, qualidade):
+    """(ação, argumentos do FFmpeg) para levar `origem` a `format_type`.
+
+    Ações: 'mantido' (já é o arquivo final), 'copia' (só troca o contêiner),
+    'sem_perda' (FLAC <-> PCM, bit a bit) e 'transcodificacao' (encoder com perda, ou
+    origem com perda virando formato sem perda).
+    """
+    codec = origem['codec']
+    if format_type == 'mp3':
+        if codec == 'mp3':
+            return ('mantido', None) if ext_origem == 'mp3' else ('copia', ['-c:a', 'copy', '-f', 'mp3'])
+        return 'transcodificacao', ['-c:a', 'libmp3lame', '-b:a', f'{qualidade}k', '-f', 'mp3']
+    if format_type == 'flac':
+        if codec == 'flac':
+            return ('mantido', None) if ext_origem == 'flac' else ('copia', ['-c:a', 'copy', '-f', 'flac'])
+        return 'sem_perda' if sem_perda(codec) else 'transcodificacao', ['-c:a', 'flac', '-f', 'flac']
+    if format_type in ('wav', 'aiff'):
+        ordem, conteiner = ('le', 'wav') if format_type == 'wav' else ('be', 'aiff')
+        alvo = _pcm(origem, ordem)
+        if codec == alvo:
+            return ('mantido', None) if ext_origem in (format_type, 'aif') else ('copia', ['-c:a', 'copy', '-f', conteiner])
+        return 'sem_perda' if sem_perda(codec) else 'transcodificacao', ['-c:a', alvo, '-f', conteiner]
+    raise ValueError(f'Formato de saída sem suporte: {format_type}')
+
+
+def _rodar_ffmpeg(cmd):
+    """Roda o FFmpeg e devolve o tempo de CPU (usuário + sistema) só desse processo."""
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    erro = proc.stderr.read()
+    proc.stderr.close()
+    # wait4 em vez de wait(): traz o rusage do filho, sem misturar com outras faixas em paralelo
+    _, status, uso = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode:
+        raise RuntimeError(f'FFmpeg falhou ({proc.returncode}): {erro.decode(errors="replace").strip()[-300:]}')
+    return uso.ru_utime + uso.ru_stime
+
+
+def converter(caminho, format_type, qualidade='320', ffmpeg='ffmpeg'):
+    """Leva o arquivo baixado ao formato de saída e devolve (caminho_final, relatório).
+
+    O original é apagado quando vira outro arquivo. O relatório vai para o files_info:
+    {'acao', 'origem': {codec, conteiner, hz, bits, kbps}, 'destino', 'perda_na_origem',
+    'ffmpeg_cpu_s', 'segundos'}.
+    """
+    inicio = time.perf_counter()
+    origem = sondar(caminho, ffmpeg)
+    if origem is None:
+        raise RuntimeError(f'Nenhum stream de áudio em {os.path.basename(caminho)}')
+    base, ext = os.path.splitext(caminho)
+    acao, argumentos = planejar(origem, ext.lstrip('.').lower(), format_type, qualidade)
+    destino = caminho if acao == 'mantido' else f'{base}.{format_type}'
+    cpu = 0.0
+    if acao != 'mantido':
+        temp = f'{base}.{uuid.uuid4().hex[:8]}.tmp'
+        cmd = [ffmpeg, '-v', 'error', '-y', '-i', caminho, '-map', '0:a:0', '-vn', '-sn', '-dn', *argumentos, temp]
+        try:
+            cpu = _rodar_ffmpeg(cmd)
+            os.replace(temp, destino)
+        except BaseException:
+            try: os.remove(temp)
+            except OSError: pass
+            raise
+        if destino != caminho:
+            os.remove(caminho)
+    return destino, {
+        'acao': acao,
+        'origem': origem,
+        'destino': format_type,
+        'perda_na_origem': format_type != 'mp3' and not sem_perda(origem['codec']),
+        'ffmpeg_cpu_s': round(cpu, 3),
+        'segundos': round(time.perf_counter() - inicio, 3),
+    }
@@ -0,0 +1,139 @@
+import os
+import json
+import queue
+import threading
+import time
+import itertools
+from collections import deque
+
+# ===================================
+# EVENTOS EM TEMPO REAL (PUB/SUB + SERVER-SENT EVENTS)
+# ===================================
+SSE_BUFFER = int(os.getenv('VIBE_SSE_BUFFER', '200'))  # eventos guardados por usuário (replay com Last-Event-ID)
+SSE_MAX_POR_USUARIO = int(os.getenv('VIBE_SSE_MAX_POR_USUARIO', '2'))  # cada stream ocupa uma thread do Gunicorn
+SSE_KEEPALIVE = int(os.getenv('VIBE_SSE_KEEPALIVE', '15'))
+SSE_DURACAO = int(os.getenv('VIBE_SSE_DURACAO', '600'))  # depois disso o navegador reconecta sozinho
+SSE_DURACAO_PAGAMENTO = int(os.getenv('VIBE_SSE_DURACAO_PAGAMENTO', '120'))  # tela do QR Code
+# Teto de streams abertos somando todos os usuários. Fica abaixo das threads do Gunicorn
+# (gunicorn.conf.py): o resto atende páginas, downloads e o webhook do Mercado Pago
+SSE_MAX_GLOBAL = int(os.getenv('VIBE_SSE_MAX_GLOBAL', '16'))
+SSE_RETRY_OCUPADO = int(os.getenv('VIBE_SSE_RETRY_OCUPADO', '15'))  # segundos até tentar de novo quando lotado
+SSE_FILA_MAX = 500
+BUFFER_TTL = 3600
+
+
+class Assinatura:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.fila = queue.Queue(maxsize=SSE_FILA_MAX)
+        self.encerrada = False
+
+    def entregar(self, evento):
+        try:
+            self.fila.put_nowait(evento)
+        except queue.Full:
+            # Cliente lento demais: derruba o stream; ao reconectar ele recebe o replay
+            self.encerrar()
+
+    def encerrar(self):
+        self.encerrada = True
+        try: self.fila.put_nowait(None)
+        except queue.Full: pass
+
+
+class Broker:
+    """Canal de eventos por usuário, em memória (um único processo Gunicorn).
+
+    Cada evento é (id, tipo, dados). Os últimos `buffer` eventos de cada usuário ficam
+    guardados para que uma reconexão com Last-Event-ID não perca nada.
+    """
+
+    def __init__(self, buffer=SSE_BUFFER, max_por_usuario=SSE_MAX_POR_USUARIO, max_global=SSE_MAX_GLOBAL):
+        self.buffer = buffer
+        self.max_por_usuario = max_por_usuario
+        self.max_global = max_global
+        self._ids = itertools.count(1)
+        self._historico = {}  # user_id -> (deque de eventos, último publish)
+        self._assinaturas = {}  # user_id -> [Assinatura]
+        self._lock = threading.Lock()
+
+    def publicar(self, user_id, tipo, dados):
+        with self._lock:
+            evento = (next(self._ids), tipo, dados)
+            if evento[0] % 1000 == 0: self._podar()
+            historico, _ = self._historico.get(user_id) or (deque(maxlen=self.buffer), 0)
+            historico.append(evento)
+            self._historico[user_id] = (historico, time.time())
+            assinaturas = list(self._assinaturas.get(user_id, ()))
+        for assinatura in assinaturas:
+            assinatura.entregar(evento)
+        return evento[0]
+
+    def assinar(self, user_id, ultimo_id=None):
+        """Nova assinatura; com `ultimo_id`, reenfileira o que o cliente perdeu.
+
+        Retorna None quando já há `max_global` streams abertos: quem chamou responde na
+        hora (sem segurar uma thread) e o navegador tenta de novo mais tarde. Um usuário
+        no próprio limite sempre entra, porque a aba nova só substitui a mais antiga.
+        """
+        assinatura = Assinatura(user_id)
+        with self._lock:
+            lista = self._assinaturas.get(user_id, [])
+            total = sum(len(l) for l in self._assinaturas.values())
+            if total >= self.max_global and len(lista) < self.max_por_usuario:
+                return None
+            lista = self._assinaturas.setdefault(user_id, lista)
+            lista.append(assinatura)
+            # Abas demais: a mais antiga é fechada para não esgotar as threads
+            while len(lista) > self.max_por_usuario:
+                lista.pop(0).encerrar()
+            if ultimo_id is not None:
+                historico, _ = self._historico.get(user_id, ((), 0))
+                for evento in historico:
+                    if evento[0] > ultimo_id: assinatura.entregar(evento)
+        return assinatura
+
+    def perdidos(self, user_id, ultimo_id):
+        """Eventos guardados do usuário depois de `ultimo_id` (replay sem abrir assinatura)."""
+        with self._lock:
+            historico, _ = self._historico.get(user_id, ((), 0))
+            return [evento for evento in historico if evento[0] > ultimo_id]
+
+    def conexoes(self):
+        """Streams SSE abertos agora (todos os usuários)."""
+        with self._lock:
+            return sum(len(lista) for lista in self._assinaturas.values())
+
+    def cancelar(self, assinatura):
+        assinatura.encerrar()
+        with self._lock:
+            lista = self._assinaturas.get(assinatura.user_id, [])
+            if assinatura in lista: lista.remove(assinatura)
+            if not lista: self._assinaturas.pop(assinatura.user_id, None)
+
+    def escutar(self, assinatura, keepalive=SSE_KEEPALIVE, duracao=SSE_DURACAO):
+        """Gera eventos da assinatura; None a cada `keepalive` segundos sem eventos."""
+        limite = time.time() + duracao
+        while not assinatura.encerrada and time.time() < limite:
+            try:
+                evento = assinatura.fila.get(timeout=keepalive)
+            except queue.Empty:
+                yield None
+                continue
+            if evento is None: return
+            yield evento
+
+    def _podar(self):
+        """Descarta históricos de usuários sem eventos há mais de BUFFER_TTL."""
+        limite = time.time() - BUFFER_TTL
+        for user_id in [u for u, (_, t) in self._historico.items() if t < limite]:
+            del self._historico[user_id]
+
+
+def formatar(evento_id, tipo, dados):
+    """Serializa um evento no formato text/event-stream."""
+    linhas = []
+    if evento_id is not None: linhas.append(f'id: {evento_id}')
+    linhas.append(f'event: {tipo}')
+    linhas.append(f'data: {json.dumps(dados, ensure_ascii=False)}')
+    return '\n'.join(linhas) + '\n\n'
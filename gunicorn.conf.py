@@ -0,0 +1,23 @@
+# ===================================
+# GUNICORN (usado pelo vibe.service)
+# ===================================
+# Processo único com threads: a fila de downloads e os streams SSE vivem em memória.
+# Cada stream SSE (/eventos) ocupa uma thread enquanto está aberto, com ou sem job
+# rodando: até VIBE_SSE_DURACAO (600 s), e o navegador reabre em seguida. Progresso e
+# pagamento somam no teto VIBE_SSE_MAX_GLOBAL (eventos.py), que deve ficar abaixo de
+# `threads` para sobrar vaga para páginas, downloads e o webhook do Mercado Pago.
+bind = '0.0.0.0:5000'
+workers = 1
+worker_class = 'gthread'
+threads = 32
+timeout = 60
+
+# O master importa o app uma vez; um worker reiniciado nasce do fork já pronto
+# (copy-on-write) em vez de repetir o import. Nada no import abre banco ou threads.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Threads de fundo não atravessam o fork: sobem aqui, já no worker
+    from app import iniciar_servicos
+    iniciar_servicos()
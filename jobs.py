@@ -0,0 +1,310 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# ===================================
+# FILA DE JOBS (PROCESSAMENTO EM SEGUNDO PLANO)
+# ===================================
+JOB_MAX_PENDENTES = int(os.getenv('VIBE_JOB_MAX_PENDENTES', '20'))
+JOB_MAX_POR_USUARIO = int(os.getenv('VIBE_JOB_MAX_POR_USUARIO', '2'))
+JOB_TTL = int(os.getenv('VIBE_JOB_TTL', '3600'))  # segundos que um job finalizado fica consultável
+
+# Paralelismo por faixa (1 e 1 = modo sequencial antigo)
+FAIXAS_SIMULTANEAS = int(os.getenv('VIBE_FAIXAS_SIMULTANEAS', '4'))
+FAIXAS_POR_USUARIO = int(os.getenv('VIBE_FAIXAS_POR_USUARIO', '2'))
+
+ESTADOS_FINAIS = ('done', 'error', 'cancelled')
+
+# Intervalo mínimo entre eventos de progresso da mesma faixa (mudança de etapa sai na hora)
+PROGRESSO_INTERVALO = float(os.getenv('VIBE_PROGRESSO_INTERVALO', '0.5'))
+
+
+class JobCancelado(Exception):
+    """Levantada dentro do pipeline quando o usuário cancela o job."""
+
+
+class FilaCheia(Exception):
+    """A fila atingiu o limite global ou o limite do usuário."""
+
+
+class Job:
+    def __init__(self, user_id, urls, format_type, ao_mudar=None, playlist=False, somente_novas=False):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.origens = list(urls)  # links colados pelo usuário
+        # Uma URL por faixa. Em modo playlist começa vazia e cresce conforme as listas são expandidas
+        self.urls = [] if playlist else list(urls)
+        self.playlist = playlist
+        self.somente_novas = somente_novas
+        self.format_type = format_type
+        self.status = 'queued'  # queued | running | done | error | cancelled
+        self._etapa = 'Na fila...'
+        self.faixas = {}  # indice -> progresso da faixa (etapa, bytes, velocidade, eta...)
+        self.resultado = None
+        self.erro = None
+        self.criado_em = time.time()
+        self.iniciado_em = None
+        self.finalizado_em = None
+        self._cancelar = threading.Event()
+        self._ao_mudar = ao_mudar  # ao_mudar(job, tipo, dados): 'job' ou 'faixa'
+        self._ultimo_progresso = {}
+
+    @property
+    def etapa(self):
+        return self._etapa
+
+    @etapa.setter
+    def etapa(self, texto):
+        self._etapa = texto
+        self.notificar()
+
+    def notificar(self, tipo='job', dados=None):
+        if self._ao_mudar:
+            try:
+                self._ao_mudar(self, tipo, dados)
+            except Exception as e:
+                print(f"Erro evento job {self.id}: {e}")
+
+    def adicionar_url(self, url):
+        """Acrescenta uma faixa descoberta na expansão de uma playlist; retorna o índice (1-based)."""
+        self.urls.append(url)
+        return len(self.urls)
+
+    def atualizar_faixa(self, indice, **dados):
+        """Atualiza o progresso de uma faixa; publica no máximo a cada PROGRESSO_INTERVALO."""
+        faixa = self.faixas.setdefault(indice, {'indice': indice, 'url': self.urls[indice - 1]})
+        mudou_etapa = dados.get('etapa', faixa.get('etapa')) != faixa.get('etapa')
+        faixa.update(dados)
+        agora = time.monotonic()
+        if mudou_etapa or agora - self._ultimo_progresso.get(indice, 0) >= PROGRESSO_INTERVALO:
+            self._ultimo_progresso[indice] = agora
+            self.notificar('faixa', dict(faixa, job=self.id))
+
+    @property
+    def cancelado(self):
+        return self._cancelar.is_set()
+
+    @property
+    def finalizado(self):
+        return self.status in ESTADOS_FINAIS
+
+    def verificar_cancelamento(self):
+        if self._cancelar.is_set():
+            raise JobCancelado()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'etapa': self.etapa,
+            'urls': self.urls,
+            'origens': self.origens,
+            'playlist': self.playlist,
+            'format': self.format_type,
+            'erro': self.erro,
+            'faixas': [self.faixas[i] for i in sorted(self.faixas)],
+            'criado_em': self.criado_em,
+            'iniciado_em': self.iniciado_em,
+            'finalizado_em': self.finalizado_em,
+        }
+
+
+class FilaDeJobs:
+    """Executa os jobs fora do ciclo da requisição, uma thread por job ativo.
+
+    A thread de um job só expande playlists e espera as faixas dele no PoolDeFaixas, que
+    é quem limita downloads e FFmpeg. Por isso há tantas threads quanto jobs admitidos
+    (`max_pendentes`): um job aceito nunca espera outro acabar para pôr as faixas na
+    fila justa do pool; com menos threads, duas playlists longas prenderiam todas e o
+    job de 3 links de um terceiro usuário ficaria 'queued' até uma delas terminar.
+    """
+
+    def __init__(self, max_pendentes=JOB_MAX_PENDENTES, max_por_usuario=JOB_MAX_POR_USUARIO,
+                 ttl=JOB_TTL, ao_mudar=None, ao_terminar=None):
+        self.ao_mudar = ao_mudar
+        self.ao_terminar = ao_terminar  # ao_terminar(job) depois que um job que rodou chega ao estado final
+        self.max_pendentes = max_pendentes
+        self.max_por_usuario = max_por_usuario
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_pendentes, thread_name_prefix='vibe-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submeter(self, user_id, urls, format_type, func, playlist=False, somente_novas=False):
+        """Enfileira `func(job)` e retorna o Job imediatamente."""
+        with self._lock:
+            self._remover_expirados()
+            ativos = [j for j in self._jobs.values() if not j.finalizado]
+            if len(ativos) >= self.max_pendentes:
+                raise FilaCheia('Servidor ocupado. Tente novamente em instantes.')
+            if sum(1 for j in ativos if j.user_id == user_id) >= self.max_por_usuario:
+                raise FilaCheia('Você já tem downloads em andamento. Aguarde terminarem.')
+            job = Job(user_id, urls, format_type, ao_mudar=self.ao_mudar, playlist=playlist, somente_novas=somente_novas)
+            self._jobs[job.id] = job
+        job.notificar()
+        self._executor.submit(self._executar, job, func)
+        return job
+
+    def obter(self, job_id, user_id=None):
+        job = self._jobs.get(job_id)
+        if job is None or (user_id is not None and job.user_id != user_id):
+            return None
+        return job
+
+    def contagem(self):
+        """Jobs ainda consultáveis por status (profundidade da fila para o /metrics)."""
+        contagem = dict.fromkeys(('queued', 'running') + ESTADOS_FINAIS, 0)
+        for job in list(self._jobs.values()):
+            contagem[job.status] += 1
+        return contagem
+
+    def listar(self, user_id):
+        """Jobs do usuário ainda consultáveis, do mais antigo ao mais novo."""
+        return sorted((j for j in list(self._jobs.values()) if j.user_id == user_id), key=lambda j: j.criado_em)
+
+    def cancelar(self, job_id, user_id=None):
+        job = self.obter(job_id, user_id)
+        if job is None:
+            return None
+        job._cancelar.set()
+        with self._lock:
+            # Job ainda na fila: já marca como cancelado, a thread apenas descarta
+            if job.status == 'queued':
+                job.status = 'cancelled'
+                job.finalizado_em = time.time()
+                job.etapa = 'Cancelado'
+        return job
+
+    def _executar(self, job, func):
+        with self._lock:
+            if job.cancelado:
+                return
+            job.status = 'running'
+            job.iniciado_em = time.time()
+        job.notificar()
+        try:
+            resultado, status, etapa = func(job), 'done', 'Concluído'
+        except JobCancelado:
+            resultado, status, etapa = None, 'cancelled', 'Cancelado'
+        except Exception as e:
+            print(f"Erro Job {job.id}: {e}")
+            job.erro = str(e)
+            resultado, status, etapa = None, 'error', 'Falhou'
+        job.resultado = resultado
+        job.status = status
+        job.finalizado_em = time.time()
+        job.etapa = etapa  # notifica já com o estado final completo
+        if self.ao_terminar:
+            try:
+                self.ao_terminar(job)
+            except Exception as e:
+                print(f"Erro Job {job.id} (ao_terminar): {e}")
+
+    def _remover_expirados(self):
+        limite = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finalizado and j.finalizado_em < limite]:
+            del self._jobs[job_id]
+
+
+class PoolDeFaixas:
+    """Processa as faixas de todos os jobs em `max_global` threads, repartidas entre usuários.
+
+    Cada usuário tem sua fila e as threads atendem os usuários em rodízio, sem passar de
+    `max_por_usuario` faixas simultâneas de um mesmo usuário. Uma playlist de 200 faixas
+    entra inteira na fila do dono sem atrasar quem pediu 3 links: a vaga que abre vai
+    para o próximo usuário da vez, não para o próximo item enfileirado.
+    """
+
+    def __init__(self, max_global=FAIXAS_SIMULTANEAS, max_por_usuario=FAIXAS_POR_USUARIO):
+        self.max_global = max_global
+        self.max_por_usuario = max_por_usuario
+        self.ativas = 0  # faixas rodando agora (para o /metrics)
+        self._filas = OrderedDict()  # user_id -> deque[(future, func, item)], na ordem do rodízio
+        self._rodando = {}  # user_id -> faixas em andamento
+        self._threads = []
+        self._cond = threading.Condition()
+
+    def pendentes(self):
+        """Faixas esperando vaga, somando todos os usuários."""
+        with self._cond:
+            return sum(len(fila) for fila in self._filas.values())
+
+    def submeter(self, job, func, item):
+        """Enfileira `func(item)` na vez do dono do job; retorna um Future."""
+        future = Future()
+        with self._cond:
+            # Threads criadas só no primeiro uso: com preload_app, não atravessariam o fork
+            while len(self._threads) < self.max_global:
+                thread = threading.Thread(target=self._trabalhar, name=f'vibe-faixa-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._filas.setdefault(job.user_id, deque()).append((future, func, item))
+            self._cond.notify()
+        return future
+
+    def _proxima(self):
+        # Chamado com o lock: primeiro usuário do rodízio com faixa na fila e vaga livre
+        for user_id, fila in self._filas.items():
+            while fila and fila[0][0].cancelled():
+                fila.popleft()
+            if fila and self._rodando.get(user_id, 0) < self.max_por_usuario:
+                self._filas.move_to_end(user_id)  # a vez passa para o próximo usuário
+                return user_id, fila.popleft()
+        return None, None
+
+    def _trabalhar(self):
+        while True:
+            with self._cond:
+                user_id, tarefa = self._proxima()
+                while tarefa is None:
+                    self._cond.wait()
+                    user_id, tarefa = self._proxima()
+                self._rodando[user_id] = self._rodando.get(user_id, 0) + 1
+                self.ativas += 1
+            future, func, item = tarefa
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(func(item))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._cond:
+                    self.ativas -= 1
+                    self._rodando[user_id] -= 1
+                    if not self._rodando[user_id] and not self._filas.get(user_id):
+                        del self._rodando[user_id]
+                        self._filas.pop(user_id, None)
+                    self._cond.notify()
+
+    def mapear(self, job, func, itens):
+        """Executa `func(item)` para cada item e devolve os resultados na ordem de entrada.
+
+        `itens` pode ser um gerador lento (expansão de playlist): cada item entra na fila
+        assim que é produzido, enquanto os anteriores já rodam. Faixas que falham viram
+        None (o pacote segue com as demais); o cancelamento do job interrompe tudo e
+        propaga JobCancelado.
+        """
+        futures = []
+        try:
+            for item in itens:
+                job.verificar_cancelamento()
+                futures.append(self.submeter(job, func, item))
+
+            resultados = []
+            for future in futures:
+                try:
+                    resultados.append(future.result())
+                except JobCancelado:
+                    raise
+                except Exception as e:
+                    print(f"Erro faixa (job {job.id}): {e}")
+                    resultados.append(None)
+            job.verificar_cancelamento()
+            return resultados
+        except BaseException:
+            for future in futures: future.cancel()
+            raise
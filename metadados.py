@@ -0,0 +1,332 @@
+import os
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from io import BytesIO
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# mutagen e PIL são importados só quando uma tag/capa é de fato gravada
+
+# ===================================
+# CAPAS (CACHE POR URL E POR CONTEÚDO)
+# ===================================
+CAPAS_DIR = os.getenv('VIBE_CAPAS_DIR', os.path.join('cache', 'capas'))
+CAPAS_MAX_MB = int(os.getenv('VIBE_CAPAS_MAX_MB', '256'))
+CAPA_LADO = int(os.getenv('VIBE_CAPA_LADO', '500'))  # maior lado do JPEG embutido, em px
+CAPA_MAX_DOWNLOAD = int(os.getenv('VIBE_CAPA_MAX_DOWNLOAD_MB', '15')) * 1024 * 1024
+CAPA_URL_TTL = int(os.getenv('VIBE_CAPA_URL_TTL', '86400'))  # uma URL pode passar a apontar para outra imagem
+CAPAS_EM_MEMORIA = 64
+
+
+class CacheDeCapas:
+    """Capa pronta para embutir (JPEG, RGB, no máximo CAPA_LADO px) por URL.
+
+    Dois níveis em disco, em `<raiz>/`:
+    - `urls/<ab>/<sha256 da URL>`: guarda o sha256 dos bytes baixados;
+    - `jpeg/<ab>/<sha256 do conteúdo>.jpg`: a capa já redimensionada.
+    URLs diferentes para a mesma imagem (CDNs, query strings) reaproveitam o JPEG sem
+    passar pelo PIL de novo. As mais usadas ficam também em memória. O mtime do JPEG
+    marca o último uso e é a base da remoção LRU, como no CacheDeFaixas.
+    """
+
+    def __init__(self, raiz=CAPAS_DIR, max_bytes=CAPAS_MAX_MB * 1024 * 1024, lado=CAPA_LADO,
+                 url_ttl=CAPA_URL_TTL, sessao=None):
+        self.raiz = raiz
+        self.max_bytes = max_bytes
+        self.lado = lado
+        self.url_ttl = url_ttl
+        self.hits = 0
+        self.misses = 0
+        self.downloads = 0
+        self._sessao = sessao
+        self._memoria = OrderedDict()
+        self._baixando = {}
+        self._tamanho = None
+        self._lock = threading.Lock()
+
+    @property
+    def sessao(self):
+        # Session única (keep-alive): capas costumam vir dos mesmos hosts (i.ytimg.com etc.)
+        if self._sessao is None:
+            sessao = requests.Session()
+            adaptador = HTTPAdapter(pool_maxsize=16, max_retries=Retry(
+                total=2, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]))
+            sessao.mount('https://', adaptador)
+            sessao.mount('http://', adaptador)
+            sessao.headers['User-Agent'] = 'VibeDownloader/1.0'
+            self._sessao = sessao
+        return self._sessao
+
+    @staticmethod
+    def _sha(dados):
+        return hashlib.sha256(dados).hexdigest()
+
+    def _caminho_url(self, url):
+        chave = self._sha(url.encode('utf-8'))
+        return os.path.join(self.raiz, 'urls', chave[:2], chave)
+
+    def _caminho_jpeg(self, conteudo):
+        return os.path.join(self.raiz, 'jpeg', conteudo[:2], conteudo + '.jpg')
+
+    def obter(self, url):
+        """Bytes do JPEG da capa, ou None se não deu para baixar/decodificar."""
+        if not url:
+            return None
+        with self._lock:
+            if url in self._memoria:
+                self._memoria.move_to_end(url)
+                self.hits += 1
+                return self._memoria[url]
+            # Uma busca por URL: as outras threads esperam o resultado dela
+            evento = self._baixando.get(url)
+            dono = evento is None
+            if dono:
+                evento = self._baixando[url] = threading.Event()
+        if not dono:
+            evento.wait(30)
+            with self._lock:
+                jpeg = self._memoria.get(url)
+                if jpeg is not None: self.hits += 1
+                return jpeg
+        try:
+            jpeg = self._do_disco(url)
+            with self._lock:
+                if jpeg is not None: self.hits += 1
+                else: self.misses += 1
+            if jpeg is None:
+                jpeg = self._baixar(url)
+            if jpeg is not None:
+                with self._lock:
+                    self._memoria[url] = jpeg
+                    while len(self._memoria) > CAPAS_EM_MEMORIA:
+                        self._memoria.popitem(last=False)
+            return jpeg
+        finally:
+            with self._lock:
+                self._baixando.pop(url, None)
+            evento.set()
+
+    def _do_disco(self, url):
+        caminho_url = self._caminho_url(url)
+        try:
+            if time.time() - os.path.getmtime(caminho_url) > self.url_ttl:
+                return None
+            with open(caminho_url, encoding='ascii') as f:
+                caminho = self._caminho_jpeg(f.read().strip())
+            with open(caminho, 'rb') as f:
+                jpeg = f.read()
+            os.utime(caminho)  # marca o acesso (LRU)
+            return jpeg
+        except (OSError, ValueError):
+            return None
+
+    def _baixar(self, url):
+        try:
+            with self.sessao.get(url, timeout=10, stream=True) as resp:
+                if resp.status_code != 200:
+                    return None
+                bruto = BytesIO()
+                for bloco in resp.iter_content(64 * 1024):
+                    bruto.write(bloco)
+                    if bruto.tell() > CAPA_MAX_DOWNLOAD:
+                        print(f"Erro capa: {url} passa de {CAPA_MAX_DOWNLOAD} bytes")
+                        return None
+        except requests.RequestException as e:
+            print(f"Erro capa: {e}")
+            return None
+        with self._lock:
+            self.downloads += 1
+
+        dados = bruto.getvalue()
+        conteudo = self._sha(dados)
+        caminho = self._caminho_jpeg(conteudo)
+        try:
+            with open(caminho, 'rb') as f:
+                jpeg = f.read()  # mesma imagem já veio por outra URL
+        except OSError:
+            jpeg = self.converter(dados, self.lado)
+            if jpeg is None:
+                return None
+            self._gravar(caminho, jpeg)
+        self._gravar(self._caminho_url(url), conteudo.encode('ascii'))
+        return jpeg
+
+    @staticmethod
+    def converter(dados, lado=CAPA_LADO):
+        """Decodifica qualquer formato do PIL e devolve um JPEG RGB com o maior lado <= `lado`.
+
+        Mantém a proporção (thumbnail não distorce nem amplia): capas 16:9 do YouTube
+        continuam 16:9.
+        """
+        from PIL import Image
+        try:
+            img = Image.open(BytesIO(dados))
+            img.thumbnail((lado, lado), Image.LANCZOS)
+            if img.mode != 'RGB':
+                fundo = Image.new('RGB', img.size, (0, 0, 0))
+                rgba = img.convert('RGBA')
+                fundo.paste(rgba, mask=rgba.split()[-1])
+                img = fundo
+            saida = BytesIO()
+            img.save(saida, format='JPEG', quality=90, optimize=True)
+            return saida.getvalue()
+        except Exception as e:
+            print(f"Erro capa (imagem inválida): {e}")
+            return None
+
+    def _gravar(self, caminho, dados):
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temp = f'{caminho}.tmp-{uuid.uuid4().hex}'
+        try:
+            with open(temp, 'wb') as f:
+                f.write(dados)
+            os.replace(temp, caminho)
+        except OSError as e:
+            print(f"Erro cache de capas: {e}")
+            try: os.remove(temp)
+            except OSError: pass
+            return
+        if caminho.endswith('.jpg'):
+            with self._lock:
+                if self._tamanho is None:
+                    self._tamanho = self._calcular_tamanho()
+                else:
+                    self._tamanho += len(dados)
+                if self._tamanho > self.max_bytes:
+                    self._evictar()
+
+    def _jpegs(self):
+        base = os.path.join(self.raiz, 'jpeg')
+        if not os.path.isdir(base):
+            return
+        for prefixo in os.listdir(base):
+            pasta = os.path.join(base, prefixo)
+            for nome in os.listdir(pasta):
+                if nome.endswith('.jpg'):
+                    yield os.path.join(pasta, nome)
+
+    def _calcular_tamanho(self):
+        total = 0
+        for caminho in self._jpegs():
+            try: total += os.path.getsize(caminho)
+            except OSError: pass
+        return total
+
+    def _evictar(self):
+        """Remove os JPEGs menos usados até caber no limite (a URL órfã vira miss)."""
+        entradas = []
+        for caminho in self._jpegs():
+            try:
+                estado = os.stat(caminho)
+                entradas.append((estado.st_mtime, caminho, estado.st_size))
+            except OSError:
+                pass
+        entradas.sort()
+        total = sum(t for _, _, t in entradas)
+        for _, caminho, tamanho in entradas:
+            if total <= self.max_bytes:
+                break
+            try: os.remove(caminho)
+            except OSError: pass
+            total -= tamanho
+        self._tamanho = total
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'downloads': self.downloads,
+                'em_memoria': len(self._memoria),
+            }
+
+
+# ===================================
+# TAGS POR FORMATO
+# ===================================
+def _zerar_tags(audio):
+    # Limpa no lugar: delete() reescreveria o arquivo inteiro antes do save()
+    if audio.tags is None:
+        audio.add_tags()
+    else:
+        audio.tags.clear()
+
+
+def _frames_id3(tags, artist, title, album, capa):
+    from mutagen.id3 import APIC, TIT2, TPE1, TALB
+    if title: tags.add(TIT2(encoding=3, text=title))
+    if artist: tags.add(TPE1(encoding=3, text=artist))
+    if album: tags.add(TALB(encoding=3, text=album))
+    if capa: tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=capa))
+
+
+def _tags_mp3(caminho, artist, title, album, capa):
+    from mutagen.id3 import ID3
+    from mutagen.mp3 import MP3
+    audio = MP3(caminho, ID3=ID3)
+    _zerar_tags(audio)
+    _frames_id3(audio.tags, artist, title, album, capa)
+    audio.save()
+
+
+def _tags_id3_em_chunk(classe):
+    """WAV e AIFF: tags ID3 num chunk próprio. Grava ID3v2.3, o que Rekordbox/Serato/Traktor leem."""
+    def gravar(caminho, artist, title, album, capa):
+        audio = classe(caminho)
+        _zerar_tags(audio)
+        _frames_id3(audio.tags, artist, title, album, capa)
+        audio.save(v2_version=3)
+    return gravar
+
+
+def _tags_flac(caminho, artist, title, album, capa):
+    from mutagen.flac import FLAC, Picture
+    from PIL import Image
+    audio = FLAC(caminho)
+    _zerar_tags(audio)
+    audio.clear_pictures()
+    if title: audio['title'] = title
+    if artist: audio['artist'] = artist
+    if album: audio['album'] = album
+    if capa:
+        figura = Picture()
+        figura.type = 3
+        figura.mime = 'image/jpeg'
+        figura.desc = 'Cover'
+        figura.data = capa
+        figura.width, figura.height = Image.open(BytesIO(capa)).size
+        figura.depth = 24
+        audio.add_picture(figura)
+    audio.save()
+
+
+def _gravador(ext):
+    if ext == '.mp3':
+        return _tags_mp3
+    if ext == '.flac':
+        return _tags_flac
+    if ext == '.wav':
+        from mutagen.wave import WAVE
+        return _tags_id3_em_chunk(WAVE)
+    if ext in ('.aiff', '.aif'):
+        from mutagen.aiff import AIFF
+        return _tags_id3_em_chunk(AIFF)
+    return None
+
+
+def escrever_tags(caminho, artist=None, title=None, album=None, capa=None):
+    """Substitui as tags do arquivo (mp3, flac, wav, aiff). `capa` são bytes JPEG.
+
+    Levanta ValueError para formato sem suporte; erros do mutagen sobem para quem chamou.
+    """
+    gravar = _gravador(os.path.splitext(caminho)[1].lower())
+    if gravar is None:
+        raise ValueError(f'Formato sem suporte a tags: {caminho}')
+    gravar(caminho, artist, title, album, capa)
@@ -0,0 +1,256 @@
+import cProfile
+import hmac
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# ===================================
+# MÉTRICAS NO FORMATO DO PROMETHEUS (SEM DEPENDÊNCIAS)
+# ===================================
+# Só o necessário para /metrics: contadores, histogramas e medidores com rótulos,
+# expostos no formato texto 0.0.4. Vale por processo (o Gunicorn roda um worker).
+TIPO_CONTEUDO = 'text/plain; version=0.0.4; charset=utf-8'
+
+BALDES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BALDES_BYTES_POR_S = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=None):
+    pares = list(zip(nomes, valores)) + (list(extra.items()) if extra else [])
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}'
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _chave(self, rotulos):
+        if set(rotulos) != set(self.rotulos):
+            raise ValueError(f'{self.nome}: rótulos esperados {self.rotulos}, recebidos {tuple(rotulos)}')
+        return tuple(str(rotulos[n]) for n in self.rotulos)
+
+    def expor(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for chave, valor in series:
+            linhas.extend(self._linhas(chave, valor))
+        return linhas
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._series[chave] = self._series.get(chave, 0) + valor
+
+    def valor(self, **rotulos):
+        with self._lock:
+            return self._series.get(self._chave(rotulos), 0)
+
+    def _linhas(self, chave, valor):
+        return [f'{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}']
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), baldes=BALDES_SEGUNDOS):
+        super().__init__(nome, ajuda, rotulos)
+        self.baldes = tuple(sorted(baldes)) + (math.inf,)
+
+    def observar(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = self._series[chave] = [[0] * len(self.baldes), 0.0, 0]
+            for i, limite in enumerate(self.baldes):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def _linhas(self, chave, serie):
+        contagens, soma, total = serie
+        linhas, acumulado = [], 0
+        for limite, n in zip(self.baldes, contagens):
+            acumulado += n
+            linhas.append(f'{self.nome}_bucket{_rotulos(self.rotulos, chave, {"le": _numero(limite)})} {acumulado}')
+        linhas.append(f'{self.nome}_sum{_rotulos(self.rotulos, chave)} {_numero(soma)}')
+        linhas.append(f'{self.nome}_count{_rotulos(self.rotulos, chave)} {total}')
+        return linhas
+
+
+class Medidor(_Metrica):
+    """Valor lido na hora da coleta: `ler()` devolve um número ou {valores dos rótulos: número}.
+
+    Com tipo='counter' serve para contadores que já existem em outro objeto (ex.: hits de cache).
+    """
+
+    def __init__(self, nome, ajuda, ler, rotulos=(), tipo='gauge'):
+        super().__init__(nome, ajuda, rotulos)
+        self.ler = ler
+        self.tipo = tipo
+
+    def expor(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+        try:
+            valores = self.ler()
+        except Exception as e:
+            print(f"Erro métrica {self.nome}: {e}")
+            return linhas
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for chave, valor in sorted(valores.items()):
+            chave = chave if isinstance(chave, tuple) else (chave,)
+            linhas.append(f'{self.nome}{_rotulos(self.rotulos, chave)} {_numero(valor)}')
+        return linhas
+
+
+class Registro:
+    def __init__(self):
+        self._metricas = []
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), baldes=BALDES_SEGUNDOS):
+        return self._registrar(Histograma(nome, ajuda, rotulos, baldes))
+
+    def medidor(self, nome, ajuda, ler, rotulos=(), tipo='gauge'):
+        return self._registrar(Medidor(nome, ajuda, ler, rotulos, tipo))
+
+    def expor(self):
+        with self._lock:
+            metricas = list(self._metricas)
+        linhas = []
+        for metrica in metricas:
+            linhas.extend(metrica.expor())
+        return '\n'.join(linhas) + '\n'
+
+
+@contextmanager
+def cronometro(histograma, **rotulos):
+    """Observa a duração do bloco em segundos (também quando ele levanta exceção)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, **rotulos)
+
+
+class PerfilWSGI:
+    """cProfile sob demanda: só perfila requisições com `X-Vibe-Perfil: <token>`.
+
+    Grava `<pasta>/<horário>-<método>-<caminho>.prof` (abrir com pstats ou snakeviz) e
+    devolve o nome no cabeçalho X-Vibe-Perfil-Arquivo. O corpo também entra no perfil,
+    pedaço a pedaço (o .zip em streaming, por exemplo). Um perfil por vez: pedidos
+    simultâneos passam sem perfil e recebem `X-Vibe-Perfil-Arquivo: ocupado`.
+    """
+
+    def __init__(self, app, pasta, token):
+        self.app = app
+        self.pasta = pasta
+        self.token = token
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        recebido = environ.get('HTTP_X_VIBE_PERFIL')
+        if not self.token or recebido is None or not hmac.compare_digest(recebido.encode(), self.token.encode()):
+            return self.app(environ, start_response)
+        if not self._lock.acquire(blocking=False):
+            return self.app(environ, self._com_cabecalho(start_response, 'ocupado'))
+        caminho = re.sub(r'[^A-Za-z0-9_.-]+', '_', environ.get('PATH_INFO', '/')).strip('_') or 'raiz'
+        nome = f"{time.strftime('%Y%m%d-%H%M%S')}-{environ.get('REQUEST_METHOD', 'GET')}-{caminho[:80]}.prof"
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+            try:
+                corpo = self.app(environ, self._com_cabecalho(start_response, nome))
+            finally:
+                perfil.disable()
+        except BaseException:
+            self._lock.release()
+            raise
+        return _CorpoPerfilado(corpo, perfil, lambda: self._terminar(perfil, nome))
+
+    @staticmethod
+    def _com_cabecalho(start_response, valor):
+        def iniciar(status, cabecalhos, exc_info=None):
+            cabecalhos.append(('X-Vibe-Perfil-Arquivo', valor))
+            return start_response(status, cabecalhos, exc_info)
+        return iniciar
+
+    def _terminar(self, perfil, nome):
+        try:
+            os.makedirs(self.pasta, exist_ok=True)
+            perfil.dump_stats(os.path.join(self.pasta, nome))
+        except OSError as e:
+            print(f"Erro perfil: {e}")
+        finally:
+            self._lock.release()
+
+
+class _CorpoPerfilado:
+    """Corpo da resposta perfilada. O lock do perfil é liberado no close(), que o servidor
+    WSGI chama sempre, mesmo quando o cliente cai antes de o corpo ser iterado (um
+    gerador que nunca começou não chegaria ao próprio finally).
+    """
+
+    def __init__(self, corpo, perfil, ao_fechar):
+        self.corpo = corpo
+        self.perfil = perfil
+        self._ao_fechar = ao_fechar
+        self._fechado = False
+
+    def __iter__(self):
+        partes = iter(self.corpo)
+        while True:
+            self.perfil.enable()
+            try:
+                parte = next(partes)
+            except StopIteration:
+                return
+            finally:
+                self.perfil.disable()
+            yield parte
+
+    def close(self):
+        if self._fechado:
+            return
+        self._fechado = True
+        try:
+            if hasattr(self.corpo, 'close'): self.corpo.close()
+        finally:
+            self._ao_fechar()
@@ -0,0 +1,89 @@
+from sqlalchemy import inspect
+
+from models import db
+
+# ===================================
+# MIGRAÇÕES VERSIONADAS (PRAGMA user_version)
+# ===================================
+# A versão do esquema fica no próprio arquivo do SQLite (PRAGMA user_version).
+# Cada passo roda uma vez, em ordem, e é idempotente: se o processo cair no meio,
+# rodar de novo termina o serviço sem quebrar o que já foi feito.
+# Para mudar o esquema: altere models.py E acrescente um passo no fim da lista.
+MIGRACOES = []
+
+
+def migracao(versao, descricao):
+    def registrar(funcao):
+        MIGRACOES.append((versao, descricao, funcao))
+        return funcao
+    return registrar
+
+
+def _colunas(conn, tabela):
+    return {c['name'] for c in inspect(conn).get_columns(tabela)}
+
+
+@migracao(1, 'Coupon: colunas usage_limit e usage_count')
+def _cupons_com_limite(conn):
+    if not inspect(conn).has_table('coupon'):
+        return
+    colunas = _colunas(conn, 'coupon')
+    if 'usage_limit' not in colunas:
+        conn.exec_driver_sql("ALTER TABLE coupon ADD COLUMN usage_limit INTEGER DEFAULT 0")
+    if 'usage_count' not in colunas:
+        conn.exec_driver_sql("ALTER TABLE coupon ADD COLUMN usage_count INTEGER DEFAULT 0")
+
+
+@migracao(2, 'Tabelas que faltarem (used_coupon, webhook_event)')
+def _tabelas_novas(conn):
+    # checkfirst: só cria o que não existe, já com os índices declarados no modelo
+    db.metadata.create_all(conn, checkfirst=True)
+
+
+@migracao(3, 'Índice de pagamentos por usuário e status')
+def _indice_pagamentos(conn):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_payment_user_status ON payment (user_id, status)")
+
+
+@migracao(4, 'UsedCoupon único por (user_id, coupon_code)')
+def _cupom_usado_unico(conn):
+    # Resgates duplicados (corrida antiga) ficam só com o primeiro registro
+    removidos = conn.exec_driver_sql(
+        "DELETE FROM used_coupon WHERE id NOT IN "
+        "(SELECT MIN(id) FROM used_coupon GROUP BY user_id, coupon_code)").rowcount
+    if removidos:
+        print(f"🔧 UsedCoupon: {removidos} resgate(s) duplicado(s) removido(s)")
+    conn.exec_driver_sql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_used_coupon_user_code ON used_coupon (user_id, coupon_code)")
+
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrar(engine):
+    """Leva o banco até VERSAO_ATUAL. Retorna a lista de versões aplicadas.
+
+    Banco vazio: create_all direto na última versão (os modelos já têm tudo).
+    Banco existente: aplica, um por transação, os passos acima da versão gravada.
+    """
+    with engine.begin() as conn:
+        if not inspect(conn).has_table('user'):
+            db.metadata.create_all(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {VERSAO_ATUAL}")
+            print(f"🔧 Banco novo criado na versão {VERSAO_ATUAL}")
+            return [VERSAO_ATUAL]
+
+    aplicadas = []
+    for numero, descricao, funcao in MIGRACOES:
+        with engine.begin() as conn:
+            if numero <= versao(conn):
+                continue
+            print(f"🔧 Migração {numero}: {descricao}")
+            funcao(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {numero}")
+        aplicadas.append(numero)
+    return aplicadas
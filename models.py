@@ -1,11 +1,34 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
+import sqlite3
 import uuid
+import os
 
 db = SQLAlchemy()
 
+# ===================================
+# SQLITE COM VÁRIAS THREADS ESCREVENDO
+# ===================================
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('VIBE_SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+@event.listens_for(Engine, 'connect')
+def configurar_sqlite(conexao, _registro):
+    """Roda em cada conexão nova do pool."""
+    if not isinstance(conexao, sqlite3.Connection):
+        return
+    cursor = conexao.cursor()
+    # WAL: leituras não bloqueiam a escrita (e vice-versa); fica gravado no arquivo
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Espera o lock de escrita em vez de falhar na hora com "database is locked"
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    # Com WAL, NORMAL só sincroniza no checkpoint: não corrompe, no máximo perde o último commit numa queda de energia
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(150), unique=True, nullable=False)
@@ -60,6 +83,11 @@ class Payment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     approved_at = db.Column(db.DateTime, nullable=True)
     expires_at = db.Column(db.DateTime, nullable=True)
+
+    # PIX pendente do usuário (/create_pix_payment) sem varrer a tabela
+    __table_args__ = (
+        db.Index('ix_payment_user_status', 'user_id', 'status'),
+    )
     
     def __repr__(self):
         return f'<Payment {self.external_reference} - {self.status}>'
@@ -78,4 +106,26 @@ class UsedCoupon(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     coupon_code = db.Column(db.String(50), nullable=False)
-    used_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    used_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Um resgate por usuário e cupom, garantido pelo banco
+    __table_args__ = (
+        db.Index('ux_used_coupon_user_code', 'user_id', 'coupon_code', unique=True),
+    )
+
+# INBOX DE NOTIFICAÇÕES DO MERCADO PAGO (processadas em segundo plano)
+class WebhookEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    payment_id = db.Column(db.String(100), nullable=False)
+    action = db.Column(db.String(50), nullable=True)
+    status = db.Column(db.String(20), default='pending') # pending | processing | retry | done | error
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    # Só uma notificação pendente por pagamento: repetições do MP viram no-op
+    __table_args__ = (
+        db.Index('ix_webhook_event_pendente', 'payment_id', unique=True, sqlite_where=db.text("status = 'pending'")),
+        db.Index('ix_webhook_event_status', 'status', 'id'),
+    )
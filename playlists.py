@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import threading
+import time
+import uuid
+
+# yt_dlp é importado só quando uma playlist precisa ser lida do site
+
+# ===================================
+# EXPANSÃO DE PLAYLISTS E CANAIS (extract_flat, SOB DEMANDA)
+# ===================================
+PLAYLISTS_DIR = os.getenv('VIBE_PLAYLISTS_DIR', os.path.join('cache', 'playlists'))
+PLAYLIST_TTL = int(os.getenv('VIBE_PLAYLIST_TTL', '900'))  # segundos em que a expansão vale sem reler o site
+PLAYLIST_MAX = int(os.getenv('VIBE_PLAYLIST_MAX', '200'))  # faixas novas por job em modo playlist
+# Entradas lidas da listagem plana (barata: só as páginas da lista). Bem acima do
+# PLAYLIST_MAX: com somente_novas, as novas costumam estar no fim de uma playlist longa
+PLAYLIST_VARREDURA = int(os.getenv('VIBE_PLAYLIST_VARREDURA', '5000'))  # 0 = sem limite
+PROFUNDIDADE_MAX = 2  # canal -> aba (/videos) -> vídeos
+
+
+class CacheDePlaylists:
+    """Lista de entradas de cada playlist/canal por URL, em `<raiz>/<ab>/<sha256 da URL>.json`.
+
+    Dentro do TTL, a lista sai do disco sem tocar no site. Depois dele, a playlist é
+    relida com extract_flat (só as páginas da lista, nenhum vídeo é aberto). O arquivo
+    guarda também, por usuário, os ids já sincronizados: com `somente_novas`, uma nova
+    sincronização do mesmo crate só devolve o que entrou na playlist depois.
+    """
+
+    def __init__(self, raiz=PLAYLISTS_DIR, ttl=PLAYLIST_TTL, max_varredura=PLAYLIST_VARREDURA, max_novas=PLAYLIST_MAX):
+        self.raiz = raiz
+        self.ttl = ttl
+        self.max_varredura = max_varredura
+        self.max_novas = max_novas
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _caminho(self, url):
+        chave = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.raiz, chave[:2], chave + '.json')
+
+    def _ler(self, url):
+        try:
+            with open(self._caminho(url), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _gravar(self, url, dados):
+        caminho = self._caminho(url)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temp = f'{caminho}.tmp-{uuid.uuid4().hex}'
+        try:
+            with open(temp, 'w', encoding='utf-8') as f:
+                json.dump(dados, f)
+            os.replace(temp, caminho)
+        except OSError as e:
+            print(f"Erro cache de playlists: {e}")
+            try: os.remove(temp)
+            except OSError: pass
+
+    def expandir(self, url, user_id=None, somente_novas=False, opcoes=None):
+        """Gera as entradas {'url', 'link', 'id', 'ie_key', 'titulo'} da playlist, na ordem dela.
+
+        Lida do site, cada entrada sai assim que a página dela chega (o pool já começa a
+        baixar as primeiras). Uma URL que não é playlist vira uma entrada só.
+        Os ids já sincronizados saem durante a varredura; o teto `max_novas` conta só as
+        entradas devolvidas, então as novas no fim de uma playlist longa ainda chegam.
+        `opcoes` vai para o YoutubeDL (ex.: ffmpeg_location).
+        """
+        dados = self._ler(url)
+        vistos = set()
+        if somente_novas and dados:
+            vistos = set(dados.get('vistos', {}).get(str(user_id), ()))
+        if dados and time.time() - dados.get('expandido_em', 0) < self.ttl:
+            with self._lock: self.hits += 1
+            fonte = iter(dados['entradas'])
+        else:
+            with self._lock: self.misses += 1
+            fonte = self._do_site(url, opcoes)
+        novas = 0
+        for entrada in fonte:
+            if entrada['id'] in vistos:
+                continue
+            yield entrada
+            novas += 1
+            if novas >= self.max_novas:
+                return
+
+    def _do_site(self, url, opcoes):
+        from yt_dlp import YoutubeDL
+        entradas = []
+        ydl_opts = dict(opcoes or {}, extract_flat='in_playlist', lazy_playlist=True, quiet=True,
+                        noplaylist=False, skip_download=True)
+        with YoutubeDL(ydl_opts) as ydl:
+            for entrada in self._entradas(ydl, url, 0):
+                entradas.append(entrada)
+                yield entrada
+                if self.max_varredura and len(entradas) >= self.max_varredura:
+                    print(f"Playlist {url}: varredura parou em {self.max_varredura} entradas")
+                    break
+        # Só a lista lida até o fim (ou até o limite da varredura) vai para o cache
+        with self._lock:
+            anteriores = self._ler(url) or {}
+            self._gravar(url, {'url': url, 'expandido_em': time.time(), 'entradas': entradas,
+                               'vistos': anteriores.get('vistos', {})})
+
+    def _entradas(self, ydl, url, profundidade):
+        # process=False: o extrator devolve `entries` como gerador, página a página
+        info = ydl.extract_info(url, download=False, process=False)
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield self._entrada(info, url)
+            return
+        for item in info.get('entries') or ():
+            if not item:
+                continue
+            aninhada = item.get('_type') == 'playlist' or (
+                item.get('_type') == 'url' and (item.get('ie_key') or '').endswith('Tab'))
+            if aninhada and profundidade < PROFUNDIDADE_MAX:
+                yield from self._entradas(ydl, item.get('url') or item.get('webpage_url'), profundidade + 1)
+            elif item.get('url') or item.get('webpage_url'):
+                yield self._entrada(item, url)
+
+    @staticmethod
+    def _entrada(info, origem):
+        from yt_dlp.utils import unsmuggle_url
+        url = info.get('webpage_url') or info.get('url') or origem
+        link = unsmuggle_url(url)[0]
+        # Entrada "plana" traz ie_key; um vídeo já extraído traz extractor_key.
+        # `url` pode levar dados "contrabandeados" para o extrator; `link` é o que o usuário vê
+        return {
+            'url': url,
+            'link': link,
+            'id': info.get('id') or link,
+            'ie_key': info.get('ie_key') or info.get('extractor_key'),
+            'titulo': info.get('title'),
+        }
+
+    def marcar_vistos(self, url, user_id, ids):
+        """Registra as entradas que o usuário já recebeu desta playlist."""
+        if not ids:
+            return
+        with self._lock:
+            dados = self._ler(url) or {'url': url, 'expandido_em': 0, 'entradas': []}
+            vistos = dados.setdefault('vistos', {})
+            vistos[str(user_id)] = sorted(set(vistos.get(str(user_id), ())) | set(ids))
+            self._gravar(url, dados)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,393 @@
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from mutagen import File as MutagenFile
+
+# ===================================
+# MOTOR DE ESPECTROGRAMA (FFmpeg -> STFT NumPy -> PNG)
+# ===================================
+N_FFT = 2048
+HOP = 512
+QUADROS_POR_BLOCO = 256  # quadros STFT processados por vez (memória fixa por bloco)
+TOP_DB = 80.0
+POOLING = os.getenv('VIBE_SPEK_POOLING', 'max')  # 'max' destaca cortes; 'mean' suaviza
+DURACAO = float(os.getenv('VIBE_SPEK_DURACAO', '0')) or None  # None = faixa inteira
+
+# Detector de transcode: corte típico (lowpass) dos encoders por bitrate
+CLASSES_BITRATE = [(20000, '320'), (19000, '256'), (18000, '192'), (16500, '128')]
+CORTE_MINIMO_HZ = 11000
+SHELF_MINIMO_DB = 12.0
+JANELA_SHELF_HZ = 600
+FORMATOS_LOSSLESS = ('flac', 'wav', 'aiff')
+EXTENSOES_AUDIO = ('.mp3', '.flac', '.wav', '.aiff', '.aif', '.m4a', '.ogg', '.opus')
+
+# Layout da imagem (equivalente ao figsize=(8, 3) do pyplot)
+LARGURA, ALTURA = 800, 300
+MARGEM_ESQ, MARGEM_DIR, MARGEM_TOPO, MARGEM_BASE = 62, 88, 30, 32
+AREA_W = LARGURA - MARGEM_ESQ - MARGEM_DIR
+AREA_H = ALTURA - MARGEM_TOPO - MARGEM_BASE
+FUNDO = (30, 30, 30)
+TEXTO = (230, 230, 230)
+
+# Pontos de controle do colormap 'inferno' (interpolados em 256 cores)
+_INFERNO = ['#000004', '#0b0724', '#210c4a', '#3d0965', '#57106e', '#71196e', '#8a226a', '#a32c61', '#bc3754',
+            '#d24644', '#e45a31', '#f1731d', '#f98e09', '#fcac11', '#f9cb35', '#f2ea69', '#fcffa4']
+
+def _gerar_lut(cores):
+    pontos = np.array([[int(c[i:i + 2], 16) for i in (1, 3, 5)] for c in cores], dtype=np.float32)
+    x = np.linspace(0, 1, len(pontos))
+    alvo = np.linspace(0, 1, 256)
+    return np.stack([np.interp(alvo, x, pontos[:, k]) for k in range(3)], axis=1).round().astype(np.uint8)
+
+LUT = _gerar_lut(_INFERNO)
+JANELA = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(N_FFT) / N_FFT)).astype(np.float32)  # Hann periódica
+
+
+def taxa_amostragem(audio_path, padrao=44100):
+    """Sample rate nativo do arquivo (sem reamostrar e perder o topo do espectro)."""
+    try:
+        info = MutagenFile(audio_path).info
+        return int(info.sample_rate) or padrao
+    except Exception:
+        return padrao
+
+
+def canais(audio_path, padrao=2):
+    """Número de canais do arquivo (o PCM de ler_pcm já chega em mono)."""
+    try:
+        return int(MutagenFile(audio_path).info.channels) or padrao
+    except Exception:
+        return padrao
+
+
+def ler_pcm(audio_path, sr, ffmpeg='ffmpeg', duracao=None, amostras_por_bloco=HOP * QUADROS_POR_BLOCO):
+    """Decodifica via FFmpeg para float32 mono, entregando blocos de tamanho fixo."""
+    cmd = [ffmpeg, '-v', 'error', '-nostdin', '-i', audio_path]
+    if duracao:
+        cmd += ['-t', str(duracao)]
+    cmd += ['-ac', '1', '-ar', str(sr), '-f', 'f32le', 'pipe:1']
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        tamanho = amostras_por_bloco * 4
+        while True:
+            dados = proc.stdout.read(tamanho)
+            if not dados:
+                break
+            yield np.frombuffer(dados[:len(dados) - len(dados) % 4], dtype=np.float32)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def magnitudes_stft(blocos, n_fft=N_FFT, hop=HOP):
+    """STFT em blocos: recebe PCM em pedaços e devolve |X| (quadros x bins) bloco a bloco.
+
+    Usa janela centralizada (padding de n_fft/2 nas bordas), como o librosa.
+    """
+    resto = np.zeros(n_fft // 2, dtype=np.float32)
+    for bloco in blocos:
+        buf = np.concatenate([resto, bloco])
+        n = (len(buf) - n_fft) // hop + 1
+        if n > 0:
+            quadros = np.lib.stride_tricks.sliding_window_view(buf, n_fft)[::hop][:n]
+            yield np.abs(np.fft.rfft(quadros * JANELA, axis=1)).astype(np.float32)
+            buf = buf[n * hop:]
+        resto = buf
+    # Último quadro com o padding final
+    if len(resto) > n_fft // 2:
+        buf = np.concatenate([resto, np.zeros(n_fft // 2, dtype=np.float32)])
+        n = max((len(buf) - n_fft) // hop + 1, 0)
+        if n:
+            quadros = np.lib.stride_tricks.sliding_window_view(buf, n_fft)[::hop][:n]
+            yield np.abs(np.fft.rfft(quadros * JANELA, axis=1)).astype(np.float32)
+
+
+class Decimador:
+    """Reduz uma sequência de linhas (quadros) a no máximo 2x `largura` colunas, com memória constante.
+
+    Cada coluna agrupa `fator` linhas ('max', 'mean' ou 'minmax' sobre linhas [min, max]);
+    quando o buffer enche, colunas vizinhas são fundidas e o fator dobra. Assim uma faixa
+    de 3 minutos e um set de 2 horas usam o mesmo buffer.
+    """
+
+    def __init__(self, largura, dim, modo='max'):
+        if modo not in ('max', 'mean', 'minmax'):
+            raise ValueError(f'pooling inválido: {modo}')
+        self.largura = largura
+        self.modo = modo
+        self._colunas = np.zeros((2 * largura, dim), dtype=np.float32)
+        self._n = 0  # colunas completas no buffer
+        self._parcial = None
+        self._parcial_n = 0
+        self.fator = 1  # linhas por coluna
+        self.linhas = 0
+
+    def _reduzir(self, grupos, eixo):
+        if self.modo == 'max':
+            return grupos.max(axis=eixo)
+        if self.modo == 'mean':
+            return grupos.sum(axis=eixo)
+        return np.stack([grupos[..., 0].min(axis=eixo), grupos[..., 1].max(axis=eixo)], axis=-1)
+
+    def _fechar(self, colunas):
+        """Grava colunas completas (já reduzidas sobre `fator` linhas) no buffer."""
+        if self.modo == 'mean':
+            colunas = colunas / self.fator
+        self._colunas[self._n:self._n + len(colunas)] = colunas
+        self._n += len(colunas)
+        if self._n == len(self._colunas):
+            pares = self._colunas.reshape(self.largura, 2, -1)
+            fundidas = self._reduzir(pares, 1)
+            self._colunas[:self.largura] = fundidas / 2 if self.modo == 'mean' else fundidas
+            self._n = self.largura
+            self.fator *= 2
+
+    def consumir(self, linhas):
+        self.linhas += len(linhas)
+        i = 0
+        while i < len(linhas):
+            if self._parcial_n == 0 and len(linhas) - i >= self.fator:
+                # Grupos completos de uma vez (vetorizado), sem estourar o buffer
+                k = min((len(linhas) - i) // self.fator, len(self._colunas) - self._n)
+                usados = k * self.fator
+                grupos = linhas[i:i + usados].reshape(k, self.fator, -1)
+                i += usados
+                self._fechar(self._reduzir(grupos, 1))  # pode dobrar o fator
+                continue
+            pedaco = linhas[i:i + self.fator - self._parcial_n]
+            extra = self._reduzir(pedaco[None], 1)[0]
+            if self._parcial is None:
+                self._parcial = extra
+            else:
+                self._parcial = self._reduzir(np.stack([self._parcial, extra])[None], 1)[0]
+            self._parcial_n += len(pedaco)
+            i += len(pedaco)
+            if self._parcial_n == self.fator:
+                self._fechar(self._parcial[None, :])
+                self._parcial = None
+                self._parcial_n = 0
+
+    def colunas(self):
+        """Colunas acumuladas, incluindo a última parcial."""
+        colunas = self._colunas[:self._n]
+        if self._parcial_n:
+            ultima = self._parcial / self._parcial_n if self.modo == 'mean' else self._parcial
+            colunas = np.vstack([colunas, ultima[None, :]])
+        return colunas
+
+
+class Espectrograma:
+    """Acumula a STFT já reduzida ao tamanho da imagem, com memória constante.
+
+    Frequência: max-pooling dos bins até a altura da imagem. Tempo: ver Decimador.
+    """
+
+    def __init__(self, sr, n_fft=N_FFT, hop=HOP, altura=AREA_H, largura=AREA_W, pooling=POOLING):
+        if pooling not in ('max', 'mean'):
+            raise ValueError(f'pooling inválido: {pooling}')
+        self.sr = sr
+        self.hop = hop
+        bins = n_fft // 2 + 1
+        self._bordas = np.unique(np.linspace(0, bins, altura + 1).astype(int)[:-1])
+        self._decimador = Decimador(largura, len(self._bordas), pooling)
+
+    @property
+    def quadros(self):
+        return self._decimador.linhas
+
+    def consumir(self, mag):
+        self._decimador.consumir(np.maximum.reduceat(mag, self._bordas, axis=1))
+
+    def matriz_db(self):
+        """Matriz (freq x tempo) em dB relativos ao pico, limitada a -TOP_DB."""
+        colunas = self._decimador.colunas()
+        if not len(colunas):
+            return None
+        mag = colunas.T
+        ref = max(float(mag.max()), 1e-10)
+        db = 20 * np.log10(np.maximum(mag, 1e-10) / ref)
+        return np.maximum(db, -TOP_DB)
+
+    @property
+    def duracao(self):
+        return self.quadros * self.hop / self.sr
+
+
+class DetectorDeCorte:
+    """Detecta o "shelf" de encoders lossy (fake 320/FLAC) a partir das mesmas magnitudes da STFT.
+
+    Estado: só a soma da potência por bin (vetorizada sobre todos os quadros de cada bloco).
+    """
+
+    def __init__(self, sr, n_fft=N_FFT):
+        self.sr = sr
+        self.hz_por_bin = sr / n_fft
+        self._potencia = np.zeros(n_fft // 2 + 1, dtype=np.float64)
+        self._quadros = 0
+
+    def consumir(self, mag):
+        self._potencia += np.einsum('ij,ij->j', mag, mag, dtype=np.float64)
+        self._quadros += len(mag)
+
+    def resultado(self):
+        if not self._quadros:
+            return None
+        nyquist = self.sr / 2
+        db = 10 * np.log10(self._potencia / self._quadros + 1e-20)
+        db = np.convolve(db, np.ones(5) / 5, mode='same')
+
+        # Queda (dB) entre a janela logo abaixo e logo acima de cada bin, via somas acumuladas
+        w = max(int(JANELA_SHELF_HZ / self.hz_por_bin), 2)
+        acumulado = np.concatenate([[0.0], np.cumsum(db)])
+        k = np.arange(w, len(db) - w)
+        queda = (acumulado[k] - acumulado[k - w]) / w - (acumulado[k + w] - acumulado[k]) / w
+        busca = k >= int(CORTE_MINIMO_HZ / self.hz_por_bin)
+
+        corte_hz, shelf_db = nyquist, 0.0
+        if busca.any():
+            i = int(np.argmax(np.where(busca, queda, -np.inf)))
+            if queda[i] >= SHELF_MINIMO_DB:
+                corte_hz, shelf_db = k[i] * self.hz_por_bin, float(queda[i])
+
+        # Conteúdo estreito (tons puros, silêncio) não permite estimar nada
+        conteudo = np.nonzero(db > db.max() - 60)[0]
+        banda_util = conteudo[-1] * self.hz_por_bin if len(conteudo) else 0
+        if banda_util < CORTE_MINIMO_HZ:
+            bitrate = 'indeterminado'
+        else:
+            bitrate = next((classe for limite, classe in CLASSES_BITRATE if corte_hz >= limite), '<128')
+            if corte_hz >= nyquist * 0.97:
+                bitrate = 'lossless'
+
+        return {
+            'cutoff_hz': int(round(corte_hz)),
+            'shelf_db': round(shelf_db, 1),
+            'shelf_score': round(float(np.clip((shelf_db - SHELF_MINIMO_DB) / 30, 0, 1)), 2),
+            'bitrate_estimado': bitrate,
+            'sample_rate': self.sr,
+        }
+
+
+ORDEM_CLASSES = ['<128'] + [classe for _, classe in reversed(CLASSES_BITRATE)] + ['lossless']
+
+
+def classe_do_bitrate(kbps):
+    """Classe de CLASSES_BITRATE que um MP3 de `kbps` deveria atingir (160 -> '128')."""
+    return next((classe for classe in reversed(ORDEM_CLASSES[1:-1]) if kbps >= int(classe)), '<128')
+
+
+def veredito(analise, formato, kbps_origem=None):
+    """Compara a análise com o formato entregue.
+
+    Retorna 'ok', 'fake_lossless', 'fake_320', 'indeterminado' ou, quando um MP3 abaixo
+    de 320 foi entregue sem reencode (`kbps_origem`), 'original' (espectro condiz com a
+    taxa real) ou 'fake_bitrate' (nem a taxa declarada ele tem).
+    """
+    if not analise or analise['bitrate_estimado'] == 'indeterminado':
+        return 'indeterminado'
+    classe = analise['bitrate_estimado']
+    if formato in FORMATOS_LOSSLESS and classe != 'lossless':
+        return 'fake_lossless'
+    if formato == 'mp3':
+        alvo = classe_do_bitrate(kbps_origem) if kbps_origem else '320'
+        if ORDEM_CLASSES.index(classe) < ORDEM_CLASSES.index(alvo):
+            return 'fake_320' if alvo == '320' else 'fake_bitrate'
+        if alvo != '320':
+            return 'original'
+    return 'ok'
+
+
+def _fonte(tamanho):
+    try:
+        return ImageFont.load_default(size=tamanho)
+    except TypeError:  # Pillow antigo sem fontes escaláveis
+        return ImageFont.load_default()
+
+
+def _passo_tempo(duracao):
+    for passo in (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800):
+        if duracao / passo <= 8:
+            return passo
+    return 3600
+
+
+def renderizar_png(db, sr, duracao, titulo, destino):
+    """Desenha o PNG direto do array colorizado (sem pyplot)."""
+    indices = ((db + TOP_DB) / TOP_DB * 255).clip(0, 255).astype(np.uint8)
+    area = Image.fromarray(LUT[indices[::-1]], 'RGB').resize((AREA_W, AREA_H), Image.BILINEAR)
+
+    img = Image.new('RGB', (LARGURA, ALTURA), FUNDO)
+    img.paste(area, (MARGEM_ESQ, MARGEM_TOPO))
+    draw = ImageDraw.Draw(img)
+    fonte, fonte_titulo = _fonte(10), _fonte(12)
+    base = MARGEM_TOPO + AREA_H
+
+    draw.text((LARGURA / 2, MARGEM_TOPO / 2), f'{titulo[:40]}...', fill=TEXTO, font=fonte_titulo, anchor='mm')
+
+    # Eixo de frequência (Hz)
+    nyquist = sr / 2
+    passo_hz = 2000 if nyquist <= 12000 else 4000
+    for hz in range(0, int(nyquist) + 1, passo_hz):
+        y = base - hz / nyquist * AREA_H
+        draw.line([(MARGEM_ESQ - 4, y), (MARGEM_ESQ, y)], fill=TEXTO)
+        draw.text((MARGEM_ESQ - 7, y), f'{hz // 1000}k' if hz else '0', fill=TEXTO, font=fonte, anchor='rm')
+    draw.text((12, MARGEM_TOPO + AREA_H / 2), 'Hz', fill=TEXTO, font=fonte, anchor='mm')
+
+    # Eixo de tempo (m:ss)
+    if duracao > 0:
+        passo = _passo_tempo(duracao)
+        for seg in range(0, int(duracao) + 1, passo):
+            x = MARGEM_ESQ + seg / duracao * AREA_W
+            draw.line([(x, base), (x, base + 4)], fill=TEXTO)
+            draw.text((x, base + 7), f'{seg // 60}:{seg % 60:02d}', fill=TEXTO, font=fonte, anchor='mt')
+
+    # Barra de cores (dB)
+    cx = LARGURA - MARGEM_DIR + 14
+    barra = np.linspace(255, 0, AREA_H).astype(np.uint8)
+    img.paste(Image.fromarray(np.repeat(LUT[barra][:, None, :], 12, axis=1), 'RGB'), (cx, MARGEM_TOPO))
+    for nivel in range(0, -int(TOP_DB) - 1, -20):
+        y = MARGEM_TOPO + (-nivel / TOP_DB) * (AREA_H - 1)
+        draw.line([(cx + 12, y), (cx + 16, y)], fill=TEXTO)
+        draw.text((cx + 19, y), f'{nivel:+d} dB', fill=TEXTO, font=fonte, anchor='lm')
+
+    img.save(destino, format='PNG', optimize=False)
+
+
+def analisar_arquivo(audio_path, ffmpeg='ffmpeg', duracao=DURACAO):
+    """Só a detecção de transcode (sem PNG), para auditoria em lote."""
+    sr = taxa_amostragem(audio_path)
+    detector = DetectorDeCorte(sr)
+    for mag in magnitudes_stft(ler_pcm(audio_path, sr, ffmpeg=ffmpeg, duracao=duracao)):
+        detector.consumir(mag)
+    analise = detector.resultado()
+    if analise:
+        analise['veredito'] = veredito(analise, os.path.splitext(audio_path)[1].lower().lstrip('.'))
+    return analise
+
+
+def auditar_pasta(pasta, ffmpeg='ffmpeg', workers=os.cpu_count()):
+    """Audita recursivamente uma biblioteca existente, gerando (caminho, análise) conforme termina."""
+    arquivos = [os.path.join(raiz, nome) for raiz, _, nomes in os.walk(pasta) for nome in sorted(nomes)
+                if os.path.splitext(nome)[1].lower() in EXTENSOES_AUDIO]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analisar_arquivo, caminho, ffmpeg): caminho for caminho in arquivos}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                yield futures[future], {'erro': str(e)}
+
+
+if __name__ == '__main__':
+    # Uso: python spek.py /caminho/da/biblioteca  (uma linha JSON por arquivo)
+    import sys
+    import json
+    import shutil
+    if len(sys.argv) != 2:
+        sys.exit('Uso: python spek.py <pasta>')
+    for caminho, analise in auditar_pasta(sys.argv[1], ffmpeg=shutil.which('ffmpeg') or 'ffmpeg'):
+        print(json.dumps({'arquivo': caminho, **(analise or {})}, ensure_ascii=False), flush=True)
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask_login import UserMixin
+from sqlalchemy import update
+
+from models import db, User
+
+# ===================================
+# USUÁRIO LOGADO EM CACHE (TTL) + EXPIRAÇÃO DE ASSINATURAS
+# ===================================
+USUARIO_TTL = float(os.getenv('VIBE_USUARIO_TTL', '60'))  # segundos
+USUARIO_CACHE_MAX = int(os.getenv('VIBE_USUARIO_CACHE_MAX', '10000'))
+EXPIRACAO_INTERVALO = float(os.getenv('VIBE_EXPIRACAO_INTERVALO', '300'))  # segundos entre varreduras
+
+
+def assinatura_vigente(usuario, agora=None):
+    """Assinante e dentro do prazo. Não escreve nada: quem baixa o flag é a varredura."""
+    if not usuario.is_subscriber:
+        return False
+    expira = usuario.subscription_expires
+    return expira is None or expira >= (agora or datetime.utcnow())
+
+
+class UsuarioEmCache(UserMixin):
+    """Retrato das colunas do User que as páginas usam; é o `current_user` das requisições.
+
+    Não é objeto do SQLAlchemy: é compartilhado entre threads e não carrega nada
+    sob demanda. Para alterar o usuário, busque o User com `db.session.get` e
+    chame `CacheDeUsuarios.invalidar` depois do commit.
+    """
+
+    CAMPOS = ('id', 'email', 'dj_name', 'credits', 'is_subscriber', 'subscription_expires',
+              'referral_code', 'referred_by')
+
+    def __init__(self, user):
+        for campo in self.CAMPOS:
+            setattr(self, campo, getattr(user, campo))
+
+    def __setattr__(self, nome, valor):
+        if nome in self.__dict__:
+            raise AttributeError(f'UsuarioEmCache é só leitura ({nome}); altere o User e invalide o cache')
+        super().__setattr__(nome, valor)
+
+
+class CacheDeUsuarios:
+    """user_id -> UsuarioEmCache por até `ttl` segundos.
+
+    Vale para um processo (o Gunicorn roda um worker): pagamento, cupom e expiração
+    invalidam a entrada no mesmo processo; o TTL limita quanto um dado alterado por
+    fora (outro processo, edição manual no banco) fica velho.
+    """
+
+    def __init__(self, ttl=USUARIO_TTL, max_entradas=USUARIO_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.hits = 0
+        self.misses = 0
+        self._entradas = {}
+        self._lock = threading.Lock()
+
+    def obter(self, user_id):
+        agora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(user_id)
+            if entrada and entrada[0] > agora:
+                self.hits += 1
+                return entrada[1]
+            self.misses += 1
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        retrato = UsuarioEmCache(user)
+        with self._lock:
+            if len(self._entradas) >= self.max_entradas:
+                self._podar(agora)
+            self._entradas[user_id] = (agora + self.ttl, retrato)
+        return retrato
+
+    def invalidar(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entradas.pop(user_id, None)
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
+
+    def _podar(self, agora):
+        # Chamado com o lock: tira as vencidas; se não bastar, as mais antigas
+        for user_id in [u for u, (expira, _) in self._entradas.items() if expira <= agora]:
+            del self._entradas[user_id]
+        excesso = len(self._entradas) - self.max_entradas + 1
+        if excesso > 0:
+            for user_id in sorted(self._entradas, key=lambda u: self._entradas[u][0])[:excesso]:
+                del self._entradas[user_id]
+
+    def stats(self):
+        with self._lock:
+            return {'entradas': len(self._entradas), 'hits': self.hits, 'misses': self.misses}
+
+
+def expirar_assinaturas(agora=None):
+    """Baixa is_subscriber de quem venceu, num UPDATE só. Retorna os ids alterados."""
+    agora = agora or datetime.utcnow()
+    resultado = db.session.execute(
+        update(User)
+        .where(User.is_subscriber == True, User.subscription_expires < agora)
+        .values(is_subscriber=False)
+        .returning(User.id)
+        .execution_options(synchronize_session=False))
+    ids = [linha[0] for linha in resultado]
+    db.session.commit()
+    return ids
+
+
+class VarredorDeAssinaturas:
+    """Thread que roda `expirar_assinaturas` a cada `intervalo` e invalida o cache."""
+
+    def __init__(self, app, cache, intervalo=EXPIRACAO_INTERVALO):
+        self.app = app
+        self.cache = cache
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._thread = None
+
+    def varrer(self):
+        with self.app.app_context():
+            ids = expirar_assinaturas()
+        if ids:
+            self.cache.invalidar(*ids)
+        return ids
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._loop, name='vibe-assinaturas', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                self.varrer()
+            except Exception as e:
+                print(f"Erro varredura de assinaturas: {e}")
+            self._parar.wait(self.intervalo)
@@ -0,0 +1,180 @@
+import os
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from sqlalchemy import insert, update
+
+from models import db, WebhookEvent
+
+# ===================================
+# WEBHOOKS DO MERCADO PAGO (INBOX + WORKER)
+# ===================================
+WEBHOOK_LOTE = int(os.getenv('VIBE_WEBHOOK_LOTE', '100'))
+WEBHOOK_INTERVALO = float(os.getenv('VIBE_WEBHOOK_INTERVALO', '5'))  # segundos entre varreduras sem aviso
+WEBHOOK_CONEXOES = int(os.getenv('VIBE_WEBHOOK_CONEXOES', '4'))  # consultas simultâneas à API do MP
+WEBHOOK_MAX_TENTATIVAS = int(os.getenv('VIBE_WEBHOOK_MAX_TENTATIVAS', '5'))
+
+MP_API_URL = 'https://api.mercadopago.com'
+
+
+class ClienteHttpMP:
+    """http_client do SDK com Session reaproveitada (keep-alive) e URL base trocável.
+
+    Mesma interface do HttpClient do SDK (request/get/post/put/delete), sem importá-lo:
+    o mercadopago só é carregado quando o primeiro pagamento é criado. O SDK só aceita
+    subclasses do HttpClient: passe `cliente_sdk()`, não a classe direto. O cliente padrão
+    abre uma Session nova por chamada. `base_url` aponta o SDK para outro servidor
+    (ex.: o falso em bench/fake_mercadopago.py).
+    """
+
+    def __init__(self, base_url=None, tentativas=3):
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self._session = requests.Session()
+        adaptador = HTTPAdapter(pool_maxsize=WEBHOOK_CONEXOES * 2, max_retries=Retry(
+            total=tentativas, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]))
+        self._session.mount('https://', adaptador)
+        self._session.mount('http://', adaptador)
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        if self.base_url and url.startswith(MP_API_URL):
+            url = self.base_url + url[len(MP_API_URL):]
+        api_result = self._session.request(method, url, **kwargs)
+        response = {"status": api_result.status_code, "response": None}
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response["response"] = api_result.json()
+            except ValueError as e:
+                print(f"Erro MP (JSON inválido): {e}")
+        return response
+
+    def get(self, url, headers, params=None, timeout=None, maxretries=None):
+        return self.request('GET', url=url, headers=headers, params=params, timeout=timeout, maxretries=maxretries)
+
+    def post(self, url, headers, data=None, params=None, timeout=None, maxretries=None):
+        return self.request('POST', url=url, headers=headers, data=data, params=params, timeout=timeout, maxretries=maxretries)
+
+    def put(self, url, headers, data=None, params=None, timeout=None, maxretries=None):
+        return self.request('PUT', url=url, headers=headers, data=data, params=params, timeout=timeout, maxretries=maxretries)
+
+    def delete(self, url, headers, params=None, timeout=None, maxretries=None):
+        return self.request('DELETE', url=url, headers=headers, params=params, timeout=timeout, maxretries=maxretries)
+
+
+def cliente_sdk(base_url=None):
+    """ClienteHttpMP que passa no isinstance(HttpClient) do SDK. Importa o mercadopago."""
+    from mercadopago.http import HttpClient
+    return type('ClienteHttpSDK', (ClienteHttpMP, HttpClient), {})(base_url)
+
+
+def registrar_evento(payment_id, action=None):
+    """Grava a notificação na inbox e confirma. Retorna False se já havia uma pendente."""
+    resultado = db.session.execute(insert(WebhookEvent).prefix_with('OR IGNORE').values(
+        payment_id=str(payment_id), action=action, status='pending', attempts=0,
+        received_at=datetime.utcnow()))
+    db.session.commit()
+    return resultado.rowcount == 1
+
+
+class ProcessadorDeWebhooks:
+    """Consome a inbox em segundo plano: um GET no MP por pagamento e um commit por lote.
+
+    - buscar(payment_id) -> dados do pagamento no MP (levanta exceção em falha);
+    - aplicar(dados) -> Payment alterado ou None; precisa ser idempotente;
+    - ao_confirmar([Payment]) roda depois do commit (ex.: avisar o usuário).
+    """
+
+    def __init__(self, app, buscar, aplicar, ao_confirmar=None, lote=WEBHOOK_LOTE,
+                 intervalo=WEBHOOK_INTERVALO, conexoes=WEBHOOK_CONEXOES, max_tentativas=WEBHOOK_MAX_TENTATIVAS):
+        self.app = app
+        self.buscar = buscar
+        self.aplicar = aplicar
+        self.ao_confirmar = ao_confirmar
+        self.lote = lote
+        self.intervalo = intervalo
+        self.max_tentativas = max_tentativas
+        self._executor = ThreadPoolExecutor(max_workers=conexoes, thread_name_prefix='vibe-mp')
+        self._acordar = threading.Event()
+        self._thread = None
+
+    def avisar(self):
+        """Chamado pelo endpoint do webhook: processa já, sem esperar o intervalo."""
+        self._acordar.set()
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        with self.app.app_context():
+            # Lote interrompido por um restart volta para a fila
+            db.session.execute(update(WebhookEvent).where(WebhookEvent.status == 'processing').values(status='retry'))
+            db.session.commit()
+        self._thread = threading.Thread(target=self._loop, name='vibe-webhooks', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            try:
+                # Lote cheio: provavelmente há mais eventos, segue sem esperar
+                while self.processar_pendentes() >= self.lote:
+                    pass
+            except Exception as e:
+                print(f"Erro worker webhooks: {e}")
+
+    def _buscar_seguro(self, payment_id):
+        try:
+            return self.buscar(payment_id), None
+        except Exception as e:
+            return None, e
+
+    def processar_pendentes(self):
+        """Processa um lote da inbox. Retorna quantos eventos foram consumidos."""
+        with self.app.app_context():
+            eventos = (WebhookEvent.query.filter(WebhookEvent.status.in_(('pending', 'retry')))
+                       .order_by(WebhookEvent.id).limit(self.lote).all())
+            if not eventos:
+                return 0
+            # Reivindica o lote: notificações novas do mesmo pagamento entram como
+            # outro evento pendente em vez de serem descartadas pelo índice único
+            for evento in eventos:
+                evento.status = 'processing'
+            db.session.commit()
+
+            por_pagamento = {}
+            for evento in eventos:
+                por_pagamento.setdefault(evento.payment_id, []).append(evento)
+            # Rede fora de qualquer escrita no banco, com algumas consultas em paralelo
+            ids = list(por_pagamento)
+            respostas = dict(zip(ids, self._executor.map(self._buscar_seguro, ids)))
+
+            alterados = []
+            agora = datetime.utcnow()
+            for payment_id, grupo in por_pagamento.items():
+                dados, erro = respostas[payment_id]
+                if erro is None:
+                    try:
+                        pagamento = self.aplicar(dados)
+                        if pagamento is not None: alterados.append(pagamento)
+                    except Exception as e:
+                        erro = e
+                for evento in grupo:
+                    if erro is None:
+                        evento.status = 'done'
+                        evento.processed_at = agora
+                    else:
+                        evento.attempts = (evento.attempts or 0) + 1
+                        evento.last_error = str(erro)[:500]
+                        # 'retry' e não 'pending': não disputa o índice único com notificações novas
+                        evento.status = 'error' if evento.attempts >= self.max_tentativas else 'retry'
+            db.session.commit()
+
+            if self.ao_confirmar and alterados:
+                try:
+                    self.ao_confirmar(alterados)
+                except Exception as e:
+                    print(f"Erro ao notificar pagamentos: {e}")
+            return len(eventos)
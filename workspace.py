@@ -0,0 +1,174 @@
+import os
+import glob
+import shutil
+import threading
+import time
+import uuid
+
+# ===================================
+# WORKSPACES POR USUÁRIO/JOB (COM VARREDOR TTL + COTA)
+# ===================================
+WORKSPACE_TTL = int(os.getenv('VIBE_WORKSPACE_TTL', '7200'))  # segundos sem uso até a remoção
+WORKSPACE_MAX_MB = int(os.getenv('VIBE_WORKSPACE_MAX_MB', '10240'))
+WORKSPACE_INTERVALO = int(os.getenv('VIBE_WORKSPACE_INTERVALO', '300'))
+
+
+class Arrendamento:
+    """Marca um workspace como em uso (download ou edição) até `liberar()`."""
+
+    def __init__(self, workspaces, chave):
+        self._workspaces = workspaces
+        self._chave = chave
+        self._ativo = True
+
+    def liberar(self):
+        if self._ativo:
+            self._ativo = False
+            self._workspaces._devolver(self._chave)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberar()
+
+
+class Workspaces:
+    """Cada job tem `<downloads>/<user_id>/<job_id>/` e `<spek>/<user_id>/<job_id>/`.
+
+    Nada é apagado na hora da requisição: um varredor em segundo plano remove os
+    workspaces sem uso há mais de `ttl` e, acima da cota, os menos usados primeiro.
+    Workspaces de jobs ativos (`ativo(job_id)`) ou arrendados nunca são removidos.
+    """
+
+    def __init__(self, raiz, raiz_spek, ttl=WORKSPACE_TTL, max_bytes=WORKSPACE_MAX_MB * 1024 * 1024,
+                 intervalo=WORKSPACE_INTERVALO, ativo=None):
+        self.raiz = raiz
+        self.raiz_spek = raiz_spek
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.intervalo = intervalo
+        self.ativo = ativo or (lambda job_id: False)
+        self._arrendados = {}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        os.makedirs(self.raiz, exist_ok=True)
+        os.makedirs(self.raiz_spek, exist_ok=True)
+
+    # --- caminhos ---
+    def pasta(self, user_id, job_id):
+        pasta = os.path.join(self.raiz, str(user_id), job_id)
+        os.makedirs(pasta, exist_ok=True)
+        return pasta
+
+    def novo_spek(self, user_id, job_id):
+        """Retorna (nome relativo à raiz do spek, caminho) de um PNG novo, sem colisão."""
+        pasta = os.path.join(self.raiz_spek, str(user_id), job_id)
+        os.makedirs(pasta, exist_ok=True)
+        nome = f'{uuid.uuid4().hex}.png'
+        return f'{user_id}/{job_id}/{nome}', os.path.join(pasta, nome)
+
+    # --- uso ---
+    def tocar(self, user_id, job_id):
+        """Marca o último acesso (o TTL conta a partir daqui)."""
+        try: os.utime(os.path.join(self.raiz, str(user_id), job_id))
+        except OSError: pass
+
+    def arrendar(self, user_id, job_id):
+        chave = (str(user_id), job_id)
+        with self._lock:
+            self._arrendados[chave] = self._arrendados.get(chave, 0) + 1
+        self.tocar(user_id, job_id)
+        return Arrendamento(self, chave)
+
+    def _devolver(self, chave):
+        with self._lock:
+            restantes = self._arrendados.get(chave, 0) - 1
+            if restantes > 0: self._arrendados[chave] = restantes
+            else: self._arrendados.pop(chave, None)
+        self.tocar(*chave)
+
+    # --- varredura ---
+    def _workspaces(self):
+        """{(user_id, job_id): [pastas]} das duas raízes."""
+        encontrados = {}
+        for raiz in (self.raiz, self.raiz_spek):
+            for user_id in os.listdir(raiz):
+                base = os.path.join(raiz, user_id)
+                if not os.path.isdir(base): continue
+                for job_id in os.listdir(base):
+                    encontrados.setdefault((user_id, job_id), []).append(os.path.join(base, job_id))
+        return encontrados
+
+    @staticmethod
+    def _tamanho(pasta):
+        total = 0
+        for base, _, arquivos in os.walk(pasta):
+            for nome in arquivos:
+                try: total += os.path.getsize(os.path.join(base, nome))
+                except OSError: pass
+        return total
+
+    def _remover(self, chave, pastas):
+        """Remove o workspace se ninguém o estiver usando. Retorna True se removeu."""
+        with self._lock:
+            if chave in self._arrendados or self.ativo(chave[1]):
+                return False
+            for pasta in pastas:
+                shutil.rmtree(pasta, ignore_errors=True)
+        for raiz in (self.raiz, self.raiz_spek):
+            try: os.rmdir(os.path.join(raiz, chave[0]))  # só some se o usuário ficou sem jobs
+            except OSError: pass
+        return True
+
+    def varrer(self):
+        """Uma passada: remove vencidos e, se passar da cota, os menos usados. Retorna bytes liberados."""
+        agora = time.time()
+        entradas = []
+        for chave, pastas in self._workspaces().items():
+            try: acesso = max(os.path.getmtime(p) for p in pastas)
+            except (OSError, ValueError): acesso = 0
+            entradas.append((acesso, chave, pastas, sum(self._tamanho(p) for p in pastas)))
+        entradas.sort()
+        total = sum(e[3] for e in entradas)
+        liberados = 0
+        for acesso, chave, pastas, tamanho in entradas:
+            if agora - acesso <= self.ttl and total <= self.max_bytes:
+                continue
+            if self._remover(chave, pastas):
+                total -= tamanho
+                liberados += tamanho
+        liberados += self._varrer_legados(agora)
+        return liberados
+
+    def _varrer_legados(self, agora):
+        """Arquivos soltos do layout antigo (downloads/*.mp3, static/spec_*.png)."""
+        liberados = 0
+        soltos = [os.path.join(self.raiz, n) for n in os.listdir(self.raiz)]
+        soltos += glob.glob(os.path.join(os.path.dirname(self.raiz_spek), 'spec_*.png'))
+        for caminho in soltos:
+            try:
+                if os.path.isfile(caminho) and agora - os.path.getmtime(caminho) > self.ttl:
+                    liberados += os.path.getsize(caminho)
+                    os.unlink(caminho)
+            except OSError:
+                pass
+        return liberados
+
+    def iniciar(self):
+        """Sobe o varredor em uma thread daemon (idempotente)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name='vibe-varredor', daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.varrer()
+            except Exception as e:
+                print(f"Erro varredor: {e}")
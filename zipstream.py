@@ -0,0 +1,256 @@
+import os
+import struct
+import threading
+import time
+import zlib
+import hashlib
+from collections import OrderedDict
+
+# ===================================
+# ZIP EM STREAMING (ENTRADAS STORED, ZIP64)
+# ===================================
+# MP3/FLAC já são comprimidos: deflate gasta CPU sem ganho. Com entradas "stored"
+# o tamanho final do arquivo é conhecido antes de ler um byte, o que permite
+# mandar Content-Length e começar a enviar na hora, sem .zip temporário em disco.
+BLOCO = 1024 * 1024
+LIMITE_32 = 0xFFFFFFFF
+LIMITE_16 = 0xFFFF
+
+FLAG_DESCRITOR = 0x0008  # CRC/tamanhos vêm no data descriptor, depois dos dados
+FLAG_UTF8 = 0x0800
+VERSAO = 20
+VERSAO_ZIP64 = 45
+
+# CRC32 já calculados, por (caminho, tamanho, mtime_ns): permitem atender Range
+# no meio do pacote sem reler as faixas anteriores
+CRCS_MAX = 4096
+_crcs = OrderedDict()
+_crcs_lock = threading.Lock()
+
+
+def _crc_conhecido(chave):
+    with _crcs_lock:
+        crc = _crcs.get(chave)
+        if crc is not None: _crcs.move_to_end(chave)
+        return crc
+
+
+def _guardar_crc(chave, crc):
+    with _crcs_lock:
+        _crcs[chave] = crc
+        _crcs.move_to_end(chave)
+        while len(_crcs) > CRCS_MAX: _crcs.popitem(last=False)
+
+
+class ArquivoAlterado(Exception):
+    """O arquivo mudou de tamanho entre o cálculo do Content-Length e o envio."""
+
+
+def _data_dos(mtime):
+    t = time.localtime(mtime)
+    ano = min(max(t.tm_year, 1980), 2107)
+    data = ((ano - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    hora = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return hora, data
+
+
+class Entrada:
+    def __init__(self, caminho, nome):
+        self.caminho = caminho
+        self.nome = nome.encode('utf-8')
+        st = os.stat(caminho)
+        self.tamanho = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.hora, self.data = _data_dos(st.st_mtime)
+        self.zip64 = self.tamanho >= LIMITE_32
+        self.offset = 0
+        self.crc = _crc_conhecido(self.chave_crc)
+
+    @property
+    def chave_crc(self):
+        return (self.caminho, self.tamanho, self.mtime_ns)
+
+    def garantir_crc(self):
+        """Lê o arquivo inteiro só se o CRC ainda não for conhecido."""
+        if self.crc is None:
+            crc = 0
+            for bloco in self.ler(0, self.tamanho):
+                crc = zlib.crc32(bloco, crc)
+            self.crc = crc
+            _guardar_crc(self.chave_crc, crc)
+        return self.crc
+
+    def ler(self, inicio, fim):
+        """Bytes [inicio, fim) do arquivo, em blocos."""
+        lidos = 0
+        with open(self.caminho, 'rb') as f:
+            f.seek(inicio)
+            while inicio + lidos < fim:
+                bloco = f.read(min(BLOCO, fim - inicio - lidos))
+                if not bloco: break
+                lidos += len(bloco)
+                yield bloco
+        if inicio + lidos != fim:
+            # Content-Length já foi enviado: melhor abortar do que entregar um zip torto
+            raise ArquivoAlterado(self.caminho)
+
+    @property
+    def versao(self):
+        return VERSAO_ZIP64 if self.zip64 or self.offset >= LIMITE_32 else VERSAO
+
+    # --- tamanhos (usados para o Content-Length) ---
+    def tamanho_local(self):
+        extra = 20 if self.zip64 else 0
+        return 30 + len(self.nome) + extra + self.tamanho + self.tamanho_descritor()
+
+    def _extra_central(self):
+        campos = []
+        if self.zip64:
+            campos += [self.tamanho, self.tamanho]
+        if self.offset >= LIMITE_32:
+            campos.append(self.offset)
+        if not campos:
+            return b''
+        return struct.pack(f'<HH{len(campos)}Q', 0x0001, 8 * len(campos), *campos)
+
+    def tamanho_central(self):
+        return 46 + len(self.nome) + len(self._extra_central())
+
+    # --- cabeçalhos ---
+    def cabecalho_local(self):
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            tam = LIMITE_32
+        else:
+            extra, tam = b'', 0
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, self.versao, FLAG_DESCRITOR | FLAG_UTF8, 0,
+            self.hora, self.data, 0, tam, tam, len(self.nome), len(extra),
+        ) + self.nome + extra
+
+    def tamanho_descritor(self):
+        return 24 if self.zip64 else 16
+
+    def descritor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.tamanho, self.tamanho)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.tamanho, self.tamanho)
+
+    def cabecalho_central(self):
+        extra = self._extra_central()
+        tam = LIMITE_32 if self.zip64 else self.tamanho
+        offset = min(self.offset, LIMITE_32)
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | self.versao, self.versao,
+            FLAG_DESCRITOR | FLAG_UTF8, 0, self.hora, self.data, self.crc, tam, tam,
+            len(self.nome), len(extra), 0, 0, 0, 0o100644 << 16, offset,
+        ) + self.nome + extra
+
+
+class ZipEmStreaming:
+    """Monta um .zip "stored" sob demanda a partir de uma lista de arquivos.
+
+    `tamanho` já é o tamanho exato do arquivo final; iterar o objeto gera os bytes
+    (ou só o trecho escolhido com `selecionar_intervalo`). O resultado é determinístico
+    para os mesmos arquivos, então `etag` identifica o pacote entre requisições.
+    Nomes repetidos ganham sufixo " (2)", " (3)"... `ao_fechar` é chamado quando o
+    servidor WSGI fecha a resposta (fim do envio ou cliente desconectado).
+    """
+
+    def __init__(self, caminhos, ao_fechar=None):
+        self.ao_fechar = ao_fechar
+        self.inicio, self.fim = 0, None
+        self.enviados = 0  # bytes já entregues ao servidor (menos que o trecho se o cliente abortar)
+        self.entradas = []
+        usados = set()
+        offset = 0
+        for caminho in caminhos:
+            entrada = Entrada(caminho, self._nome_unico(os.path.basename(caminho), usados))
+            entrada.offset = offset
+            offset += entrada.tamanho_local()
+            self.entradas.append(entrada)
+        self.inicio_central = offset
+        self.tamanho_central = sum(e.tamanho_central() for e in self.entradas)
+        self.tamanho = offset + self.tamanho_central + len(self._fim())
+        self.fim = self.tamanho
+
+    @property
+    def etag(self):
+        assinatura = repr([(e.nome, e.tamanho, e.mtime_ns) for e in self.entradas])
+        return hashlib.sha1(assinatura.encode('utf-8')).hexdigest()
+
+    def selecionar_intervalo(self, inicio, fim):
+        """Restringe a iteração aos bytes [inicio, fim) do pacote (requisições Range)."""
+        self.inicio, self.fim = inicio, fim
+
+    @staticmethod
+    def _nome_unico(nome, usados):
+        base, ext = os.path.splitext(nome)
+        candidato, n = nome, 1
+        while candidato.lower() in usados:
+            n += 1
+            candidato = f'{base} ({n}){ext}'
+        usados.add(candidato.lower())
+        return candidato
+
+    def _fim(self):
+        qtd, tam, inicio = len(self.entradas), self.tamanho_central, self.inicio_central
+        fim = b''
+        if qtd >= LIMITE_16 or tam >= LIMITE_32 or inicio >= LIMITE_32:
+            fim_zip64 = inicio + tam
+            fim += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | VERSAO_ZIP64, VERSAO_ZIP64,
+                               0, 0, qtd, qtd, tam, inicio)
+            fim += struct.pack('<IIQI', 0x07064b50, 0, fim_zip64, 1)
+        fim += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(qtd, LIMITE_16), min(qtd, LIMITE_16),
+                           min(tam, LIMITE_32), min(inicio, LIMITE_32), 0)
+        return fim
+
+    def __iter__(self):
+        for parte in self._partes():
+            self.enviados += len(parte)
+            yield parte
+
+    def _partes(self):
+        inicio, fim = self.inicio, self.fim
+        pos = 0
+
+        def recorte(dados):
+            # Parte de `dados` (que começa em `pos`) dentro de [inicio, fim)
+            return dados[max(inicio - pos, 0):max(fim - pos, 0)]
+
+        for entrada in self.entradas:
+            if pos >= fim: return
+            if pos + entrada.tamanho_local() <= inicio:
+                pos += entrada.tamanho_local()
+                continue
+            cabecalho = entrada.cabecalho_local()
+            if recorte(cabecalho): yield recorte(cabecalho)
+            pos += len(cabecalho)
+
+            de, ate = max(inicio - pos, 0), min(fim - pos, entrada.tamanho)
+            if de == 0 and ate == entrada.tamanho and entrada.crc is None:
+                # Arquivo inteiro no trecho: calcula o CRC enquanto envia
+                crc = 0
+                for bloco in entrada.ler(0, entrada.tamanho):
+                    crc = zlib.crc32(bloco, crc)
+                    yield bloco
+                entrada.crc = crc
+                _guardar_crc(entrada.chave_crc, crc)
+            elif de < ate:
+                yield from entrada.ler(de, ate)
+            pos += entrada.tamanho
+
+            if pos < fim and pos + entrada.tamanho_descritor() > inicio:
+                entrada.garantir_crc()
+                yield recorte(entrada.descritor())
+            pos += entrada.tamanho_descritor()
+
+        if pos < fim:
+            for entrada in self.entradas: entrada.garantir_crc()
+            final = b''.join(e.cabecalho_central() for e in self.entradas) + self._fim()
+            yield recorte(final)
+
+    def close(self):
+        if self.ao_fechar:
+            callback, self.ao_fechar = self.ao_fechar, None
+            callback()